@@ -0,0 +1,182 @@
+"""
+Admission control and cancellation for warehouse queries.
+
+warehouse_admission caps how many queries run against the warehouse at once across every
+Streamlit session in the process; the rest wait in FIFO order for up to a queue timeout,
+and new queries are turned away when the queue is full, so a peak-hour pile-up queues
+instead of saturating the server.
+
+A QueryHandle follows one query: it reports its place in the queue while waiting, and
+cancel() stops it from another thread, either before it is admitted or on the server
+through cursor.cancel() while it runs.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from tracing import annotate, span
+
+MAX_CONCURRENT_QUERIES = int(os.getenv("WAREHOUSE_MAX_CONCURRENT_QUERIES", "3"))
+MAX_QUEUED_QUERIES = int(os.getenv("WAREHOUSE_MAX_QUEUED_QUERIES", "20"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("WAREHOUSE_QUEUE_TIMEOUT_SECONDS", "60"))
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class WarehouseBusy(Exception):
+    pass
+
+
+class QueryHandle:
+    """Cancellation and queue position of one warehouse query, shared between threads."""
+
+    def __init__(self):
+        self.cancelled = False
+        # Place in the admission queue (1 = next), or None when not waiting
+        self.queue_position = None
+        self._cursor = None
+        self._lock = threading.Lock()
+        self._on_cancel = []
+
+    def cancel(self):
+        """Stop the query: it will not be admitted, and a running statement is cancelled on the server."""
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            cursor, callbacks = self._cursor, list(self._on_cancel)
+        for callback in callbacks:
+            callback()
+        if cursor is not None:
+            try:
+                cursor.cancel()
+            except Exception as e:
+                print(f"Could not cancel query: {e}")
+
+    @contextmanager
+    def bind(self, cursor):
+        """Make cancel() cancel this cursor's statement while the block runs."""
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelled("Query cancelled")
+            self._cursor = cursor
+        try:
+            yield cursor
+        finally:
+            with self._lock:
+                self._cursor = None
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise QueryCancelled("Query cancelled")
+
+
+class AdmissionController:
+    """
+    At most max_concurrent queries hold a slot; up to max_queued more wait for one in FIFO order
+    for at most queue_timeout seconds. Beyond that admit() raises WarehouseBusy.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_QUERIES, max_queued=MAX_QUEUED_QUERIES,
+                 queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._running = 0
+        self._queue = deque()  # waiting QueryHandles, first in line first
+        self._cond = threading.Condition()
+        self.counters = {
+            "admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0, "cancelled": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+        }
+
+    def _update_positions(self):
+        for position, handle in enumerate(self._queue, start=1):
+            handle.queue_position = position
+
+    def _wait_for_slot(self, handle):
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._cond:
+            if self._running < self.max_concurrent and not self._queue:
+                self._running += 1
+                self.counters["admitted"] += 1
+                return 0.0
+            if len(self._queue) >= self.max_queued:
+                self.counters["rejected"] += 1
+                raise WarehouseBusy(
+                    f"The warehouse is busy ({self._running} queries running, {len(self._queue)} waiting); "
+                    "please try again shortly"
+                )
+            self._queue.append(handle)
+            self._update_positions()
+            self.counters["queued"] += 1
+            try:
+                while not (self._queue[0] is handle and self._running < self.max_concurrent):
+                    remaining = deadline - time.monotonic()
+                    if handle.cancelled:
+                        self.counters["cancelled"] += 1
+                        raise QueryCancelled("Query cancelled while waiting for the warehouse")
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise WarehouseBusy(
+                            f"The warehouse stayed busy for {self.queue_timeout:.0f}s; please try again shortly"
+                        )
+                    self._cond.wait(remaining)
+                self._running += 1
+                self.counters["admitted"] += 1
+            finally:
+                self._queue.remove(handle)
+                handle.queue_position = None
+                self._update_positions()
+                # The next in line may now be first with a free slot
+                self._cond.notify_all()
+            wait = time.monotonic() - started
+            self.counters["wait_seconds_total"] += wait
+            self.counters["wait_seconds_max"] = max(self.counters["wait_seconds_max"], wait)
+            return wait
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, handle=None):
+        """Hold a query slot for the enclosed block, queueing for one if necessary."""
+        handle = handle or QueryHandle()
+        handle.raise_if_cancelled()
+        # A cancel while queued must wake the waiter rather than wait for the next release
+        handle._on_cancel.append(self._wake)
+        try:
+            with span("admission"):
+                wait = self._wait_for_slot(handle)
+                annotate(wait_ms=round(wait * 1000, 1))
+        finally:
+            handle._on_cancel.remove(self._wake)
+        try:
+            yield handle
+        finally:
+            self._release()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats["running"] = self._running
+            stats["waiting"] = len(self._queue)
+            stats["max_concurrent"] = self.max_concurrent
+        admitted = stats["admitted"]
+        stats["wait_seconds_avg"] = stats["wait_seconds_total"] / admitted if admitted else 0.0
+        return stats
+
+
+# Process-wide controller shared by every Streamlit session
+warehouse_admission = AdmissionController()
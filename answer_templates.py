@@ -0,0 +1,106 @@
+import math
+import os
+
+from pandas.api.types import is_numeric_dtype
+
+from fast_path import METRICS, period_sql
+
+# Largest result that is still described locally instead of by the LLM
+SUMMARY_MAX_ROWS = int(os.getenv("SUMMARY_MAX_ROWS", "5"))
+# "indian" groups as 12,34,567; "international" as 1,234,567
+NUMBER_GROUPING = os.getenv("NUMBER_GROUPING", "indian")
+
+# Column alias (as emitted by the fast path) -> answer label
+COLUMN_LABELS = {alias.lower(): label for _, _, alias, label in METRICS}
+
+
+def format_number(value):
+    """Format a number with our grouping rules; whole numbers get no decimals, others two."""
+    value = float(value)
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    if value.is_integer():
+        whole, fraction = str(int(value)), ""
+    else:
+        whole, fraction = f"{value:.2f}".split(".")
+        fraction = "." + fraction
+    if NUMBER_GROUPING == "indian" and len(whole) > 3:
+        head, groups = whole[:-3], [whole[-3:]]
+        while len(head) > 2:
+            groups.insert(0, head[-2:])
+            head = head[:-2]
+        whole = ",".join(([head] if head else []) + groups)
+    else:
+        whole = f"{int(whole):,}"
+    return f"{sign}{whole}{fraction}"
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _metric_labels(columns, intent):
+    """Answer label for every numeric column, or None if any column cannot be named."""
+    labels = []
+    for column in columns:
+        label = COLUMN_LABELS.get(str(column).lower())
+        if label is None and len(columns) == 1 and intent is not None and len(intent.metrics) == 1:
+            # Unnamed aggregate such as "SUM(SalesQuantity)/7": name it after the question
+            label = intent.metrics[0][2]
+        if label is None:
+            return None
+        if intent is not None and intent.average:
+            label = f"average daily {label}"
+        labels.append(label)
+    return labels
+
+
+def _context(intent):
+    parts = []
+    if intent is not None and intent.filters:
+        values = [value for _, column_values in sorted(intent.filters.items()) for value in column_values]
+        parts.append("for " + " ".join(values))
+    if intent is not None and intent.period:
+        parts.append(period_sql(intent.period)[2])
+    return (" " + " ".join(parts)) if parts else ""
+
+
+def summarize_locally(results, intent):
+    """
+    Describe a scalar or small tabular result without calling a model.
+    intent is the (non-strict) QuestionIntent of the question, or None.
+    Returns None when the result is too complex, so the caller falls back to the LLM.
+    """
+    if results is None or results.empty or len(results) > SUMMARY_MAX_ROWS:
+        return None
+    numeric = [column for column in results.columns if is_numeric_dtype(results[column])]
+    labels_columns = [column for column in results.columns if column not in numeric]
+    labels = _metric_labels(numeric, intent)
+    if not numeric or labels is None:
+        return None
+    context = _context(intent)
+
+    if len(results) == 1 and not labels_columns:
+        row = results.iloc[0]
+        if all(_is_missing(row[column]) for column in numeric):
+            return f"No data was found{context}."
+        values = ["not available" if _is_missing(row[column]) else format_number(row[column]) for column in numeric]
+        answer = f"The {labels[0]}{context} is {values[0]}"
+        for label, value in zip(labels[1:], values[1:]):
+            answer += f" and the {label} is {value}"
+        return answer + "."
+
+    if len(labels_columns) != 1:
+        return None
+    label_column = labels_columns[0]
+    items = []
+    for _, row in results.iterrows():
+        values = ", ".join(
+            f"{label} {'n/a' if _is_missing(row[column]) else format_number(row[column])}"
+            if len(numeric) > 1 else ("n/a" if _is_missing(row[column]) else format_number(row[column]))
+            for label, column in zip(labels, numeric)
+        )
+        items.append(f"{row[label_column]}: {values}")
+    heading = " and ".join(labels) if len(numeric) > 1 else labels[0]
+    heading = heading[0].upper() + heading[1:]
+    return f"{heading}{context} by {label_column}: " + "; ".join(items) + "."
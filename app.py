@@ -2,168 +2,73 @@ import os
 import streamlit as st
 from dotenv import load_dotenv
 
+
+@st.cache_resource
+def load_environment():
+    """Load .env once per server process; Streamlit reruns this script on every interaction."""
+    load_dotenv()
+    # Ensure OPENAI_API_KEY is set in environment before LangChain and openai are imported
+    os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY") or ""
+
 # Load environment variables early
-load_dotenv()
-
-# Ensure OPENAI_API_KEY is set in environment before importing LangChain
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-
-import pyodbc
-import openai
-from dynamic_sql_generation import generate_sql_from_nl
-import re
-import contractions
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-DRIVER = os.getenv("Driver")
-SERVER = os.getenv("Server")
-DATABASE = os.getenv("Database")
-UID = os.getenv("UID")
-PWD = os.getenv("PWD")
-
-openai.api_key = OPENAI_API_KEY
-
-# Define column data types for Dw.fsales table
-COLUMN_TYPES = {
-    "DId": "int",
-    "BillingDocument": "varchar",
-    "BillingDocumentItem": "varchar",
-    "BillingDate": "date",
-    "SalesOfficeID": "int",
-    "DistributionChannel": "varchar",
-    "DisivisonCode": "varchar",
-    "Route": "varchar",
-    "RouteDescription": "varchar",
-    "CustomerGroup": "varchar",
-    "CustomerID": "varchar",
-    "ProductHeirachy1": "varchar",
-    "ProductHeirachy2": "varchar",
-    "ProductHeirachy3": "varchar",
-    "ProductHeirachy4": "varchar",
-    "ProductHeirachy5": "varchar",
-    "Materialgroup": "varchar",
-    "SubMaterialgroup1": "varchar",
-    "SubMaterialgroup2": "varchar",
-    "SubMaterialgroup3": "varchar",
-    "MaterialCode": "varchar",
-    "SalesQuantity": "int",
-    "SalesUnit": "varchar",
-    "TotalAmount": "decimal",
-    "TotalTax": "decimal",
-    "NetAmount": "decimal",
-    "EffectiveStartDate": "date",
-    "EffectiveEndDate": "date",
-    "IsActive": "bit",
-    "SalesOrganizationCode": "varchar",
-    "SalesOrgCodeDesc": "varchar",
-    "ItemCategory": "varchar",
-    "ShipToParty": "varchar"
+load_environment()
+
+import asyncio
+import json
+import pandas as pd
+import startup
+from admission import warehouse_admission
+from dimension_catalog import dimension_catalog
+from dynamic_sql_generation import sql_cache, sql_flight, translation_paths
+from pipeline import run_pipeline
+from rollups import rollup_router
+from summarizer import summary_flight
+from tracing import start_metrics_server
+from warehouse import get_warehouse_pool, query_flight
+
+STAGE_LABELS = {
+    "translate": "Translating to SQL...",
+    "check": "Checking the query...",
+    "execute": "Executing SQL query...",
+    "summarize": "Summarizing the result...",
 }
 
-def fix_sql_value_quoting(sql_query):
-    # This function attempts to fix quoting of values based on column data types
-    for column, col_type in COLUMN_TYPES.items():
-        # Regex to find conditions like column = 'value' or column='value'
-        pattern = re.compile(rf"({column}\s*=\s*)'([^']*)'", re.IGNORECASE)
-        def replacer(match):
-            prefix = match.group(1)
-            value = match.group(2)
-            # For numeric types, remove quotes
-            if col_type in ['int', 'decimal', 'bit']:
-                # Check if value is numeric or boolean-like
-                if value.isdigit() or value.lower() in ['true', 'false', '0', '1']:
-                    return f"{prefix}{value}"
-                else:
-                    # If value is not numeric, keep quotes to avoid SQL error
-                    return match.group(0)
-            else:
-                # For varchar, date, keep quotes
-                return match.group(0)
-        sql_query = pattern.sub(replacer, sql_query)
-    return sql_query
-
-def validate_sql_query(sql_query):
-    # Check for placeholder or example values in the SQL query
-    placeholders = ['specific_salesofficeid', 'example_value', 'placeholder']
-    for ph in placeholders:
-        if ph.lower() in sql_query.lower():
-            return False, f"SQL query contains placeholder value: {ph}"
-    return True, ""
-
-def execute_sql_query(sql_query):
-    try:
-        connection_string = (
-            f"DRIVER={{{DRIVER}}};"
-            f"SERVER={SERVER};"
-            f"DATABASE={DATABASE};"
-            f"UID={UID};"
-            f"PWD={PWD}"
-        )
-        with pyodbc.connect(connection_string, timeout=10) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            columns = [column[0] for column in cursor.description]
-            rows = cursor.fetchall()
-            results = [dict(zip(columns, row)) for row in rows]
-            return results
-    except Exception as e:
-        st.error(f"Error executing SQL query: {e}")
-        return None
-
-def results_to_natural_language(results, user_query):
-    if not results:
-        return "No results found."
-
-    # Detect sales quantity questions without a time reference
-    if "salesquantity" in user_query.lower().replace(" ", "") or "sales quantity" in user_query.lower():
-        # Extend time references with additional time-related keywords
-        time_keywords = [
-            "yesterday", "today", "last week", "last month", "this week", "this month", 
-            "on", "between", "from", "to", "qtd", "quarter", "mtd", "month", "wtd", "week", 
-            "ytd", "year", "l7d", "last 7 days", "lw", "previous week", "pw"
-        ]
-        
-        # Check if any time keyword is present in the user's query
-        if not any(time_kw in user_query.lower() for time_kw in time_keywords):
-            return "Please specify a time period for the sales quantity (e.g., 'last week', 'yesterday', 'QTD', 'MTD', 'L7D', etc.)."
-
-    # Convert results list of dicts to string for prompt
-    results_str = "\n".join([str(row) for row in results[:10]])  # limit to first 10 rows
-
-    prompt_text = (
-        f"The user asked: \"{user_query}\"\n\n"
-        f"The SQL query returned the following result:\n{results_str}\n\n"
-        "Generate a direct, concise, and natural language answer using the user's question and result. "
-        "Avoid explanations and unit information. Example output: 'The unique billing count for yesterday is 3421.'\n\n"
-        "Answer:"
-    )
 
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[ 
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt_text}
-            ],
-            max_tokens=150,
-            temperature=0.3,
-        )
-        summary = response.choices[0].message['content'].strip()
+def show_waterfall(trace):
+    """Debug view: one bar per span of the question, in start order."""
+    import altair as alt
+
+    data = trace.to_dict()
+    depth = {}
+    rows = []
+    for span in data["spans"]:
+        depth[span["id"]] = depth.get(span["parent"], -1) + 1
+        duration = span["duration_ms"] if span["duration_ms"] is not None else data["duration_ms"] - span["start_ms"]
+        rows.append({
+            "span": f"{span['id']:>2} {'  ' * depth[span['id']]}{span['name']}",
+            "start_ms": span["start_ms"],
+            "end_ms": span["start_ms"] + duration,
+            "duration_ms": round(duration, 1),
+            "details": json.dumps(span["attrs"], default=str) + (f" error: {span['error']}" if span["error"] else ""),
+        })
+    if not rows:
+        return
+    frame = pd.DataFrame(rows)
+    st.subheader(f"Timing ({data['duration_ms']:.0f} ms)")
+    chart = alt.Chart(frame).mark_bar().encode(
+        x=alt.X("start_ms", title="ms since question"),
+        x2="end_ms",
+        y=alt.Y("span", sort=None, title=None),
+        tooltip=["span", "duration_ms", "details"],
+    )
+    st.altair_chart(chart, use_container_width=True)
+    st.dataframe(frame[["span", "start_ms", "duration_ms", "details"]], hide_index=True)
 
-        # Remove units if accidentally generated
-        units = [
-            "$ USD", "€ EUR", "£ GBP", "₹ INR", "¥ JPY", "₩ KRW", 
-            "KG", "G", "L", "ML", "Units","$"
-        ]
-        
-        for unit in units:
-            summary = summary.replace(unit, "")
 
-        return summary
-    except Exception as e:
-        st.error(f"Error generating natural language summary: {e}")
-        return "Could not generate summary."
+@st.cache_resource
+def start_warm_up():
+    """Create the shared clients, matchers and connections in the background, once per server process."""
+    return startup.warm_up_in_background()
 
 
 def main():
@@ -171,46 +76,111 @@ def main():
     st.title("Ask HFL ")
 
     user_query = st.text_area("Enter your query:")
-
-    sql_query = None  # Initialize sql_query to avoid UnboundLocalError
+    debug = st.sidebar.checkbox("Show timing waterfall")
+    # Serves /metrics once per process when METRICS_PORT is set
+    start_metrics_server()
+    warm_up = start_warm_up()
 
     if st.button("Run Query"):
         if not user_query.strip():
             st.warning("Please enter a query.")
             return
 
-        with st.spinner("Translating to SQL..."):
-            # Preprocess the user query before generating SQL
-            preprocessed_query = contractions.fix(user_query)
-        # Use dynamic SQL generation via LLM chain
-        sql_query = generate_sql_from_nl(preprocessed_query)
-        # Fix SQL value quoting based on column types
-        sql_query = fix_sql_value_quoting(sql_query)
-        print(f"Generated SQL Query: {sql_query}")
-        st.subheader("Generated SQL Query:")
-        st.code(sql_query, language="sql")
-
-    # Validate SQL query for placeholders
-    if sql_query is None:
+        status = st.empty()
+        sql_header, sql_box, path_box = st.empty(), st.empty(), st.empty()
+        result_header, answer_box, table_box = st.empty(), st.empty(), st.empty()
+        streamed = {"sql": "", "summary": ""}
+
+        # Called on the pipeline's event loop, which runs in this script thread
+        def on_event(kind, payload):
+            if kind == "stage_start":
+                status.info(STAGE_LABELS[payload])
+            elif kind == "progress":
+                # Updating the page every second also lets Streamlit stop the query on a rerun or disconnect
+                if payload["queue_position"]:
+                    status.warning(
+                        f"The warehouse is busy; your query is number {payload['queue_position']} in line "
+                        f"({payload['elapsed']:.0f}s)..."
+                    )
+                else:
+                    status.info(f"{STAGE_LABELS['execute']} ({payload['elapsed']:.0f}s)")
+            elif kind == "sql_token":
+                streamed["sql"] += payload
+                sql_header.subheader("Generated SQL Query:")
+                sql_box.code(streamed["sql"], language="sql")
+            elif kind == "sql":
+                sql_header.subheader("Generated SQL Query:")
+                sql_box.code(payload, language="sql")
+            elif kind == "results":
+                result_header.subheader("Result:")
+                if len(payload) > 1:
+                    table_box.dataframe(payload)
+            elif kind == "summary_token":
+                streamed["summary"] += payload
+                answer_box.write(streamed["summary"])
+            elif kind == "summary":
+                answer_box.write(payload)
+            elif kind == "note":
+                st.info(payload)
+            elif kind == "error":
+                st.error(payload)
+
+        result = asyncio.run(run_pipeline(user_query, on_event=on_event))
+        status.empty()
+        if result.translation_path:
+            path_box.caption(f"Translated via: {result.translation_path}")
+        if result.results is not None and result.results.attrs.get("truncated"):
+            st.warning(f"Only the first {len(result.results)} rows were fetched; refine the question to see everything.")
+        if debug and result.trace is not None:
+            show_waterfall(result.trace)
+    else:
         st.warning("No SQL query generated.")
-        return
-
-    valid, error_msg = validate_sql_query(sql_query)
-    if not valid:
-        st.error(error_msg)
-        return
 
-    with st.spinner("Executing SQL query..."):
-        try:
-            results = execute_sql_query(sql_query)
-        except Exception as e:
-            st.error(f"Error executing SQL query: {e}")
-            return
-        
-    if results is not None:
-        st.subheader("Result:")
-        summary = results_to_natural_language(results, user_query)
-        st.write(summary)
+    translated = sum(translation_paths.values())
+    if translated:
+        st.sidebar.caption(
+            f"Skipped the LLM for {(translated - translation_paths['llm']) / translated:.0%} of "
+            f"{translated} questions (fast path {translation_paths['fast_path']}, cache {translation_paths['cache']}, "
+            f"shared {translation_paths['coalesced']})"
+        )
+    cache_stats = sql_cache.stats()
+    st.sidebar.caption(
+        f"SQL cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate)"
+    )
+    pool_stats = get_warehouse_pool().stats()
+    st.sidebar.caption(
+        f"DB pool: {pool_stats['in_use']} in use / {pool_stats['idle']} idle, "
+        f"avg wait {pool_stats['wait_seconds_avg'] * 1000:.0f} ms"
+    )
+    admission_stats = warehouse_admission.stats()
+    st.sidebar.caption(
+        f"Warehouse queries: {admission_stats['running']}/{admission_stats['max_concurrent']} running, "
+        f"{admission_stats['waiting']} waiting, {admission_stats['rejected'] + admission_stats['timeouts']} turned away"
+    )
+    duplicates = {name: flight.stats()["duplicates"] for name, flight in
+                  [("translations", sql_flight), ("queries", query_flight), ("summaries", summary_flight)]}
+    if any(duplicates.values()):
+        st.sidebar.caption(
+            "Shared in-flight work with identical requests: "
+            + ", ".join(f"{count} {name}" for name, count in duplicates.items())
+        )
+    rollup_stats = rollup_router.stats()
+    if rollup_stats["rewritten"]:
+        st.sidebar.caption(
+            f"Rollups: {rollup_stats['rewritten']} queries rewritten, {rollup_stats['fallbacks']} fell back"
+        )
+    if debug:
+        steps = [
+            f"{name} {step['seconds']:.1f}s" + (" (failed)" if step["error"] else "")
+            for name, step in list(warm_up.items())
+        ]
+        st.sidebar.caption(f"Warm-up: {', '.join(steps) or 'running...'}")
+    catalog_stats = dimension_catalog.stats()
+    st.sidebar.caption(
+        f"Dimension catalog: {catalog_stats['values']} values, "
+        f"loaded up to {catalog_stats['watermark'] or 'never (built-in terms)'}"
+    )
 
 if __name__ == "__main__":
     main()
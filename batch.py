@@ -0,0 +1,153 @@
+"""
+Answer a file of questions without the Streamlit UI, e.g. for the morning reports from cron:
+
+    python batch.py questions.yaml --output answers.parquet --llm-concurrency 4 --db-concurrency 2
+
+Questions come from a CSV (a "question" column, or the first column) or a YAML file (a list
+of questions, or of {"question": ...} entries, optionally under a "questions" key).
+Repeated questions are asked once. Every question goes through the same pipeline as the
+app, with LLM calls and warehouse queries limited separately. The output has one row per
+question with its SQL, the first result rows as JSON, the answer, any error and timings.
+Exits with status 1 if any question failed.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Ensure OPENAI_API_KEY is set in environment before importing LangChain
+os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY") or ""
+
+import openai
+import pandas as pd
+
+from pipeline import run_pipeline
+from translation_cache import normalize_question
+
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "2"))
+# Result rows kept per question in the output file
+BATCH_RESULT_ROWS = int(os.getenv("BATCH_RESULT_ROWS", "100"))
+
+
+def load_questions(path):
+    """Questions from a CSV or YAML file, in file order."""
+    if path.lower().endswith((".yaml", ".yml")):
+        import yaml
+
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f) or []
+        if isinstance(data, dict):
+            data = data.get("questions", [])
+        return [str(item["question"] if isinstance(item, dict) else item) for item in data]
+    frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    column = "question" if "question" in frame.columns else frame.columns[0]
+    return frame[column].tolist()
+
+
+def dedupe(questions):
+    """Unique non-empty questions (first spelling wins) and how often each was asked."""
+    unique = {}
+    for question in questions:
+        if not question.strip():
+            continue
+        key = normalize_question(question)
+        if key in unique:
+            unique[key][1] += 1
+        else:
+            unique[key] = [question.strip(), 1]
+    return [(question, count) for question, count in unique.values()]
+
+
+async def answer_all(questions, llm_concurrency, db_concurrency, on_done=None):
+    """Run every question through the pipeline concurrently; returns PipelineResults with wall times."""
+    limits = {"llm": asyncio.Semaphore(llm_concurrency), "db": asyncio.Semaphore(db_concurrency)}
+
+    async def answer(question):
+        started = time.perf_counter()
+        result = await run_pipeline(question, limits=limits)
+        elapsed = time.perf_counter() - started
+        if on_done is not None:
+            on_done(result, elapsed)
+        return result, elapsed
+
+    return await asyncio.gather(*(answer(question) for question, _ in questions))
+
+
+def results_frame(questions, answered, result_rows=BATCH_RESULT_ROWS):
+    rows = []
+    for (question, asked), (result, elapsed) in zip(questions, answered):
+        results = result.results
+        rows.append({
+            "question": question,
+            "times_asked": asked,
+            "translation_path": result.translation_path,
+            "sql": result.sql,
+            "rows": None if results is None else len(results),
+            "results": None if results is None else results.head(result_rows).to_json(
+                orient="records", date_format="iso"
+            ),
+            "answer": result.summary,
+            "error": result.error,
+            "notes": " ".join(result.notes),
+            "latency_s": round(elapsed, 3),
+            **{f"{stage}_s": round(seconds, 3) for stage, seconds in result.timings.items()},
+        })
+    return pd.DataFrame(rows)
+
+
+def write_frame(frame, path):
+    if path.lower().endswith(".parquet"):
+        # Needs pyarrow or fastparquet
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a CSV or YAML file of questions headlessly.")
+    parser.add_argument("questions", help="CSV or YAML file of questions")
+    parser.add_argument("--output", "-o", default="answers.csv", help="CSV or .parquet output file")
+    parser.add_argument("--llm-concurrency", type=int, default=BATCH_LLM_CONCURRENCY)
+    parser.add_argument("--db-concurrency", type=int, default=BATCH_DB_CONCURRENCY)
+    parser.add_argument("--result-rows", type=int, default=BATCH_RESULT_ROWS,
+                        help="result rows kept per question in the output")
+    args = parser.parse_args()
+
+    asked = load_questions(args.questions)
+    questions = dedupe(asked)
+    print(f"{len(questions)} questions ({len(asked) - len(questions)} duplicates or blanks removed)")
+    if not questions:
+        return 0
+
+    def on_done(result, elapsed):
+        status = "error" if result.error else "ok"
+        print(f"[{status} {elapsed:6.2f}s] {result.question}", file=sys.stderr)
+
+    started = time.perf_counter()
+    answered = asyncio.run(answer_all(questions, args.llm_concurrency, args.db_concurrency, on_done))
+    wall_time = time.perf_counter() - started
+
+    frame = results_frame(questions, answered, args.result_rows)
+    write_frame(frame, args.output)
+
+    failed = int(frame["error"].notna().sum())
+    latency = frame["latency_s"]
+    print(
+        f"Answered {len(frame) - failed}/{len(frame)} questions in {wall_time:.1f}s wall time; "
+        f"per question p50 {latency.quantile(0.5):.2f}s, p95 {latency.quantile(0.95):.2f}s, "
+        f"max {latency.max():.2f}s"
+    )
+    print(f"Wrote {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""
+Offline benchmark of the NL -> SQL -> answer pipeline.
+
+Runs every question in benchmarks/questions.json through each pipeline stage with the
+LLM calls answered from the recorded responses in that file and Dw.fsales replaced by a
+synthetic SQLite copy, so no OpenAI key or SQL Server is needed:
+
+    python benchmark.py --rows 200000 --iterations 20
+    python benchmark.py --save-baseline          # on the reference machine
+    python benchmark.py                          # exits 1 if a stage regressed
+
+Reports p50/p95/p99 latency, throughput and peak traced memory per stage and compares
+them with the stored baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+# Never touch the real translation cache or catalog snapshot, and let LangChain start without a key
+_BENCHMARK_TMP = tempfile.mkdtemp(prefix="nl2sql-bench-")
+os.environ["SQL_CACHE_PATH"] = os.path.join(_BENCHMARK_TMP, "sql_cache.sqlite")
+os.environ["CATALOG_SNAPSHOT_PATH"] = os.path.join(_BENCHMARK_TMP, "dimension_catalog.json")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import openai
+
+import dynamic_sql_generation
+import summarizer
+from dynamic_sql_generation import fix_unquoted_product_terms, preprocess_user_input, sql_cache
+from result_cache import ResultCache
+from result_fetch import fetch_frame
+from sql_guard import guard_sql
+from sqlite_warehouse import create_warehouse, to_sqlite
+from warehouse import fix_sql_value_quoting, parameterize_sql
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+STAGES = [
+    "preprocess_user_input", "translate", "fix_unquoted_product_terms", "fix_sql_value_quoting",
+    "sql_guard", "parameterize_sql", "execute", "summarize",
+]
+# Differences smaller than these are noise, whatever the ratio
+MIN_REGRESSION_MS = 0.05
+MIN_REGRESSION_KIB = 64
+
+
+class RecordedChain:
+    """Stands in for nl_to_sql_chain, answering each preprocessed question with its recorded SQL."""
+
+    def __init__(self, responses, latency):
+        self.responses = responses
+        self.latency = latency
+        self.calls = 0
+
+    def run(self, context, user_input, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.responses[user_input]
+
+    async def arun(self, context, user_input, **kwargs):
+        return self.run(context, user_input)
+
+
+class RecordedChatCompletion:
+    """Stands in for openai.ChatCompletion, answering with the recorded summary of the question."""
+
+    responses = {}
+    latency = 0.0
+    calls = 0
+
+    @classmethod
+    def create(cls, messages, **kwargs):
+        cls.calls += 1
+        time.sleep(cls.latency)
+        prompt = messages[-1]["content"]
+        question = prompt.split('"')[1] if prompt.count('"') >= 2 else ""
+        content = cls.responses.get(question, "The answer is shown in the table.")
+        return SimpleNamespace(choices=[SimpleNamespace(message={"content": content})])
+
+
+def sqlite_value(value):
+    """A query parameter as SQLite stores it in the synthetic warehouse (dates as ISO text)."""
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+
+class Benchmark:
+    def __init__(self, cases, conn):
+        self.cases = cases
+        self.conn = conn
+
+    def run_question(self, case, record):
+        """Run one question through every stage; record(stage, callable) times each call."""
+        question = case["question"]
+        record("preprocess_user_input", lambda: preprocess_user_input(question))
+        sql_query, _ = record("translate", lambda: dynamic_sql_generation.generate_sql_with_path(question))
+        record("fix_unquoted_product_terms", lambda: fix_unquoted_product_terms(case["sql"]))
+        sql_query = record("fix_sql_value_quoting", lambda: fix_sql_value_quoting(sql_query))
+        sql_query = record("sql_guard", lambda: guard_sql(sql_query).sql)
+        query = record("parameterize_sql", lambda: parameterize_sql(sql_query))
+        sqlite_query = to_sqlite(query.sql)
+        params = [sqlite_value(value) for value in query.params]
+
+        def execute():
+            cursor = self.conn.cursor()
+            cursor.execute(sqlite_query, params)
+            return fetch_frame(cursor)
+
+        results = record("execute", execute)
+        record("summarize", lambda: summarizer.results_to_natural_language(results, question))
+
+    def time_stages(self, iterations, warmup):
+        """Wall-clock seconds per stage call, plus seconds per question for all stages together."""
+        durations = {stage: [] for stage in STAGES}
+        totals = []
+
+        for iteration in range(warmup + iterations):
+            # Every iteration translates from scratch instead of from the previous iteration's cache
+            sql_cache.clear()
+            for case in self.cases:
+                question_time = 0.0
+
+                def record(stage, function):
+                    nonlocal question_time
+                    started = time.perf_counter()
+                    value = function()
+                    elapsed = time.perf_counter() - started
+                    question_time += elapsed
+                    if iteration >= warmup:
+                        durations[stage].append(elapsed)
+                    return value
+
+                self.run_question(case, record)
+                if iteration >= warmup:
+                    totals.append(question_time)
+        return durations, totals
+
+    def trace_memory(self):
+        """Peak traced allocation in KiB per stage over one pass (kept apart from timing, as tracing is slow)."""
+        peaks = {stage: 0.0 for stage in STAGES}
+
+        def record(stage, function):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            value = function()
+            peaks[stage] = max(peaks[stage], (tracemalloc.get_traced_memory()[1] - before) / 1024)
+            return value
+
+        sql_cache.clear()
+        tracemalloc.start()
+        try:
+            for case in self.cases:
+                self.run_question(case, record)
+        finally:
+            tracemalloc.stop()
+        return peaks
+
+
+def check_result_cache_midnight():
+    """Problems found when the result cache is used across midnight; empty if none."""
+    day = date(2024, 3, 31)
+    cache = ResultCache(max_bytes=1024 * 1024, today=lambda: day)
+    watermark = cache.watermark(lambda: "2024-03-31")
+    relative = "SELECT SUM(NetAmount) FROM Dw.fsales WHERE BillingDate = CAST(GETDATE() - 1 AS DATE)"
+    literal = "SELECT SUM(NetAmount) FROM Dw.fsales WHERE BillingDate = '2024-03-30'"
+    for sql_query in (relative, literal):
+        cache.put(sql_query, watermark, [{"total": 1}])
+    problems = []
+    if cache.get(relative, watermark) is None:
+        problems.append("a GETDATE() query missed on the day it was cached")
+    day += timedelta(days=1)
+    if cache.get(relative, watermark) is not None:
+        problems.append("a GETDATE() query cached before midnight was served after it")
+    if cache.get(literal, watermark) is None:
+        problems.append("a query with literal dates missed after midnight")
+    return problems
+
+
+def summarize_durations(values):
+    values = sorted(values)
+    return {
+        "calls": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "per_second": len(values) / sum(values) if sum(values) else 0.0,
+    }
+
+
+def build_report(durations, totals, peaks, config):
+    stages = {stage: dict(summarize_durations(durations[stage]), peak_kib=peaks[stage]) for stage in STAGES}
+    stages["question"] = dict(summarize_durations(totals), peak_kib=max(peaks.values()))
+    return {
+        "config": config,
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "stages": stages,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """List of (stage, message) for every stage that is slower or larger than the baseline allows."""
+    regressions = []
+    for stage, current in report["stages"].items():
+        previous = baseline["stages"].get(stage)
+        if previous is None:
+            continue
+        for key, unit, minimum in (("p95_ms", "ms", MIN_REGRESSION_MS), ("peak_kib", "KiB", MIN_REGRESSION_KIB)):
+            limit = previous[key] * (1 + tolerance)
+            if current[key] > limit and current[key] - previous[key] > minimum:
+                regressions.append(
+                    (stage, f"{key} {current[key]:.2f} {unit} vs baseline {previous[key]:.2f} {unit}")
+                )
+    return regressions
+
+
+def print_report(report, baseline=None):
+    header = f"{'stage':<28}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>11}{'peak KiB':>10}"
+    if baseline is not None:
+        header += f"{'p95 vs base':>13}"
+    print(header)
+    for stage, row in report["stages"].items():
+        line = (
+            f"{stage:<28}{row['calls']:>7}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['p99_ms']:>10.3f}"
+            f"{row['per_second']:>11.1f}{row['peak_kib']:>10.1f}"
+        )
+        previous = (baseline or {}).get("stages", {}).get(stage)
+        if previous and previous["p95_ms"]:
+            line += f"{(row['p95_ms'] / previous['p95_ms'] - 1):>+13.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NL to SQL pipeline offline.")
+    parser.add_argument("--questions", default=os.path.join(BENCHMARK_DIR, "questions.json"))
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--rows", type=int, default=100_000, help="synthetic Dw.fsales rows")
+    parser.add_argument("--days", type=int, default=120, help="days of history the rows are spread over")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency of each LLM call")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing, e.g. 0.25")
+    args = parser.parse_args()
+
+    problems = check_result_cache_midnight()
+    for problem in problems:
+        print(f"RESULT CACHE: {problem}")
+    if problems:
+        return 1
+
+    with open(args.questions, encoding="utf-8") as f:
+        cases = json.load(f)
+
+    latency = args.llm_latency_ms / 1000
+    dynamic_sql_generation.nl_to_sql_chain = RecordedChain(
+        {preprocess_user_input(case["question"]): case["sql"] for case in cases}, latency
+    )
+    RecordedChatCompletion.responses = {case["question"]: case["summary"] for case in cases}
+    RecordedChatCompletion.latency = latency
+    openai.ChatCompletion = RecordedChatCompletion
+
+    started = time.perf_counter()
+    conn = create_warehouse(
+        rows=args.rows, days=args.days, seed=args.seed,
+        hierarchy_levels=dynamic_sql_generation.product_hierarchy_levels,
+    )
+    print(f"Loaded {args.rows} synthetic Dw.fsales rows in {time.perf_counter() - started:.1f}s")
+
+    benchmark = Benchmark(cases, conn)
+    # The pipeline prints every prompt size and query; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        durations, totals = benchmark.time_stages(args.iterations, args.warmup)
+        peaks = benchmark.trace_memory()
+
+    config = {key: getattr(args, key) for key in ("rows", "days", "iterations", "seed", "llm_latency_ms")}
+    config["questions"] = len(cases)
+    report = build_report(durations, totals, peaks, config)
+    print(f"LLM calls: {dynamic_sql_generation.nl_to_sql_chain.calls} SQL, {RecordedChatCompletion.calls} summary")
+
+    if args.save_baseline:
+        print_report(report)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print_report(report)
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print_report(report, baseline)
+    if baseline["config"] != config:
+        print(f"Warning: baseline was recorded with {baseline['config']}, not {config}")
+    regressions = compare(report, baseline, args.tolerance)
+    for stage, message in regressions:
+        print(f"REGRESSION {stage}: {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
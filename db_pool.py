@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from tracing import span
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections shared by every session in the process.
+    - At most max_size connections are open at once.
+    - Idle connections not used for validate_after seconds are checked with validate_query on checkout.
+    - Connections older than max_age seconds are closed instead of being reused.
+    - When the pool is exhausted, checkout waits up to checkout_timeout seconds
+      (0 fails immediately) and then raises PoolExhausted.
+    """
+
+    def __init__(self, connect, max_size=5, max_age=1800, checkout_timeout=5.0,
+                 validate_query="SELECT 1", validate_after=30):
+        self.connect = connect
+        self.max_size = max_size
+        self.max_age = max_age
+        self.checkout_timeout = checkout_timeout
+        self.validate_query = validate_query
+        self.validate_after = validate_after
+        self._idle = deque()  # (connection, created_at, last_used)
+        self._created_at = {}  # id(connection) -> created_at for checked-out connections
+        self._open = 0
+        self._cond = threading.Condition()
+        self.counters = {
+            "checkouts": 0, "waits": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "timeouts": 0, "created": 0, "recycled": 0, "validation_failures": 0, "discarded": 0,
+        }
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.validate_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _acquire_slot(self, deadline):
+        """
+        Wait until deadline for an idle connection or a free slot.
+        Returns (idle entry or None for a new slot, seconds spent here, whether it had to wait).
+        """
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            while not self._idle and self._open >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolExhausted(
+                        f"No database connection available within {self.checkout_timeout}s "
+                        f"({self.max_size} in use)"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            wait = time.monotonic() - started
+            if self._idle:
+                return self._idle.pop(), wait, waited
+            self._open += 1
+            return None, wait, waited
+
+    def _record_checkout(self, wait, waited):
+        # Called with self._cond held, once per connection handed out
+        self.counters["checkouts"] += 1
+        if waited:
+            self.counters["waits"] += 1
+        self.counters["wait_seconds_total"] += wait
+        self.counters["wait_seconds_max"] = max(self.counters["wait_seconds_max"], wait)
+
+    def _release_slot(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def acquire(self):
+        # Recycled or dead idle connections are retried within the same timeout, and the
+        # checkout and its wait are counted once, for the connection finally returned
+        deadline = time.monotonic() + self.checkout_timeout
+        wait, waited = 0.0, False
+        while True:
+            entry, slot_wait, slot_waited = self._acquire_slot(deadline)
+            wait += slot_wait
+            waited = waited or slot_waited
+            if entry is None:
+                try:
+                    conn = self.connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                created_at = time.monotonic()
+                with self._cond:
+                    self.counters["created"] += 1
+                    self._created_at[id(conn)] = created_at
+                    self._record_checkout(wait, waited)
+                return conn
+            conn, created_at, last_used = entry
+            now = time.monotonic()
+            if now - created_at > self.max_age:
+                self._close(conn)
+                with self._cond:
+                    self.counters["recycled"] += 1
+                self._release_slot()
+                continue
+            if now - last_used > self.validate_after and not self._is_alive(conn):
+                self._close(conn)
+                with self._cond:
+                    self.counters["validation_failures"] += 1
+                self._release_slot()
+                continue
+            with self._cond:
+                self._created_at[id(conn)] = created_at
+                self._record_checkout(wait, waited)
+            return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+        if not broken:
+            try:
+                # End the implicit transaction so the next user starts clean
+                conn.rollback()
+            except Exception:
+                broken = True
+        if broken or time.monotonic() - created_at > self.max_age:
+            self._close(conn)
+            with self._cond:
+                self.counters["discarded" if broken else "recycled"] += 1
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        with span("pool_acquire"):
+            conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=not self._is_alive(conn))
+            raise
+        else:
+            self.release(conn)
+
+    def close_idle(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open - len(self._idle)
+            stats["open"] = self._open
+            stats["max_size"] = self.max_size
+        stats["wait_seconds_avg"] = stats["wait_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, connect):
+    """Return the process-wide pool registered under name, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ConnectionPool(
+                connect,
+                max_size=int(os.getenv("DB_POOL_SIZE", "5")),
+                max_age=float(os.getenv("DB_POOL_MAX_AGE_SECONDS", "1800")),
+                checkout_timeout=float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "5")),
+                validate_after=float(os.getenv("DB_POOL_VALIDATE_AFTER_SECONDS", "30")),
+            )
+            _pools[name] = pool
+        return pool
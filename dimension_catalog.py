@@ -0,0 +1,353 @@
+"""
+Catalog of the distinct dimension values in Dw.fsales (product hierarchy, route, material group).
+
+Values are loaded from the warehouse, refreshed incrementally from the last loaded
+BillingDate and saved to a local JSON snapshot, so startup does not wait for the warehouse.
+Until the first load the catalog holds the hardcoded hierarchy terms it is seeded with.
+
+Every value is indexed for exact, case-insensitive and fuzzy (trigram) lookup, together with
+the column(s) it belongs to. Listeners registered with on_change() are called after each
+refresh that found new values, e.g. to rebuild the term matchers.
+
+Values in generated SQL are found from the token stream (sql_tokens), only where they are
+compared with a catalog column, so SQL keywords and functions are never taken for values.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from sql_tokens import SQLTokenizeError, identifier_name, string_value, tokenize
+from tracing import annotate
+
+CATALOG_COLUMNS = [
+    "ProductHeirachy1", "ProductHeirachy2", "ProductHeirachy3", "ProductHeirachy4", "ProductHeirachy5",
+    "Route", "RouteDescription", "Materialgroup",
+]
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", os.path.join(".cache", "dimension_catalog.json"))
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", str(6 * 3600)))
+# Days before the last loaded BillingDate that are read again, for late-arriving rows
+CATALOG_OVERLAP_DAYS = int(os.getenv("CATALOG_OVERLAP_DAYS", "1"))
+# Lowest trigram similarity (0-1) at which a close value is suggested for an unknown one
+FUZZY_MIN_SIMILARITY = float(os.getenv("CATALOG_FUZZY_MIN_SIMILARITY", "0.6"))
+
+_COLUMN_INDEX = {column.lower(): column for column in CATALOG_COLUMNS}
+# Tokens that can continue an unquoted value such as Milk Cake, Flav.Milk, 4.5 KG or 700+700ML
+_VALUE_JOINERS = {".", "+", "-"}
+
+
+def fold(value):
+    """Case- and whitespace-insensitive lookup key."""
+    return re.sub(r"\s+", " ", value).strip().lower()
+
+
+def is_term(value):
+    """Whether a value can be detected as a term in questions (not a number or a single character)."""
+    return len(value) >= 2 and not value.replace(".", "").isdigit()
+
+
+def trigrams(text):
+    padded = f"  {fold(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class DimensionCatalog:
+    def __init__(self, snapshot_path=CATALOG_SNAPSHOT_PATH, refresh_interval=CATALOG_REFRESH_SECONDS):
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        # column -> set of values as spelled in the warehouse
+        self.values = {column: set() for column in CATALOG_COLUMNS}
+        # Last BillingDate (ISO string) the values were loaded up to; None until loaded from the warehouse
+        self.watermark = None
+        self.refreshed_at = 0.0
+        self.counters = {"refreshes": 0, "refresh_errors": 0, "new_values": 0}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._exact = {}
+        self._folded = {}
+        self._trigram_index = {}
+
+    # -- loading -----------------------------------------------------------------
+
+    def add_values(self, levels):
+        """Add column -> values; returns how many were new."""
+        added = 0
+        with self._lock:
+            for column, values in levels.items():
+                known = self.values.setdefault(column, set())
+                for value in values:
+                    value = value.strip() if isinstance(value, str) else value
+                    if value and value not in known:
+                        known.add(value)
+                        added += 1
+            if added:
+                self._build_index()
+        return added
+
+    def is_empty(self):
+        return not any(self.values.values())
+
+    def load_snapshot(self):
+        """Load the local snapshot if there is one; returns whether it was loaded."""
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.add_values(snapshot.get("columns", {}))
+        self.watermark = snapshot.get("watermark")
+        self.refreshed_at = snapshot.get("refreshed_at", 0.0)
+        return True
+
+    def save_snapshot(self):
+        with self._lock:
+            snapshot = {
+                "watermark": self.watermark,
+                "refreshed_at": self.refreshed_at,
+                "columns": {column: sorted(values) for column, values in self.values.items()},
+            }
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        temporary = self.snapshot_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(temporary, self.snapshot_path)
+
+    def refresh(self, conn, full=False):
+        """
+        Load distinct values from Dw.fsales: everything on the first (or a full) refresh,
+        otherwise only rows from CATALOG_OVERLAP_DAYS before the last loaded BillingDate.
+        Saves the snapshot and notifies listeners when something new was found.
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(BillingDate) FROM Dw.fsales")
+        watermark = cursor.fetchone()[0]
+        since = None
+        if not full and self.watermark is not None:
+            since = date.fromisoformat(self.watermark) - timedelta(days=CATALOG_OVERLAP_DAYS)
+        levels = {}
+        for column in CATALOG_COLUMNS:
+            if since is None:
+                cursor.execute(f"SELECT DISTINCT {column} FROM Dw.fsales WHERE {column} IS NOT NULL")
+            else:
+                cursor.execute(
+                    f"SELECT DISTINCT {column} FROM Dw.fsales "
+                    f"WHERE BillingDate >= ? AND {column} IS NOT NULL",
+                    since,
+                )
+            levels[column] = [str(row[0]) for row in cursor.fetchall()]
+        added = self.add_values(levels)
+        self.watermark = None if watermark is None else str(watermark)[:10]
+        self.refreshed_at = time.time()
+        self.counters["refreshes"] += 1
+        self.counters["new_values"] += added
+        self.save_snapshot()
+        if added:
+            for listener in list(self._listeners):
+                listener(self)
+        return added
+
+    def refresh_in_background(self, connection):
+        """
+        Start a refresh in a daemon thread if one is due and none is running.
+        connection() must return a context manager yielding a DB-API connection (e.g. pool.connection).
+        """
+        with self._lock:
+            due = time.time() - self.refreshed_at >= self.refresh_interval
+            if not due or self._refreshing:
+                return False
+            self._refreshing = True
+
+        def run():
+            try:
+                with connection() as conn:
+                    self.refresh(conn)
+            except Exception as e:
+                self.counters["refresh_errors"] += 1
+                # Retry after the normal interval instead of on every question
+                self.refreshed_at = time.time()
+                print(f"Dimension catalog refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="catalog-refresh", daemon=True).start()
+        return True
+
+    def on_change(self, listener):
+        self._listeners.append(listener)
+
+    # -- index -------------------------------------------------------------------
+
+    def _build_index(self):
+        exact, folded, index = {}, {}, {}
+        for column in CATALOG_COLUMNS + [c for c in self.values if c not in CATALOG_COLUMNS]:
+            for value in self.values.get(column, ()):
+                exact.setdefault(value, []).append(column)
+                key = fold(value)
+                folded.setdefault(key, []).append((value, column))
+                for gram in trigrams(key):
+                    index.setdefault(gram, set()).add(key)
+        self._exact, self._folded, self._trigram_index = exact, folded, index
+
+    def levels(self, columns=CATALOG_COLUMNS):
+        """column -> set of values, for the given columns (in that order)."""
+        with self._lock:
+            return {column: set(self.values.get(column, ())) for column in columns}
+
+    def columns_for(self, value):
+        """Columns the value belongs to: exact spelling first, else case-insensitively."""
+        if value in self._exact:
+            return list(self._exact[value])
+        return [column for _, column in self._folded.get(fold(value), [])]
+
+    def spellings(self, value, column=None):
+        """
+        Warehouse spellings of a case- and whitespace-insensitive match, optionally within one column.
+        More than one means the catalog holds values differing only by case (e.g. MILK and Milk).
+        """
+        found = []
+        for spelling, value_column in self._folded.get(fold(value), []):
+            if (column is None or value_column == column) and spelling not in found:
+                found.append(spelling)
+        return sorted(found)
+
+    def fuzzy(self, term, column=None, limit=5, min_similarity=FUZZY_MIN_SIMILARITY):
+        """
+        Closest values by trigram (Dice) similarity as (value, column, similarity), best first.
+        Only values sharing a trigram with the term are scored, so this stays fast on large catalogs.
+        """
+        grams = trigrams(term)
+        shared = Counter()
+        index = self._trigram_index
+        for gram in grams:
+            shared.update(index.get(gram, ()))
+        matches = []
+        for key, count in shared.most_common(limit * 10):
+            similarity = 2 * count / (len(grams) + len(trigrams(key)))
+            if similarity < min_similarity:
+                continue
+            for value, value_column in self._folded[key]:
+                if column is None or value_column == column:
+                    matches.append((value, value_column, round(similarity, 3)))
+        matches.sort(key=lambda match: -match[2])
+        return matches[:limit]
+
+    def stats(self):
+        with self._lock:
+            counts = {column: len(values) for column, values in self.values.items()}
+        return dict(self.counters, values=sum(counts.values()), columns=counts, watermark=self.watermark)
+
+
+def _compared_values(tokens):
+    """
+    (column, index) of the first token of every value compared with a catalog column:
+    col = v, col <> v, col != v and col [NOT] IN (v, ...). Subqueries are skipped.
+    """
+    for i, token in enumerate(tokens):
+        if token.kind != "identifier" or identifier_name(token) not in _COLUMN_INDEX:
+            continue
+        column = _COLUMN_INDEX[identifier_name(token)]
+        following = tokens[i + 1].text.lower() if i + 1 < len(tokens) else ""
+        if following in ("=", "<>", "!="):
+            if i + 2 < len(tokens):
+                yield column, i + 2
+        elif following in ("in", "not"):
+            start = i + 2 + (following == "not")
+            if start + 1 >= len(tokens) or tokens[start].text != "(" \
+                    or tokens[start + 1].kind == "identifier" and identifier_name(tokens[start + 1]) == "select":
+                continue
+            depth, item = 0, start + 1
+            for j in range(start + 1, len(tokens)):
+                text = tokens[j].text
+                if text == "(":
+                    depth += 1
+                elif text == ")" and depth:
+                    depth -= 1
+                elif text in (",", ")") and not depth:
+                    yield column, item
+                    if text == ")":
+                        break
+                    item = j + 1
+
+
+def _unquoted_value(sql_query, tokens, first, catalog):
+    """End index of the longest run of unquoted tokens from first that spells a catalog value, else None."""
+    end = None
+    for j in range(first, len(tokens)):
+        token = tokens[j]
+        if token.kind not in ("identifier", "number") and token.text not in _VALUE_JOINERS:
+            break
+        if catalog.spellings(sql_query[tokens[first].start:token.end]):
+            end = j + 1
+    # A function call such as Route = LTRIM(...) is not a value
+    if end is not None and end < len(tokens) and tokens[end].text == "(":
+        return None
+    return end
+
+
+def quote_sql_values(sql_query, catalog):
+    """
+    Quote catalog values the model left unquoted where they are compared with a catalog column,
+    e.g. ProductHeirachy1 = Milk Cake -> ProductHeirachy1 = 'Milk Cake'. They keep their spelling.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except SQLTokenizeError:
+        return sql_query
+    edits = []
+    for _, first in _compared_values(tokens):
+        if tokens[first].kind == "string":
+            continue
+        end = _unquoted_value(sql_query, tokens, first, catalog)
+        if end is not None:
+            value = sql_query[tokens[first].start:tokens[end - 1].end]
+            edits.append((tokens[first].start, tokens[end - 1].end, "'" + value.replace("'", "''") + "'"))
+    for start, end, text in sorted(edits, reverse=True):
+        sql_query = sql_query[:start] + text + sql_query[end:]
+    return sql_query
+
+
+def resolve_sql_values(sql_query, catalog):
+    """
+    Check string literals compared with a catalog column against that column's values.
+    Returns (sql, notes). A literal that differs from one value only by case or spacing is
+    replaced by the warehouse spelling; the notes say so. Literals matching several values
+    that differ only by case, and unknown literals, are left as written: the notes name the
+    matching values, or the closest value by trigram similarity as a suggestion.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except SQLTokenizeError:
+        return sql_query, []
+    edits, notes = [], []
+    for column, first in _compared_values(tokens):
+        literal = tokens[first]
+        if literal.kind != "string":
+            continue
+        value = string_value(literal)
+        if value in catalog.values.get(column, ()):
+            continue
+        spellings = catalog.spellings(value, column)
+        if len(spellings) == 1:
+            edits.append((literal.start, literal.end, "'" + spellings[0].replace("'", "''") + "'"))
+            notes.append(f"Used the {column} value '{spellings[0]}' for '{value}'.")
+        elif spellings:
+            notes.append(
+                f"'{value}' matches several {column} values ({', '.join(spellings)}); it was used as written."
+            )
+        else:
+            candidates = catalog.fuzzy(value, column, limit=2)
+            if candidates and (len(candidates) == 1 or candidates[0][2] > candidates[1][2]):
+                notes.append(f"'{value}' is not a known {column} value; did you mean '{candidates[0][0]}'?")
+    for start, end, text in sorted(edits, reverse=True):
+        sql_query = sql_query[:start] + text + sql_query[end:]
+    annotate(corrected_values=len(edits), value_notes=len(notes))
+    return sql_query, notes
+
+
+# Process-wide catalog shared by every Streamlit session; starts from the local snapshot
+dimension_catalog = DimensionCatalog()
+dimension_catalog.load_snapshot()
@@ -1,7 +1,15 @@
-from langchain.chat_models import ChatOpenAI
-from langchain import LLMChain
-from langchain.prompts import PromptTemplate
-import re
+from term_matcher import TermMatcher
+from translation_cache import TranslationCache
+from fast_path import FastPathParser, intent_to_sql
+from dimension_catalog import dimension_catalog, fold, is_term, quote_sql_values
+from prompt_builder import build_prompt_context, count_tokens, prompt_fingerprint
+from single_flight import SingleFlight
+from tracing import annotate, span
+from collections import Counter
+from dataclasses import dataclass
+import hashlib
+import os
+import threading
 
 business_term_mapping = {
     "UBC": "COUNT(DISTINCT BillingDocument)",
@@ -17,255 +25,244 @@ business_term_mapping = {
     
 }
 
+business_term_matcher = TermMatcher(business_term_mapping)
+
 def replace_business_terms(user_input: str) -> str:
-    for key, value in business_term_mapping.items():
-        pattern = re.compile(r'\b' + re.escape(key) + r'\b', re.IGNORECASE)
-        user_input = pattern.sub(value, user_input)
-    return user_input
-
-from langchain.prompts import PromptTemplate
-
-prompt_template = PromptTemplate(
-    input_variables=["user_input"],
-    template=""" 
-You are a professional support representative helping a business analytics team with SQL queries. Your goal is to translate natural language queries from business users into accurate SQL queries based on a table of sales data, `Dw.fsales`. Your aim is to assist by providing precise SQL without unnecessary explanations.
-
-### Table: Dw.fsales
-| Column Name            | Data Type           | Description                                 |
-|------------------------|---------------------|---------------------------------------------|
-| DId                   | int                 | Internal ID                                 |
-| BillingDocument       | bigint              | Sales bill number                           |
-| BillingDocumentItem   | int                 | Item number in the bill                     |
-| BillingDate           | date                | Date of billing                             |
-| SalesOfficeID         | int                 | Sales office code                           |
-| DistributionChannel   | nvarchar(25)        | Sales distribution channel                  |
-| DisivisonCode         | int                 | Division code                               |
-| Route                 | nvarchar(25)        | Sales route                                 |
-| RouteDescription      | nvarchar(50)        | Route description                           |
-| CustomerGroup         | nvarchar(25)        | Customer group                              |
-| CustomerID            | nvarchar(50)        | Customer ID                                 |
-| ProductHeirachy1      | nvarchar(35)        | Product category level 1 (e.g., Milk)       |
-| ProductHeirachy2      | nvarchar(35)        | Product category level 2 (e.g., Cow)        |
-| ProductHeirachy3      | nvarchar(35)        | Product category level 3 (e.g., DTM)        |
-| ProductHeirachy4      | nvarchar(35)        | Product category level 4 (e.g., Sachets)    |
-| ProductHeirachy5      | nvarchar(35)        | Product category level 5 (e.g., 500 ML)     |
-| Materialgroup         | nvarchar(35)        | Material group                              |
-| SubMaterialgroup1     | nvarchar(35)        | Sub-material group level 1                  |
-| SubMaterialgroup2     | nvarchar(35)        | Sub-material group level 2                  |
-| SubMaterialgroup3     | nvarchar(35)        | Sub-material group level 3                  |
-| MaterialCode          | int                 | Material code                               |
-| SalesQuantity         | decimal             | Quantity sold                               |
-| SalesUnit             | nvarchar(5)         | Unit of measurement                         |
-| TotalAmount           | decimal             | Total value including taxes                 |
-| TotalTax              | decimal             | Total tax                                   |
-| NetAmount             | decimal             | Total without tax                           |
-| EffectiveStartDate    | datetime            | Contract/validity start                     |
-| EffectiveEndDate      | datetime            | Contract/validity end                       |
-| IsActive              | bit                 | 1 = active                                  |
-| SalesOrganizationCode | int                 | Sales org code                              |
-| SalesOrgCodeDesc      | nvarchar(50)        | Sales org description                       |
-| ItemCategory          | nvarchar(75)        | Item category                               |
-| ShipToParty           | nvarchar(30)        | Shipping partner ID                         |
-
-
-### Product Hierarchies:
-- ProductHeirachy1: Milk, Curd, Flav.Milk, Ghee, Frozen Dessert, Cream, ButterMilk, Lassi, Milk Cake, IceCream
-- ProductHeirachy2: Cow, Buffalo, Default, Mixed
-- ProductHeirachy3: DTM,STD Milk, Plain, Mango Tango, STANDY, Pista, TM, FCM, BFCM, Pine Apple, Caramel Ripple Sundae
-- ProductHeirachy4: Sachets, Poly Pack, Tetra Pack, Matka, Cup, Pillow Pack, Bucket, Cone, Stick (Ice Cream), Glass Bottle
-- ProductHeirachy5: 500 ML, 1000 GMS, 165 GMS, 10 KG, 9.1 KG, 200 GMS, 60ML, 400 GMS, 475 GMS, 350 ML
-
-### Sample Values:
-- SalesUnit: CAR, L, KG, EA
-- DistributionChannel: Parlours, Direct
-- DisivisonCode: 1, 4, 3, 2
-- CustomerGroup: Parlours, HDC
-- Materialgroup: MILK, UHT MILK, BUTTER MILK, BUCKET CURD, ICE CREAM/FD, SWEET LASSI (POUCH), CHEESE, BUTTER MILK (CUP), POUCH CURD, FRUIT LASSI (CUP)
-- SubMaterialgroup1: Non-Dairy, Dairy, Dairy-Tradable Goods
-- SubMaterialgroup2: Milk, VAP, Fat (Bulk), Fat (CP)
-- SubMaterialgroup3: Milk - STD, Milk - FCM, VAP-Ice Cream, VAP-Butter Milk (Plain), Milk-TM-Special, VAP-Curd (Pouch), Milk-TM-Family, VAP-Lassi(Sweet), Milk - BFCM, VAP-Frozen Dessert
-- ItemCategory: L2N, ZREN, G2N, ZZMS, ZMTS
-
-- Sample Routes: 1942G, 1942J, 1940U, 1942F, 1945B, 1942B, 1981A, 1981B, 1941Q, 1965B
-- Route Descriptions:
-    - LB NAGAR TO VANASTALIPURAM
-    - LB NAGAR TO SANTOSHNAGAR
-    - Uppal-Vidyanagar-D.D.colony
-    - KALLURU S O < > Khammam Local
-    - Erragadda-MLA Colony-Banjarahills
-
-### Instructions:
-- Always use the table: `Dw.fsales`
-- Use `DISTINCT` when asked for "different", "unique", or "list"
-- Use `SUM()` or `COUNT()` if user asks for total, number, or total amount
-- Use appropriate `WHERE` clauses when asked for specific date ranges (e.g., last year, last month, etc.)
-- When you see product hierarchy terms in the user query, ensure they are enclosed in single quotes in the SQL query.
-- Always enclose product hierarchy values in single quotes in the SQL query to avoid invalid column name errors.
-- Generate a correct SQL query based on the user's question.
-- Focus on **dates**: Always filter `BillingDate` by time references like "last week", "yesterday", "this month", etc.
-- If the user mentions **“top”, “highest”**, calculate normalized sales over the requested period (e.g., divide the total by 7 for a weekly comparison).
-- If the user asks for **“total”**, use `SUM(SalesQuantity)` without division.
-- If the user asks for **“average”**, divide `SUM(SalesQuantity)` by the number of days in the requested period (7 for a week, 30 for a month, etc.).
-- When grouping by product hierarchies, always enclose values in single quotes in the query (e.g., `'Milk'`, `'Butter'`).
-- If the period is a **week**, divide the result by 7 for averages or comparisons.
-- If the period is a **month**, divide the result by 30 for averages or comparisons.
-- Be concise with the SQL and avoid adding units or unnecessary formatting.
-
-### SQL RULES:
-
-1. Always use the table: `Dw.fsales`
-2. Use single quotes for string values (e.g., `'Milk'`)
-3. If asked for:
-   - “total sales” → use `SUM(SalesQuantity)`
-   - “average sales per day last week” → use `SUM(SalesQuantity)/7`
-4. Use `DATEADD(WEEK, -1, GETDATE())` to filter for "last week" (adjust if needed).
-5. Use `GROUP BY` when asking by route, product, etc.
-6. Use `COUNT(DISTINCT BillingDocument)` for UBC (unique billing count).
-7. No explanations — only the SQL output.
-8. Always sanitize values and avoid placeholder names like `example_value`.
-
-
-### BUSINESS LANGUAGE CONVENTIONS:
-- Questions are asked like: “What is the sales quantity for Milk DTM sale for last week?”
-- “Curd” or “Milk” refer to `ProductHeirachy1` values.
-- “DTM” or similar refer to `ProductHeirachy3` values.
-- “Last week” means the previous calendar week (Monday to Sunday).
-- UBC means unique billing count → use `COUNT(DISTINCT BillingDocument)`
-- When the user asks for comparison between products or routes, use `GROUP BY`
-- Use `SUM(SalesQuantity)` for total sales, and `SUM(SalesQuantity)/7` for weekly average.
-
-### EXAMPLES:
-- **"What is the sales quantity for Milk DTM sale for last week?"**  
-→ `SELECT SUM(SalesQuantity)/7 FROM Dw.fsales WHERE ProductHeirachy1 = 'Milk' AND ProductHeirachy3 = 'DTM' AND BillingDate BETWEEN DATEADD(DAY, 1 - DATEPART(WEEKDAY, GETDATE()), DATEADD(WEEK, -1, GETDATE())) AND DATEADD(DAY, 7 - DATEPART(WEEKDAY, GETDATE()), DATEADD(WEEK, -1, GETDATE()));`
-
-
-
-### Example Queries:
-- **"Top selling milk product last week"** → Use `SUM(SalesQuantity)/7` and order DESC.
-- **"Sales quantity of milk for last week"** → Use `SUM(SalesQuantity)/7`.
-- **"Total sales quantity for butter last month"** → Use `SUM(SalesQuantity)/30`.
-- **"Average sales of milk per day last week"** → Use `SUM(SalesQuantity)/7`.
-- **"Total sales for the past month"** → Use `SUM(SalesQuantity)`.
-
-### Sample Query Translations:
-1. "What’s the total sales for today?" → `SELECT SUM(SalesQuantity) FROM Dw.fsales WHERE BillingDate = CAST(GETDATE() AS DATE);`
-2. "Show UBC and Net Amount for last week by route" → `SELECT Route, SUM(UBC), SUM(NetAmount) FROM Dw.fsales WHERE BillingDate >= DATEADD(week, -1, GETDATE()) GROUP BY Route;`
-3. "Compare sales of Milk vs Curd in April" → `SELECT SUM(SalesQuantity) FROM Dw.fsales WHERE ProductHeirachy1 IN ('Milk', 'Curd') AND BillingDate >= '2025-04-01' AND BillingDate < '2025-05-01' GROUP BY ProductHeirachy1;`
-4. "Top 5 selling products in the last 30 days" → `SELECT TOP 5 ProductHeirachy1, SUM(SalesQuantity) FROM Dw.fsales WHERE BillingDate >= DATEADD(day, -30, GETDATE()) GROUP BY ProductHeirachy1 ORDER BY SUM(SalesQuantity) DESC;`
-5. "Which product had the highest UBC in Route X?" → `SELECT ProductHeirachy1, MAX(UBC) FROM Dw.fsales WHERE Route = 'Route X' GROUP BY ProductHeirachy1;`
-
-User Query: "USER_INPUT"
-
-Context:
-- **Product Types**: Milk, Curd, etc.
-- **Metrics**: Sales Quantity, Net Amount, Total Amount, Sales Date, etc.
-- **Filters**: Region, Date Range, Sales Office, etc.
-- **Comparison Operations**: SUM, AVG, COUNT, etc.
-- **Relationships**: The user may ask for comparisons between product categories, across different time periods, or specific filters.
-
-### Instructions:
-1. **Identify the main product(s)** involved in the query (e.g., Milk, Curd).
-2. **Identify the metric(s)** the user wants to analyze (e.g., Sales Quantity, Net Amount).
-3. Recognize if the user is asking for **comparisons** between products (e.g., comparing Milk vs. Curd).
-4. **Identify any filters** mentioned in the query (e.g., Region, Date Range).
-5. **Generate the SQL query** based on the user's request:
-   - Ensure that product categories are enclosed in single quotes in the query.
-   - Apply the appropriate aggregation function (SUM, AVG, etc.) as required.
-   - Filter by date range and region or other specified filters.
-
-### SQL Query Template:
-
-```sql
-SELECT 
-    Product, 
-    SUM(SalesQuantity) AS TotalSales, 
-    SUM(NetAmount) AS TotalAmount
-FROM Dw.fsales
-WHERE Product IN ('Milk', 'Curd')  -- Adjust based on user query
-  AND BillingDate BETWEEN '2025-04-01' AND '2025-04-30'  -- Adjust based on user input
-  AND Region = 'Region A'  -- Adjust if region filter is specified
-GROUP BY Product;
+    return business_term_matcher.sub(user_input)
+
+# The schema, sample values, rules and examples are assembled per question by
+# prompt_builder, so only the parts relevant to the question are sent.
+PROMPT_TEMPLATE = """{context}
 
 User Query: {user_input}
 
 SQL:
 """
-)
 
-llm = ChatOpenAI(
-    temperature=0,
-    model_name="gpt-4",
-    openai_api_key=None
+LLM_MODEL = "gpt-4"
+
+# Built on first use by get_nl_to_sql_chain(): importing LangChain alone takes seconds
+nl_to_sql_chain = None
+_chain_lock = threading.Lock()
+
+def get_nl_to_sql_chain():
+    """The process-wide LLMChain that translates questions, created on first use."""
+    global nl_to_sql_chain
+    with _chain_lock:
+        if nl_to_sql_chain is None:
+            from langchain import LLMChain
+            from langchain.chat_models import ChatOpenAI
+            from langchain.prompts import PromptTemplate
+
+            llm = ChatOpenAI(
+                temperature=0,
+                model_name=LLM_MODEL,
+                openai_api_key=None,
+                # Tokens are streamed to callbacks (see agenerate_sql_with_path); run() still returns the full text
+                streaming=True,
+            )
+            prompt_template = PromptTemplate(input_variables=["context", "user_input"], template=PROMPT_TEMPLATE)
+            nl_to_sql_chain = LLMChain(llm=llm, prompt=prompt_template)
+    return nl_to_sql_chain
+
+# Persistent cache of translated SQL, keyed on the preprocessed question.
+# The prompt and model are fingerprinted so that editing either one starts a fresh keyspace.
+sql_cache = TranslationCache(
+    os.getenv("SQL_CACHE_PATH", os.path.join(".cache", "sql_cache.sqlite")),
+    ttl_seconds=int(os.getenv("SQL_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "5000")),
+    namespace=hashlib.sha256(
+        (LLM_MODEL + PROMPT_TEMPLATE + prompt_fingerprint()).encode("utf-8")
+    ).hexdigest(),
 )
 
-nl_to_sql_chain = LLMChain(llm=llm, prompt=prompt_template)
-
-product_hierarchy_terms = {
-    'Milk', 'Butter', 'ButterMilk', 'Cheese', 'Cold Coffee', 'Cream', 'Curd', 'Doodh Peda',
-    'Flav.Milk', 'Frozen Dessert', 'Ghee', 'Gluco Shakti', 'Gulab Jamun', 'IceCream', 'Laddu', 
-    'Lassi', 'Milk Cake', 'Milk Shakes', 'Paneer', 'Rasgulla', 'Shrikhand', 'SkimMilk Powder',
-    'Buffalo', 'Cow', 'Default', 'Mixed',
-    'Afghan Delight', 'Agmarked', 'Almond Crunch', 'American Delight', 'Amrakhand', 'Anjeer Badam',
-    'Badam', 'Badam Nuts', 'Badam Pista Kesar', 'Banana Cinnamon', 'Banana Strawberry', 'Belgium Chocolate',
-    'Berry Burst', 'BFCM', 'Black Currant Vanilla', 'Black Current', 'Blocks', 'Bubble Gum', 'Butter Scotch',
-    'Butterscotch Bliss', 'Butterscotch Crunch', 'Caramel Nuts', 'Caramel Ripple Sundae', 'Cassatta',
-    'Choco chips', 'Choco Rock', 'Chocobar', 'Chocolate', 'Chocolate Coffee Fudge', 'Chocolate Overload',
-    'Classic Kulfi', 'Classic Vanilla', 'Coffee', 'Cookies & Cream', 'Cotton Candy', 'Cubes', 'Double Chocolate',
-    'DTM', 'Elachi', 'FCM', 'Fig Honey', 'Fruit Fantasy', 'Fruit Fusion', 'Gol Gappa', 'Golden Cow Milk',
-    'Grape Juicy', 'Gulkhand Kulfi', 'HONEY NUTS', 'ISI', 'Jowar', 'Kala Khatta', 'Kohinoor Kulfi', 'Laddoo Prasadam',
-    'LATTE', 'Low Fat', 'Malai Kulfi', 'Mango', 'Mango Alphanso', 'Mango Juicy', 'Mango Masti Jusy',
-    'Mango Tango', 'Mawa Kulfi', 'Mega-Sundae', 'Melon Rush', 'Mixed Berry Sundae', 'Mixed Millet', 'Mozarella',
-    'NonAgmarked', 'Orange', 'Orange Juicy', 'Pan Kulfi', 'Pine Apple', 'Pineapple', 'Pista', 'Pistachio',
-    'Plain', 'Pot Kulfi (Pista)', 'Premium Vannila', 'Probiotic', 'Probiotic TM', 'Rajbhog', 'Rasperry Twin',
-    'Roasted Cashew', 'Royal Rose Delight', 'Sabja', 'Salted', 'Shrikhand Kesar', 'Sitaphal', 'Slices', 'Slim',
-    'Special', 'STANDY', 'STD', 'STD Milk', 'Strawberry', 'Strawbery', 'Sweet', 'TM', 'Twin Vanilla&Strawberry',
-    'Vanilla', 'Vanilla&Strawberry', 'Alu. Foil Pack', 'Aluminium Foil  Pack', 'Ball', 'Box', 'Bucket', 'Carton',
-    'Ceka Pack', 'Cone', 'Cup', 'Glass Bottle', 'Jar', 'Matka', 'Pillow Pack', 'Poly Pack', 'Pouch', 'PP + Box',
-    'PP Bottle', 'Sachets', 'Spout Pouch', 'STANDY POUCH', 'Stick', 'Stick (Ice Cream)', 'Tetra Pack', 'Tin', 'Tray',
-    'Tub', 'UHT Poly Pack', '1 KG', '10 KG', '100 GMS', '100 ML', '1000 GMS', '1000 ML', '110 ML', '110ML',
-    '115 GMS', '120 GMS', '120 ML', '125 GMS', '125 ML', '125ML', '12ML', '130 GMS', '130 ML', '135 GMS', '135 ML',
-    '140 GMS', '140 ML', '145 GMS', '145 ML', '15 KG', '150 GMS', '150 ML', '155 ML', '160 GMS', '160 ML', '165 GMS',
-    '165 ML', '170 GMS', '170 ML', '175 ML', '18.2 KG', '180 GMS', '180 ML', '185 ML', '190 ML', '2 KG', '2 Litres',
-    '20 GMS', '20 KG', '200 GMS', '200 ML', '220 GMS', '220 ML', '225 GMS', '225 ML', '230 ML', '250 GMS', '250 ML',
-    '25ML', '300 GMS', '310 ML', '325 ML', '330 ML', '35 ML', '350 GMS', '350 ML', '360 GMS', '375 ML', '380 GMS',
-    '4 liters', '4 Litres', '4.5 KG', '4.70 KG', '40 ML', '400 GMS', '400 ML', '425 GMS', '425 ML', '440 ML', '450 GMS',
-    '450 ML', '475 GMS', '475 ML', '480 GMS', '480 ML', '485 ML', '490 ML', '5 Kg', '5 Litres', '50 ML', '500 GMS',
-    '500 ML', '6 Liter', '60 ML', '60ML', '65 ML', '70 GMS', '70 ML', '700 ML', '700+700ML', '700ML', '750 ML',
-    '80 GMS', '80 ML', '800 ML', '850 GMS', '9 KG', '9.1 KG', '90 ML', '900 GMS', '900 ML', '950 GMS', '950 ML',
-    '975 ML', '990 ML'
+# Known values for each product hierarchy column of Dw.fsales, used until dimension_catalog
+# has been loaded from the warehouse
+product_hierarchy_levels = {
+    "ProductHeirachy1": {
+        'Milk', 'Butter', 'ButterMilk', 'Cheese', 'Cold Coffee', 'Cream', 'Curd', 'Doodh Peda', 'Flav.Milk',
+        'Frozen Dessert', 'Ghee', 'Gluco Shakti', 'Gulab Jamun', 'IceCream', 'Laddu', 'Lassi', 'Milk Cake',
+        'Milk Shakes', 'Paneer', 'Rasgulla', 'Shrikhand', 'SkimMilk Powder'
+    },
+    "ProductHeirachy2": {
+        'Buffalo', 'Cow', 'Default', 'Mixed'
+    },
+    "ProductHeirachy3": {
+        'Afghan Delight', 'Agmarked', 'Almond Crunch', 'American Delight', 'Amrakhand', 'Anjeer Badam', 'Badam',
+        'Badam Nuts', 'Badam Pista Kesar', 'Banana Cinnamon', 'Banana Strawberry', 'Belgium Chocolate',
+        'Berry Burst', 'BFCM', 'Black Currant Vanilla', 'Black Current', 'Blocks', 'Bubble Gum', 'Butter Scotch',
+        'Butterscotch Bliss', 'Butterscotch Crunch', 'Caramel Nuts', 'Caramel Ripple Sundae', 'Cassatta',
+        'Choco chips', 'Choco Rock', 'Chocobar', 'Chocolate', 'Chocolate Coffee Fudge', 'Chocolate Overload',
+        'Classic Kulfi', 'Classic Vanilla', 'Coffee', 'Cookies & Cream', 'Cotton Candy', 'Cubes',
+        'Double Chocolate', 'DTM', 'Elachi', 'FCM', 'Fig Honey', 'Fruit Fantasy', 'Fruit Fusion', 'Gol Gappa',
+        'Golden Cow Milk', 'Grape Juicy', 'Gulkhand Kulfi', 'HONEY NUTS', 'ISI', 'Jowar', 'Kala Khatta',
+        'Kohinoor Kulfi', 'Laddoo Prasadam', 'LATTE', 'Low Fat', 'Malai Kulfi', 'Mango', 'Mango Alphanso',
+        'Mango Juicy', 'Mango Masti Jusy', 'Mango Tango', 'Mawa Kulfi', 'Mega-Sundae', 'Melon Rush',
+        'Mixed Berry Sundae', 'Mixed Millet', 'Mozarella', 'NonAgmarked', 'Orange', 'Orange Juicy', 'Pan Kulfi',
+        'Pine Apple', 'Pineapple', 'Pista', 'Pistachio', 'Plain', 'Pot Kulfi (Pista)', 'Premium Vannila',
+        'Probiotic', 'Probiotic TM', 'Rajbhog', 'Rasperry Twin', 'Roasted Cashew', 'Royal Rose Delight', 'Sabja',
+        'Salted', 'Shrikhand Kesar', 'Sitaphal', 'Slices', 'Slim', 'Special', 'STANDY', 'STD', 'STD Milk',
+        'Strawberry', 'Strawbery', 'Sweet', 'TM', 'Twin Vanilla&Strawberry', 'Vanilla', 'Vanilla&Strawberry'
+    },
+    "ProductHeirachy4": {
+        'Alu. Foil Pack', 'Aluminium Foil  Pack', 'Ball', 'Box', 'Bucket', 'Carton', 'Ceka Pack', 'Cone', 'Cup',
+        'Glass Bottle', 'Jar', 'Matka', 'Pillow Pack', 'Poly Pack', 'Pouch', 'PP + Box', 'PP Bottle', 'Sachets',
+        'Spout Pouch', 'STANDY POUCH', 'Stick', 'Stick (Ice Cream)', 'Tetra Pack', 'Tin', 'Tray', 'Tub',
+        'UHT Poly Pack'
+    },
+    "ProductHeirachy5": {
+        '1 KG', '10 KG', '100 GMS', '100 ML', '1000 GMS', '1000 ML', '110 ML', '110ML', '115 GMS', '120 GMS',
+        '120 ML', '125 GMS', '125 ML', '125ML', '12ML', '130 GMS', '130 ML', '135 GMS', '135 ML', '140 GMS',
+        '140 ML', '145 GMS', '145 ML', '15 KG', '150 GMS', '150 ML', '155 ML', '160 GMS', '160 ML', '165 GMS',
+        '165 ML', '170 GMS', '170 ML', '175 ML', '18.2 KG', '180 GMS', '180 ML', '185 ML', '190 ML', '2 KG',
+        '2 Litres', '20 GMS', '20 KG', '200 GMS', '200 ML', '220 GMS', '220 ML', '225 GMS', '225 ML', '230 ML',
+        '250 GMS', '250 ML', '25ML', '300 GMS', '310 ML', '325 ML', '330 ML', '35 ML', '350 GMS', '350 ML',
+        '360 GMS', '375 ML', '380 GMS', '4 liters', '4 Litres', '4.5 KG', '4.70 KG', '40 ML', '400 GMS', '400 ML',
+        '425 GMS', '425 ML', '440 ML', '450 GMS', '450 ML', '475 GMS', '475 ML', '480 GMS', '480 ML', '485 ML',
+        '490 ML', '5 Kg', '5 Litres', '50 ML', '500 GMS', '500 ML', '6 Liter', '60 ML', '60ML', '65 ML', '70 GMS',
+        '70 ML', '700 ML', '700+700ML', '700ML', '750 ML', '80 GMS', '80 ML', '800 ML', '850 GMS', '9 KG',
+        '9.1 KG', '90 ML', '900 GMS', '900 ML', '950 GMS', '950 ML', '975 ML', '990 ML'
+    },
 }
 
+if dimension_catalog.is_empty():
+    dimension_catalog.add_values(product_hierarchy_levels)
+
+# How many questions went through each translation path: "fast_path", "cache", "llm"
+# or "coalesced" (shared the LLM call of an identical question asked at the same time)
+translation_paths = Counter()
+
+# Concurrent identical preprocessed questions share one LLM call
+sql_flight = SingleFlight("llm_sql")
+
+@dataclass
+class TermMatchers:
+    """
+    Term matchers and the fast path built from the dimension catalog.
+    Matchers are compiled once per build; each call is a single scan over the text.
+    hierarchy wraps catalog terms in quotes and input also applies business_term_mapping
+    (with term quoting already applied to the mapped value). Terms the catalog spells in
+    several cases (e.g. MILK and Milk) are quoted as the question wrote them and left to the LLM.
+    """
+    terms: set
+    # Catalog column of every known term (the first column it appears in), used to pick prompt sections
+    columns: dict
+    hierarchy: TermMatcher
+    input: TermMatcher
+    # Rule-based translator for simple metric/product/period questions
+    fast_path: FastPathParser
+
+def build_term_matchers(catalog=dimension_catalog):
+    levels = {column: {value for value in values if is_term(value)} for column, values in catalog.levels().items()}
+    terms = set().union(*levels.values())
+    spellings = {}
+    for term in terms:
+        spellings.setdefault(fold(term), set()).add(term)
+    ambiguous = {term for group in spellings.values() if len(group) > 1 for term in group}
+    quoted = {term: f"'{term}'" for term in terms if term not in ambiguous}
+    quoted.update({term: lambda written: f"'{written}'" for term in ambiguous})
+    hierarchy = TermMatcher(quoted)
+    folded_terms = {term.lower() for term in terms}
+    columns = {}
+    for column, values in levels.items():
+        for term in values:
+            columns.setdefault(term.lower(), column)
+    return TermMatchers(
+        terms=terms,
+        columns=columns,
+        hierarchy=hierarchy,
+        input=TermMatcher({
+            **quoted,
+            **{key: hierarchy.sub(value) for key, value in business_term_mapping.items()},
+        }),
+        # Business terms that rename a catalog value (e.g. "butter milk") are passed as aliases;
+        # mappings that only drop words ("milk DTM" -> "DTM") are not, so both values are kept.
+        fast_path=FastPathParser({column: values - ambiguous for column, values in levels.items()}, aliases={
+            key: value for key, value in business_term_mapping.items()
+            if value.lower() in folded_terms and value.lower() not in key.lower()
+        }),
+    )
+
+# Built on first use (or by warm-up) and rebuilt whenever a catalog refresh finds new values
+_term_matchers = None
+_term_matchers_lock = threading.Lock()
+
+def term_matchers() -> TermMatchers:
+    """The current process-wide TermMatchers, building them on first use."""
+    global _term_matchers
+    if _term_matchers is None:
+        with _term_matchers_lock:
+            if _term_matchers is None:
+                _term_matchers = build_term_matchers()
+    return _term_matchers
+
+def rebuild_term_matchers(catalog=dimension_catalog):
+    """Swap in matchers built from the catalog; questions in flight keep the ones they started with."""
+    global _term_matchers
+    _term_matchers = build_term_matchers(catalog)
+
+dimension_catalog.on_change(rebuild_term_matchers)
+
+# Prompt size of the LLM calls made so far
+prompt_stats = {"requests": 0, "total_tokens": 0, "max_tokens": 0, "last_tokens": 0}
+
+def build_prompt(user_query: str, preprocessed_query: str):
+    """Return the question-specific prompt context and its token count."""
+    matchers = term_matchers()
+    columns = {matchers.columns[term.lower()] for term, _, _ in matchers.hierarchy.find(user_query)}
+    context, tokens = build_prompt_context(f"{user_query}\n{preprocessed_query}", columns)
+    prompt_stats["requests"] += 1
+    prompt_stats["total_tokens"] += tokens
+    prompt_stats["max_tokens"] = max(prompt_stats["max_tokens"], tokens)
+    prompt_stats["last_tokens"] = tokens
+    return context, tokens
+
+def prompt_tokens(context: str, preprocessed_query: str) -> int:
+    """Token count of the full prompt sent to the model."""
+    return count_tokens(PROMPT_TEMPLATE.format(context=context, user_input=preprocessed_query))
+
 def preprocess_user_input(user_input: str) -> str:
-    # Replace business terms with SQL expressions
-    user_input = replace_business_terms(user_input)
-    # Sort terms by length descending to avoid partial replacements
-    sorted_terms = sorted(product_hierarchy_terms, key=len, reverse=True)
-    for term in sorted_terms:
-        # Use regex to replace whole word matches case-insensitively
-        pattern = re.compile(r'\b' + re.escape(term) + r'\b', re.IGNORECASE)
-        user_input = pattern.sub(f"'{term}'", user_input)
-    return user_input
+    # Replace business terms with SQL expressions and quote product hierarchy terms.
+    # Longest match wins, so "Milk Cake" is quoted once rather than also matching "Milk".
+    return term_matchers().input.sub(user_input)
 
 def fix_unquoted_product_terms(sql_query: str) -> str:
     """
-    Post-process the generated SQL query to ensure product hierarchy terms are quoted.
+    Post-process the generated SQL query to ensure catalog values compared with a catalog
+    column are quoted. Existing string literals, keywords and functions are left as they are.
     """
-    for term in product_hierarchy_terms:
-        # Replace unquoted term with quoted term, only if it appears as a standalone word
-        pattern = re.compile(rf"(?<!')\b{re.escape(term)}\b(?!')", re.IGNORECASE)
-        sql_query = pattern.sub(f"'{term}'", sql_query)
-    return sql_query
+    return quote_sql_values(sql_query, dimension_catalog)
 
 def generate_sql_from_nl(user_query: str) -> str:
+    return generate_sql_with_path(user_query)[0]
+
+def translate_without_llm(user_query: str):
     """
-    Generate SQL query from natural language user query using LangChain LLMChain.
-    Preprocess user input to handle business terms and product hierarchy terms.
-    Post-process generated SQL to fix unquoted product hierarchy terms.
-    Strip markdown code block delimiters from the generated SQL before returning.
+    Try the rule-based fast path, then sql_cache.
+    Returns (sql, path, preprocessed_query); sql is None when the LLM is needed.
     """
-    preprocessed_query = preprocess_user_input(user_query)
-    result = nl_to_sql_chain.run(user_input=preprocessed_query)
+    with span("fast_path"):
+        intent = term_matchers().fast_path.parse(user_query)
+    if intent is not None:
+        translation_paths["fast_path"] += 1
+        annotate(path="fast_path")
+        return intent_to_sql(intent), "fast_path", None
+    with span("preprocess_user_input"):
+        preprocessed_query = preprocess_user_input(user_query)
+    with span("sql_cache", cache="sql_cache"):
+        cached = sql_cache.get(preprocessed_query)
+        annotate(cache_hit=cached is not None)
+    if cached is not None:
+        translation_paths["cache"] += 1
+        annotate(path="cache")
+        return cached, "cache", preprocessed_query
+    annotate(path="llm")
+    return None, "llm", preprocessed_query
+
+def finish_llm_sql(preprocessed_query: str, result: str) -> str:
+    """Clean up raw LLM output. It is cached by cache_translation once it has been checked."""
     # Remove markdown triple backticks and optional language specifier
+    result = result.strip()
     if result.startswith("```sql"):
         result = result[len("```sql"):].strip()
     elif result.startswith("```"):
@@ -274,5 +271,80 @@ def generate_sql_from_nl(user_query: str) -> str:
     if result.endswith("```"):
         result = result[:-3].strip()
     # Fix unquoted product hierarchy terms in SQL
-    result = fix_unquoted_product_terms(result)
-    return result.strip()
+    with span("fix_unquoted_product_terms"):
+        result = fix_unquoted_product_terms(result).strip()
+    translation_paths["llm"] += 1
+    return result
+
+def cache_translation(user_query: str, sql_query: str) -> None:
+    """
+    Store an LLM translation in sql_cache. Called only after the SQL has passed validation
+    and sql_guard, so a rejected translation is not served again to later questions.
+    """
+    with span("sql_cache_put"):
+        sql_cache.put(preprocess_user_input(user_query), sql_query)
+
+def generate_sql_with_path(user_query: str):
+    """
+    Generate SQL query from natural language user query using LangChain LLMChain.
+    Preprocess user input to handle business terms and product hierarchy terms.
+    Post-process generated SQL to fix unquoted product hierarchy terms.
+    Strip markdown code block delimiters from the generated SQL before returning.
+    Simple questions are translated by the fast path parser, and repeated questions are
+    served from sql_cache (filled by cache_translation once a translation has been checked);
+    only the rest call the LLM, once per preprocessed question in flight.
+    Returns the SQL and the path that produced it ("fast_path", "cache", "llm" or "coalesced").
+    """
+    sql_query, path, preprocessed_query = translate_without_llm(user_query)
+    if sql_query is not None:
+        return sql_query, path
+    sql_query, shared = sql_flight.do(preprocessed_query, llm_sql, user_query, preprocessed_query)
+    return sql_query, coalesced_path(shared)
+
+def llm_sql(user_query: str, preprocessed_query: str) -> str:
+    context, _ = build_prompt(user_query, preprocessed_query)
+    chain = get_nl_to_sql_chain()
+    with span("llm_sql", model=LLM_MODEL, prompt_tokens=prompt_tokens(context, preprocessed_query)):
+        result = chain.run(context=context, user_input=preprocessed_query)
+        annotate(completion_tokens=count_tokens(result))
+    return finish_llm_sql(preprocessed_query, result)
+
+def coalesced_path(shared: bool) -> str:
+    """Translation path of an LLM translation, recording it when it was shared with another question."""
+    if not shared:
+        return "llm"
+    translation_paths["coalesced"] += 1
+    annotate(path="coalesced")
+    return "coalesced"
+
+def token_callback(on_token):
+    """A LangChain callback that forwards every streamed LLM token to on_token."""
+    from langchain.callbacks.base import AsyncCallbackHandler
+
+    class TokenCallback(AsyncCallbackHandler):
+        async def on_llm_new_token(self, token: str, **kwargs) -> None:
+            on_token(token)
+
+    return TokenCallback()
+
+async def agenerate_sql_with_path(user_query: str, on_token=None):
+    """
+    Async variant of generate_sql_with_path that streams LLM tokens to on_token.
+    A question sharing another one's LLM call gets the finished SQL as a single token.
+    """
+    sql_query, path, preprocessed_query = translate_without_llm(user_query)
+    if sql_query is not None:
+        return sql_query, path
+    sql_query, shared = await sql_flight.ado(preprocessed_query, allm_sql, user_query, preprocessed_query, on_token)
+    if shared and on_token is not None:
+        on_token(sql_query)
+    return sql_query, coalesced_path(shared)
+
+async def allm_sql(user_query: str, preprocessed_query: str, on_token=None) -> str:
+    context, _ = build_prompt(user_query, preprocessed_query)
+    chain = get_nl_to_sql_chain()
+    callbacks = [token_callback(on_token)] if on_token is not None else None
+    with span("llm_sql", model=LLM_MODEL, prompt_tokens=prompt_tokens(context, preprocessed_query)):
+        result = await chain.arun(context=context, user_input=preprocessed_query, callbacks=callbacks)
+        annotate(completion_tokens=count_tokens(result))
+    return finish_llm_sql(preprocessed_query, result)
@@ -0,0 +1,214 @@
+import re
+from dataclasses import dataclass, field
+
+from term_matcher import TermMatcher
+
+# (pattern, SQL expression, column alias, label used in answers)
+METRICS = [
+    (r"ubc|unique billing count|unique bill count|bill count", "COUNT(DISTINCT BillingDocument)", "UBC", "unique billing count"),
+    (r"net amount|net sales value", "SUM(NetAmount)", "NetAmount", "net amount"),
+    (r"total amount|gross amount", "SUM(TotalAmount)", "TotalAmount", "total amount"),
+    (r"total tax|tax amount|tax", "SUM(TotalTax)", "TotalTax", "total tax"),
+    (r"sales quantity|sales qty|sale quantity|quantity|qty|volume", "SUM(SalesQuantity)", "SalesQuantity", "sales quantity"),
+]
+# Bare "sales"/"sold" means sales quantity, but only when no other metric was asked for
+SALES_QUANTITY_METRIC = METRICS[-1]
+BARE_SALES_PATTERN = r"sales|sale|sold"
+
+TODAY = "CAST(GETDATE() AS DATE)"
+# Monday of the current week, independent of the server's DATEFIRST setting
+WEEK_START = f"DATEADD(DAY, -((DATEPART(WEEKDAY, GETDATE()) + @@DATEFIRST - 2) % 7), {TODAY})"
+MONTH_START = "DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1)"
+QUARTER_START = "DATEADD(QUARTER, DATEDIFF(QUARTER, 0, GETDATE()), 0)"
+YEAR_START = "DATEFROMPARTS(YEAR(GETDATE()), 1, 1)"
+
+# name -> (pattern, BillingDate predicate, number of days as a SQL expression, label used in answers)
+PERIODS = {
+    "today": (r"today", f"BillingDate = {TODAY}", "1", "today"),
+    "yesterday": (r"yesterday", "BillingDate = CAST(DATEADD(DAY, -1, GETDATE()) AS DATE)", "1", "yesterday"),
+    "last_week": (
+        r"last week|previous week|lw|pw",
+        f"BillingDate >= DATEADD(DAY, -7, {WEEK_START}) AND BillingDate < {WEEK_START}",
+        "7",
+        "last week",
+    ),
+    "wtd": (
+        r"this week|week to date|wtd",
+        f"BillingDate >= {WEEK_START} AND BillingDate <= {TODAY}",
+        f"(DATEDIFF(DAY, {WEEK_START}, {TODAY}) + 1)",
+        "this week",
+    ),
+    "mtd": (
+        r"this month|month to date|mtd",
+        f"BillingDate >= {MONTH_START} AND BillingDate <= {TODAY}",
+        "DAY(GETDATE())",
+        "this month",
+    ),
+    "last_month": (
+        r"last month|previous month",
+        f"BillingDate >= DATEADD(MONTH, -1, {MONTH_START}) AND BillingDate < {MONTH_START}",
+        "DAY(EOMONTH(GETDATE(), -1))",
+        "last month",
+    ),
+    "qtd": (
+        r"this quarter|quarter to date|qtd",
+        f"BillingDate >= {QUARTER_START} AND BillingDate <= {TODAY}",
+        f"(DATEDIFF(DAY, {QUARTER_START}, {TODAY}) + 1)",
+        "this quarter",
+    ),
+    "ytd": (
+        r"this year|year to date|ytd",
+        f"BillingDate >= {YEAR_START} AND BillingDate <= {TODAY}",
+        "DATEPART(DAYOFYEAR, GETDATE())",
+        "this year",
+    ),
+}
+# "last 7 days", "past 30 days", "L7D"; at least one day, so averages never divide by zero
+LAST_N_DAYS_PATTERN = r"(?:last|past|previous) (?P<days>[1-9]\d{0,2}) days|l(?P<short_days>[1-9]\d{0,2})d"
+
+AVERAGE_PATTERN = r"average|avg|per day|daily|a day"
+TOTAL_PATTERN = r"total|overall"
+
+# Words that carry no meaning for the query shape. Anything else left over
+# (e.g. "by", "top", "vs", "route", a literal date) means the question is not a simple one.
+FILLER_WORDS = {
+    "what", "whats", "is", "was", "were", "are", "the", "for", "of", "in", "on", "during", "our", "me", "show",
+    "give", "tell", "get", "find", "how", "much", "many", "and", "did", "we", "do", "please", "a", "an",
+    "sale", "sales", "sold", "hfl", "can", "you", "i", "want", "to", "know", "there", "it", "at",
+}
+
+
+@dataclass
+class QuestionIntent:
+    # (SQL expression, column alias, answer label) for every metric asked for
+    metrics: list
+    # product hierarchy column -> list of values
+    filters: dict
+    # PERIODS key or "last_<n>_days"
+    period: str
+    average: bool = False
+    matched_terms: list = field(default_factory=list)
+
+
+def _find_spans(pattern, text):
+    return [(m.start(), m.end(), m) for m in re.finditer(rf"(?<!\w)(?:{pattern})(?!\w)", text)]
+
+
+class FastPathParser:
+    """
+    Rule-based parser for the common question shape: one or more metrics, optional
+    product hierarchy values and exactly one period. parse() returns None whenever
+    anything in the question is not understood, so callers can fall back to the LLM.
+    """
+
+    def __init__(self, hierarchy_levels, aliases=None):
+        # hierarchy_levels maps each ProductHeirachy column to its known values;
+        # aliases maps extra spellings (e.g. "butter milk") to one of those values.
+        self.term_levels = {}
+        for column, values in hierarchy_levels.items():
+            for value in values:
+                self.term_levels.setdefault(value.lower(), (column, value))
+        spellings = {value: value for _, value in self.term_levels.values()}
+        for alias, value in (aliases or {}).items():
+            if value.lower() in self.term_levels:
+                spellings[alias] = self.term_levels[value.lower()][1]
+        self.matcher = TermMatcher(spellings)
+
+    def parse(self, question, strict=True):
+        """
+        With strict=False nothing is rejected: the intent holds whatever metrics, filters
+        and period (None unless exactly one) were recognised, for describing results.
+        """
+        text = re.sub(r"[’']", "", question.lower())
+        consumed = []
+
+        filters = {}
+        matched_terms = []
+        for spelling, start, end in self.matcher.find(text):
+            column, value = self.term_levels[self.matcher.replacements[spelling.lower()].lower()]
+            if value not in filters.setdefault(column, []):
+                filters[column].append(value)
+            matched_terms.append(value)
+            consumed.append((start, end))
+
+        def take(pattern):
+            spans = [span for span in _find_spans(pattern, text) if not _overlaps(span, consumed)]
+            consumed.extend((start, end) for start, end, _ in spans)
+            return spans
+
+        periods = []
+        for start, end, match in take(LAST_N_DAYS_PATTERN):
+            days = int(match.group("days") or match.group("short_days"))
+            periods.append(("last_n_days", days))
+        for name, (pattern, _, _, _) in PERIODS.items():
+            if take(pattern):
+                periods.append((name, None))
+        if strict and len(periods) != 1:
+            return None
+
+        metrics = []
+        for pattern, expression, alias, label in METRICS:
+            if take(pattern) and (expression, alias, label) not in metrics:
+                metrics.append((expression, alias, label))
+        average = bool(take(AVERAGE_PATTERN))
+        total = bool(take(TOTAL_PATTERN))
+        if not metrics and take(BARE_SALES_PATTERN):
+            metrics.append(SALES_QUANTITY_METRIC[1:])
+        if not strict:
+            period = None
+            if len(periods) == 1:
+                name, days = periods[0]
+                period = name if days is None else f"last_{days}_days"
+            return QuestionIntent(metrics, filters, period, average, matched_terms)
+        if not metrics or (average and total):
+            return None
+
+        leftover = "".join(" " if _overlaps((i, i + 1), consumed) else ch for i, ch in enumerate(text))
+        if any(word not in FILLER_WORDS for word in re.findall(r"\w+", leftover)):
+            return None
+
+        name, days = periods[0]
+        # Mirrors the worked example in prompt_template: a weekly sales quantity without
+        # "total" is reported as a per-day figure (SUM(SalesQuantity)/7).
+        if name == "last_week" and not total and metrics == [SALES_QUANTITY_METRIC[1:]]:
+            average = True
+        period = name if days is None else f"last_{days}_days"
+        return QuestionIntent(metrics, filters, period, average, matched_terms)
+
+
+def _overlaps(span, spans):
+    start, end = span[0], span[1]
+    return any(start < other_end and other_start < end for other_start, other_end in spans)
+
+
+def period_sql(period):
+    """Return (BillingDate predicate, day count expression, label) for a period name."""
+    match = re.fullmatch(r"last_(\d+)_days", period)
+    if match:
+        days = int(match.group(1))
+        predicate = f"BillingDate >= CAST(DATEADD(DAY, -{days}, GETDATE()) AS DATE) AND BillingDate < {TODAY}"
+        return predicate, str(days), f"in the last {days} days"
+    _, predicate, days, label = PERIODS[period]
+    return predicate, days, label
+
+
+def _quote(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def intent_to_sql(intent):
+    predicate, days, _ = period_sql(intent.period)
+    columns = []
+    for expression, alias, _ in intent.metrics:
+        if intent.average:
+            # COUNT() is an int; multiply first so T-SQL does not truncate the average
+            expression = f"{expression} * 1.0 / {days}" if expression.startswith("COUNT") else f"{expression}/{days}"
+        columns.append(f"{expression} AS {alias}")
+    conditions = []
+    for column, values in sorted(intent.filters.items()):
+        if len(values) == 1:
+            conditions.append(f"{column} = {_quote(values[0])}")
+        else:
+            conditions.append(f"{column} IN ({', '.join(_quote(v) for v in values)})")
+    conditions.append(predicate)
+    return f"SELECT {', '.join(columns)} FROM Dw.fsales WHERE {' AND '.join(conditions)};"
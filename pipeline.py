@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+
+import contractions
+
+from admission import QueryHandle
+from dimension_catalog import dimension_catalog, resolve_sql_values
+from dynamic_sql_generation import agenerate_sql_with_path, cache_translation
+from sql_guard import SHOWPLAN_ENABLED, guard_sql
+from summarizer import astream_natural_language
+from tracing import annotate, span, traced
+from warehouse import (
+    estimate_plan_cost, execute_sql_query, fix_sql_value_quoting, validate_sql_query, warm_up_connection,
+)
+
+# Per-stage time limits in seconds
+STAGE_TIMEOUTS = {
+    "translate": float(os.getenv("TRANSLATE_TIMEOUT_SECONDS", "60")),
+    "check": float(os.getenv("CHECK_TIMEOUT_SECONDS", "15")),
+    "execute": float(os.getenv("EXECUTE_TIMEOUT_SECONDS", "120")),
+    "summarize": float(os.getenv("SUMMARIZE_TIMEOUT_SECONDS", "30")),
+}
+
+# How often a running warehouse query reports progress to on_event
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("PROGRESS_INTERVAL_SECONDS", "1"))
+
+# Shared resource each stage uses, for callers that limit concurrency per resource
+STAGE_RESOURCES = {"translate": "llm", "execute": "db", "summarize": "llm"}
+
+# Message prefix used when a stage fails
+STAGE_ERRORS = {
+    "translate": "Error generating SQL query",
+    "check": "Query rejected",
+    "execute": "Error executing SQL query",
+    "summarize": "Error generating natural language summary",
+}
+
+
+@dataclass
+class PipelineResult:
+    question: str
+    sql: str = None
+    translation_path: str = None
+    results: object = None
+    summary: str = None
+    error: str = None
+    # stage name -> seconds
+    timings: dict = field(default_factory=dict)
+    # tracing.Trace with the span waterfall of this question
+    trace: object = None
+    # What resolve_sql_values and sql_guard changed or noticed about the query, for the user
+    notes: list = field(default_factory=list)
+
+
+class StageFailed(Exception):
+    pass
+
+
+async def run_stage(name, awaitable, result, emit, limits=None):
+    """
+    Await one stage under its timeout, recording its duration and reporting start/end events.
+    limits maps a STAGE_RESOURCES name to an asyncio.Semaphore held while the stage runs;
+    time spent waiting for it is recorded as "<stage>_wait" and does not count against the timeout.
+    """
+    limit = (limits or {}).get(STAGE_RESOURCES.get(name))
+    if limit is not None:
+        waited = time.perf_counter()
+        try:
+            await limit.acquire()
+        except BaseException:
+            # Cancelled while queued: the stage never starts
+            awaitable.close()
+            raise
+        result.timings[f"{name}_wait"] = time.perf_counter() - waited
+    emit("stage_start", name)
+    started = time.perf_counter()
+    try:
+        with span(name):
+            return await asyncio.wait_for(awaitable, STAGE_TIMEOUTS[name])
+    except asyncio.TimeoutError:
+        raise StageFailed(f"{STAGE_ERRORS[name]}: timed out after {STAGE_TIMEOUTS[name]:.0f}s")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise StageFailed(f"{STAGE_ERRORS[name]}: {e}") from e
+    finally:
+        result.timings[name] = time.perf_counter() - started
+        if limit is not None:
+            limit.release()
+        emit("stage_end", name)
+
+
+async def watch_query(awaitable, handle, emit):
+    """
+    Await a warehouse query, emitting "progress" every PROGRESS_INTERVAL_SECONDS with the seconds
+    elapsed and the query's place in the admission queue (None once it runs).
+    If the wait ends early (stage timeout, cancelled task, or on_event raising because the
+    session was rerun or closed) the query is cancelled on the server.
+    """
+    task = asyncio.ensure_future(awaitable)
+    # Once cancelled, the worker's QueryCancelled is expected and nobody awaits it
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    started = time.perf_counter()
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=PROGRESS_INTERVAL_SECONDS)
+            if done:
+                return task.result()
+            emit("progress", {
+                "stage": "execute",
+                "elapsed": time.perf_counter() - started,
+                "queue_position": handle.queue_position,
+            })
+    finally:
+        if not task.done():
+            handle.cancel()
+
+
+async def run_pipeline(user_query, on_event=None, limits=None):
+    """
+    Translate, execute and summarize one question.
+    on_event(kind, payload) is called from the event loop as work progresses:
+    "stage_start"/"stage_end" (stage name), "sql_token" and "summary_token" (streamed text),
+    "sql", "results" and "summary" (final values), "note" (a change made to the query or a
+    value that may be misspelt), "progress" (see watch_query) and "error" (message).
+    A stage that times out is cancelled. A warehouse query is also cancelled on the server
+    when its stage times out or the pipeline is abandoned; other blocking work already
+    running in a worker thread finishes in the background and its result is discarded.
+    Every question is traced (see tracing.py); result.trace holds its spans.
+    limits is passed to run_stage to cap concurrent LLM and database work across questions.
+    The LLM calls and the warehouse query are shared with identical ones already in flight
+    for other questions (see single_flight.py).
+    """
+    emit = on_event or (lambda kind, payload: None)
+    result = PipelineResult(user_query)
+
+    with traced(user_query) as trace:
+        result.trace = trace
+        await _run_traced(user_query, result, emit, limits)
+        trace.finish(result.error)
+    return result
+
+
+async def _run_traced(user_query, result, emit, limits):
+    """Body of run_pipeline, run inside the question's trace."""
+    # Open/validate a pooled connection while the LLM is still generating
+    warm_up = asyncio.create_task(asyncio.to_thread(warm_up_connection))
+    # Warm-up failures are not fatal; the execute stage reports connection errors itself
+    warm_up.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    try:
+        # Preprocess the user query before generating SQL
+        preprocessed_query = contractions.fix(user_query)
+        sql_query, result.translation_path = await run_stage(
+            "translate",
+            agenerate_sql_with_path(preprocessed_query, on_token=lambda token: emit("sql_token", token)),
+            result, emit, limits,
+        )
+        # Fix the case of values compared with catalog columns; other mismatches are only noted
+        with span("resolve_sql_values"):
+            sql_query, result.notes = resolve_sql_values(sql_query, dimension_catalog)
+        # Fix SQL value quoting based on column types
+        with span("fix_sql_value_quoting"):
+            result.sql = fix_sql_value_quoting(sql_query)
+        print(f"Generated SQL Query: {result.sql}")
+        emit("sql", result.sql)
+
+        with span("validate"):
+            valid, error_msg = validate_sql_query(result.sql)
+            annotate(valid=valid)
+        if not valid:
+            raise StageFailed(error_msg)
+
+        # Reject or bound runaway scans before they reach the warehouse
+        guarded = await run_stage(
+            "check",
+            asyncio.to_thread(guard_sql, result.sql, estimate_plan_cost if SHOWPLAN_ENABLED else None),
+            result, emit, limits,
+        )
+        if guarded.sql != result.sql:
+            result.sql = guarded.sql
+            emit("sql", result.sql)
+        result.notes += guarded.notes
+        for note in result.notes:
+            emit("note", note)
+        # Only checked translations are cached; the guard is applied again when they are reused
+        if result.translation_path == "llm":
+            cache_translation(preprocessed_query, sql_query)
+
+        handle = QueryHandle()
+        result.results = await run_stage(
+            "execute", watch_query(asyncio.to_thread(execute_sql_query, result.sql, handle), handle, emit),
+            result, emit, limits,
+        )
+        emit("results", result.results)
+
+        try:
+            result.summary = await run_stage(
+                "summarize",
+                astream_natural_language(result.results, user_query,
+                                         on_token=lambda token: emit("summary_token", token)),
+                result, emit, limits,
+            )
+        except StageFailed as e:
+            result.error = str(e)
+            emit("error", result.error)
+            result.summary = "Could not generate summary."
+        emit("summary", result.summary)
+    except StageFailed as e:
+        result.error = str(e)
+        emit("error", result.error)
@@ -0,0 +1,216 @@
+import hashlib
+import os
+import re
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1200"))
+
+HEADER = (
+    "You translate business questions into a single T-SQL query on the sales table `Dw.fsales`. "
+    "Reply with the SQL only, no explanations."
+)
+
+# name, type, description, pattern of question words that make the column relevant.
+# Columns without a pattern are always sent.
+COLUMNS = [
+    ("BillingDate", "date", "Date of billing", None),
+    ("BillingDocument", "bigint", "Sales bill number (UBC = COUNT(DISTINCT BillingDocument))", None),
+    ("SalesQuantity", "decimal", "Quantity sold", None),
+    ("NetAmount", "decimal", "Total without tax", r"net amount|sum\(netamount\)|revenue|value"),
+    ("TotalAmount", "decimal", "Total value including taxes", r"total amount|gross|sum\(totalamount\)"),
+    ("TotalTax", "decimal", "Total tax", r"tax"),
+    ("DId", "int", "Internal ID", r"\bdid\b"),
+    ("BillingDocumentItem", "int", "Item number in the bill", r"\bitems?\b|line"),
+    ("SalesOfficeID", "int", "Sales office code", r"office"),
+    ("DistributionChannel", "nvarchar(25)", "Sales distribution channel", r"channel|parlou?r|direct"),
+    ("DisivisonCode", "int", "Division code", r"division"),
+    ("Route", "nvarchar(25)", "Sales route", r"route"),
+    ("RouteDescription", "nvarchar(50)", "Route description", r"route|area|locality"),
+    ("CustomerGroup", "nvarchar(25)", "Customer group", r"customer group|parlou?r|hdc"),
+    ("CustomerID", "nvarchar(50)", "Customer ID", r"customer|outlet|retailer"),
+    ("ProductHeirachy1", "nvarchar(35)", "Product category level 1 (e.g., Milk)", r"product|categor|compare|\bvs\b|versus|top|highest|lowest"),
+    ("ProductHeirachy2", "nvarchar(35)", "Product category level 2 (e.g., Cow)", None),
+    ("ProductHeirachy3", "nvarchar(35)", "Product category level 3 (e.g., DTM)", None),
+    ("ProductHeirachy4", "nvarchar(35)", "Product category level 4 (e.g., Sachets)", r"pack"),
+    ("ProductHeirachy5", "nvarchar(35)", "Product category level 5 (e.g., 500 ML)", r"size|\bsku"),
+    ("Materialgroup", "nvarchar(35)", "Material group", r"material"),
+    ("SubMaterialgroup1", "nvarchar(35)", "Sub-material group level 1", r"material|dairy"),
+    ("SubMaterialgroup2", "nvarchar(35)", "Sub-material group level 2", r"material|\bvap\b|fat"),
+    ("SubMaterialgroup3", "nvarchar(35)", "Sub-material group level 3", r"material"),
+    ("MaterialCode", "int", "Material code", r"material code|sku|\bcode\b"),
+    ("SalesUnit", "nvarchar(5)", "Unit of measurement", r"\bunit"),
+    ("EffectiveStartDate", "datetime", "Contract/validity start", r"effective|validity|contract"),
+    ("EffectiveEndDate", "datetime", "Contract/validity end", r"effective|validity|contract"),
+    ("IsActive", "bit", "1 = active", r"active"),
+    ("SalesOrganizationCode", "int", "Sales org code", r"organi[sz]ation|\borg\b"),
+    ("SalesOrgCodeDesc", "nvarchar(50)", "Sales org description", r"organi[sz]ation|\borg\b"),
+    ("ItemCategory", "nvarchar(75)", "Item category", r"item category"),
+    ("ShipToParty", "nvarchar(30)", "Shipping partner ID", r"ship"),
+]
+
+# Sample values sent along with a column when it is relevant
+SAMPLE_VALUES = {
+    "ProductHeirachy1": "Milk, Curd, Flav.Milk, Ghee, Frozen Dessert, Cream, ButterMilk, Lassi, Milk Cake, IceCream",
+    "ProductHeirachy2": "Cow, Buffalo, Default, Mixed",
+    "ProductHeirachy3": "DTM, STD Milk, Plain, Mango Tango, STANDY, Pista, TM, FCM, BFCM, Pine Apple, Caramel Ripple Sundae",
+    "ProductHeirachy4": "Sachets, Poly Pack, Tetra Pack, Matka, Cup, Pillow Pack, Bucket, Cone, Stick (Ice Cream), Glass Bottle",
+    "ProductHeirachy5": "500 ML, 1000 GMS, 165 GMS, 10 KG, 9.1 KG, 200 GMS, 60ML, 400 GMS, 475 GMS, 350 ML",
+    "SalesUnit": "CAR, L, KG, EA",
+    "DistributionChannel": "Parlours, Direct",
+    "DisivisonCode": "1, 4, 3, 2",
+    "CustomerGroup": "Parlours, HDC",
+    "Materialgroup": "MILK, UHT MILK, BUTTER MILK, BUCKET CURD, ICE CREAM/FD, SWEET LASSI (POUCH), CHEESE, "
+                     "BUTTER MILK (CUP), POUCH CURD, FRUIT LASSI (CUP)",
+    "SubMaterialgroup1": "Non-Dairy, Dairy, Dairy-Tradable Goods",
+    "SubMaterialgroup2": "Milk, VAP, Fat (Bulk), Fat (CP)",
+    "SubMaterialgroup3": "Milk - STD, Milk - FCM, VAP-Ice Cream, VAP-Butter Milk (Plain), Milk-TM-Special, "
+                         "VAP-Curd (Pouch), Milk-TM-Family, VAP-Lassi(Sweet), Milk - BFCM, VAP-Frozen Dessert",
+    "ItemCategory": "L2N, ZREN, G2N, ZZMS, ZMTS",
+    "Route": "1942G, 1942J, 1940U, 1942F, 1945B, 1942B, 1981A, 1981B, 1941Q, 1965B",
+    "RouteDescription": "LB NAGAR TO VANASTALIPURAM, LB NAGAR TO SANTOSHNAGAR, Uppal-Vidyanagar-D.D.colony, "
+                        "KALLURU S O < > Khammam Local, Erragadda-MLA Colony-Banjarahills",
+}
+
+# Rules that apply to every question
+CORE_RULES = [
+    "Always use the table `Dw.fsales`; use only the columns listed above.",
+    "Enclose string values, including product hierarchy values, in single quotes (e.g. 'Milk').",
+    "Filter `BillingDate` by the time reference in the question (yesterday, last week, this month, ...).",
+    "UBC (unique billing count) is `COUNT(DISTINCT BillingDocument)`.",
+    "Use `SUM(SalesQuantity)` for sales quantity or total sales, `SUM(NetAmount)` for net amount.",
+    "Never use placeholder values such as example_value.",
+]
+
+# (pattern, rule) pairs sent only when the question matches
+CONDITIONAL_RULES = [
+    (r"average|avg|per day|daily", "For an average, divide the total by the number of days in the period (7 for a week, 30 for a month)."),
+    (r"\btotal\b", "For a total, use the SUM without dividing by the number of days."),
+    (r"top|highest|lowest|best|worst|compare|\bvs\b|versus",
+     "For top/highest or comparisons, normalise over the period (divide by 7 for a week, 30 for a month), "
+     "GROUP BY the compared column and ORDER BY the metric."),
+    (r"week|\blw\b|\bpw\b|wtd", "\"Last week\" is the previous calendar week, Monday to Sunday."),
+    (r"\bby\b|each|per (?!day)|wise|list|different|unique|distinct",
+     "Use GROUP BY for breakdowns (by route, product, ...) and DISTINCT for lists of different values."),
+]
+
+# (question, SQL, pattern of question words that make the example relevant)
+EXAMPLES = [
+    ("What is the sales quantity for Milk DTM sale for last week?",
+     "SELECT SUM(SalesQuantity)/7 FROM Dw.fsales WHERE ProductHeirachy1 = 'Milk' AND ProductHeirachy3 = 'DTM' "
+     "AND BillingDate BETWEEN DATEADD(DAY, 1 - DATEPART(WEEKDAY, GETDATE()), DATEADD(WEEK, -1, GETDATE())) "
+     "AND DATEADD(DAY, 7 - DATEPART(WEEKDAY, GETDATE()), DATEADD(WEEK, -1, GETDATE()));",
+     r"sales quantity|salesquantity|week"),
+    ("What's the total sales for today?",
+     "SELECT SUM(SalesQuantity) FROM Dw.fsales WHERE BillingDate = CAST(GETDATE() AS DATE);",
+     r"total|today"),
+    ("Show UBC and Net Amount for last week by route",
+     "SELECT Route, COUNT(DISTINCT BillingDocument), SUM(NetAmount) FROM Dw.fsales "
+     "WHERE BillingDate >= DATEADD(week, -1, GETDATE()) GROUP BY Route;",
+     r"ubc|billingdocument|net amount|netamount|route|\bby\b"),
+    ("Compare sales of Milk vs Curd in April",
+     "SELECT ProductHeirachy1, SUM(SalesQuantity) FROM Dw.fsales WHERE ProductHeirachy1 IN ('Milk', 'Curd') "
+     "AND BillingDate >= '2025-04-01' AND BillingDate < '2025-05-01' GROUP BY ProductHeirachy1;",
+     r"compare|\bvs\b|versus|january|february|march|april|may|june|july|august|september|october|november|december"),
+    ("Top 5 selling products in the last 30 days",
+     "SELECT TOP 5 ProductHeirachy1, SUM(SalesQuantity) FROM Dw.fsales WHERE BillingDate >= DATEADD(day, -30, GETDATE()) "
+     "GROUP BY ProductHeirachy1 ORDER BY SUM(SalesQuantity) DESC;",
+     r"top|highest|best|selling|days"),
+    ("Which product had the highest UBC in Route 1942G this month?",
+     "SELECT TOP 1 ProductHeirachy1, COUNT(DISTINCT BillingDocument) FROM Dw.fsales WHERE Route = '1942G' "
+     "AND BillingDate >= DATEADD(MONTH, DATEDIFF(MONTH, 0, GETDATE()), 0) "
+     "GROUP BY ProductHeirachy1 ORDER BY COUNT(DISTINCT BillingDocument) DESC;",
+     r"highest|route|ubc|billingdocument"),
+    ("Average sales of milk per day last week",
+     "SELECT SUM(SalesQuantity)/7 FROM Dw.fsales WHERE ProductHeirachy1 = 'Milk' "
+     "AND BillingDate >= DATEADD(week, -1, GETDATE());",
+     r"average|avg|per day"),
+]
+MAX_EXAMPLES = 3
+
+_token_encoding = None
+
+
+def count_tokens(text):
+    """Count GPT-4 tokens with tiktoken when available, otherwise estimate ~4 characters per token."""
+    global _token_encoding
+    if _token_encoding is None:
+        try:
+            import tiktoken
+            _token_encoding = tiktoken.encoding_for_model("gpt-4")
+        except Exception:
+            _token_encoding = False
+    if _token_encoding:
+        return len(_token_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def prompt_fingerprint():
+    """Hash of everything the builder can send, so caches keyed on it reset when it changes."""
+    content = repr((HEADER, COLUMNS, SAMPLE_VALUES, CORE_RULES, CONDITIONAL_RULES, EXAMPLES, MAX_EXAMPLES))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _matches(pattern, text):
+    return pattern is not None and re.search(pattern, text, re.IGNORECASE) is not None
+
+
+def _render(columns, samples, rules, examples):
+    lines = [HEADER, "", "### Table: Dw.fsales (column | type | description)"]
+    lines += [f"{name} | {col_type} | {description}" for name, col_type, description, _ in columns]
+    if samples:
+        lines += ["", "### Sample values"]
+        lines += [f"- {name}: {values}" for name, values in samples]
+    lines += ["", "### Rules"]
+    lines += [f"- {rule}" for rule in rules]
+    if examples:
+        lines += ["", "### Examples"]
+        lines += [f"Q: {question}\nSQL: {sql}" for question, sql, _ in examples]
+    return "\n".join(lines)
+
+
+def build_prompt_context(question, hierarchy_columns=(), max_tokens=PROMPT_MAX_TOKENS):
+    """
+    Assemble the schema, sample values, rules and examples relevant to the question.
+    hierarchy_columns are the catalog columns (ProductHeirachy, Route, ...) of the terms detected in it.
+    Optional parts are dropped, least relevant first, until the prompt fits max_tokens.
+    Returns (context text, token count).
+    """
+    hierarchy_columns = set(hierarchy_columns)
+    columns = [
+        column for column in COLUMNS
+        if (column[3] is None and not column[0].startswith("ProductHeirachy"))
+        or column[0] in hierarchy_columns or _matches(column[3], question)
+    ]
+    # Hierarchy levels are always described together so the model can pick the right one
+    if any(name.startswith("ProductHeirachy") for name, _, _, _ in columns):
+        columns = [c for c in COLUMNS if c in columns or c[0].startswith("ProductHeirachy")]
+    column_names = [name for name, _, _, _ in columns]
+    # Sample values for detected hierarchy levels first, then the other selected columns
+    samples = [(name, SAMPLE_VALUES[name]) for name in column_names if name in hierarchy_columns and name in SAMPLE_VALUES]
+    samples += [(name, SAMPLE_VALUES[name]) for name in column_names
+                if name not in hierarchy_columns and name in SAMPLE_VALUES
+                and (name == "ProductHeirachy1" or not name.startswith("ProductHeirachy"))]
+    conditional = [rule for pattern, rule in CONDITIONAL_RULES if _matches(pattern, question)]
+    scored = sorted(
+        ((len(re.findall(pattern, question, re.IGNORECASE)), i) for i, (_, _, pattern) in enumerate(EXAMPLES)),
+        key=lambda item: (-item[0], item[1]),
+    )
+    examples = [EXAMPLES[i] for score, i in scored[:MAX_EXAMPLES] if score > 0] or [EXAMPLES[0]]
+
+    text = _render(columns, samples, CORE_RULES + conditional, examples)
+    tokens = count_tokens(text)
+    # Trim in order of least value: extra examples, sample values, conditional rules, optional columns
+    while tokens > max_tokens:
+        if len(examples) > 1:
+            examples = examples[:-1]
+        elif samples:
+            samples = samples[:-1]
+        elif conditional:
+            conditional = conditional[:-1]
+        elif any(column[3] is not None and column[0] not in hierarchy_columns for column in columns):
+            optional = [column for column in columns if column[3] is not None and column[0] not in hierarchy_columns]
+            columns.remove(optional[-1])
+        else:
+            break
+        text = _render(columns, samples, CORE_RULES + conditional, examples)
+        tokens = count_tokens(text)
+    return text, tokens
@@ -0,0 +1,140 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from term_matcher import SQL_STRING_LITERAL
+from translation_cache import SQL_RELATIVE_DATE_PATTERN
+
+_SQL_LITERAL_OR_WHITESPACE = re.compile(rf"({SQL_STRING_LITERAL})|\s+")
+
+
+def normalize_sql(sql_query: str) -> str:
+    # Collapse whitespace and case outside string literals; literals are kept verbatim
+    parts = []
+    last = 0
+    for match in _SQL_LITERAL_OR_WHITESPACE.finditer(sql_query):
+        parts.append(sql_query[last:match.start()].lower())
+        parts.append(match.group(1) if match.group(1) is not None else " ")
+        last = match.end()
+    parts.append(sql_query[last:].lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def estimate_size(results) -> int:
+    """Rough in-memory size of a query result in bytes."""
+    if results is None:
+        return 0
+    if hasattr(results, "memory_usage"):
+        # pandas DataFrame
+        return int(results.memory_usage(index=True, deep=True).sum())
+    size = sys.getsizeof(results)
+    for row in results:
+        size += sys.getsizeof(row)
+        for value in row.values():
+            size += sys.getsizeof(value)
+    return size
+
+
+class ResultCache:
+    """
+    Memory-bounded LRU cache of warehouse query results.
+    Every entry is stamped with the warehouse load watermark it was computed under;
+    when the watermark moves (new data landed) all older entries are dropped.
+    SQL that resolves dates on the server (GETDATE()) is also keyed by today's date, since
+    "yesterday" is another day after midnight even when no new data has landed.
+    """
+
+    def __init__(self, max_bytes, watermark_interval=60, today=date.today):
+        self.max_bytes = max_bytes
+        # Returns the current date; replaceable to check behaviour across midnight
+        self.today = today
+        # How often (seconds) the watermark query is allowed to run
+        self.watermark_interval = watermark_interval
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._entries = OrderedDict()  # key() -> (watermark, results, size)
+        self._bytes = 0
+        self._watermark = None
+        self._watermark_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def key(self, sql_query):
+        """Cache key of a query: its normalized SQL, plus today's date if it uses GETDATE() and the like."""
+        key = normalize_sql(sql_query)
+        if SQL_RELATIVE_DATE_PATTERN.search(sql_query):
+            key += f" -- {self.today().isoformat()}"
+        return key
+
+    def watermark(self, load_watermark):
+        """
+        Return the current load watermark, calling load_watermark() at most once per interval.
+        Returns None when it cannot be determined, which disables caching for that query.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._watermark is not None and now - self._watermark_checked_at < self.watermark_interval:
+                return self._watermark
+        try:
+            watermark = load_watermark()
+        except Exception:
+            return None
+        with self._lock:
+            if watermark != self._watermark:
+                if self._entries:
+                    self.counters["invalidations"] += 1
+                self._entries.clear()
+                self._bytes = 0
+                self._watermark = watermark
+            self._watermark_checked_at = now
+        return watermark
+
+    def get(self, sql_query, watermark):
+        if watermark is None:
+            return None
+        key = self.key(sql_query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != watermark:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def put(self, sql_query, watermark, results):
+        if watermark is None or results is None:
+            return
+        size = estimate_size(results)
+        if size > self.max_bytes:
+            return
+        key = self.key(sql_query)
+        with self._lock:
+            if watermark != self._watermark:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (watermark, results, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["watermark"] = self._watermark
+        return stats
+
+
+# Process-wide instance shared by every Streamlit session
+result_cache = ResultCache(
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    watermark_interval=float(os.getenv("RESULT_CACHE_WATERMARK_SECONDS", "60")),
+)
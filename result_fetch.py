@@ -0,0 +1,48 @@
+import os
+from decimal import Decimal
+
+import pandas as pd
+
+MAX_RESULT_ROWS = int(os.getenv("MAX_RESULT_ROWS", "100000"))
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "5000"))
+
+
+def iter_row_batches(cursor, max_rows=MAX_RESULT_ROWS, batch_size=FETCH_BATCH_SIZE):
+    """Yield lists of rows with fetchmany, stopping once max_rows rows have been read."""
+    remaining = max_rows
+    while remaining > 0:
+        rows = cursor.fetchmany(min(batch_size, remaining))
+        if not rows:
+            return
+        remaining -= len(rows)
+        yield rows
+
+
+def fetch_frame(cursor, max_rows=MAX_RESULT_ROWS, batch_size=FETCH_BATCH_SIZE):
+    """
+    Stream the cursor into a column-oriented DataFrame holding at most max_rows rows.
+    The frame's attrs["truncated"] is True when the query had more rows than that.
+    """
+    columns = [column[0] for column in cursor.description]
+    decimal_columns = {i for i, column in enumerate(cursor.description) if column[1] is Decimal}
+    values = [[] for _ in columns]
+    fetched = 0
+    for rows in iter_row_batches(cursor, max_rows, batch_size):
+        # Transpose each batch straight into per-column lists; no per-row dicts
+        for column_values, batch_values in zip(values, zip(*rows)):
+            column_values.extend(batch_values)
+        fetched += len(rows)
+    truncated = fetched >= max_rows and cursor.fetchone() is not None
+
+    data = {}
+    for i in range(len(columns)):
+        column_values, values[i] = values[i], None
+        if i in decimal_columns:
+            # SQL Server decimals arrive as Decimal objects; float64 is far more compact
+            column_values = pd.Series(column_values, dtype="float64")
+        data[i] = column_values
+    # Columns are keyed by position so unnamed or duplicate names (e.g. two bare SUM()s) survive
+    frame = pd.DataFrame(data)
+    frame.columns = columns
+    frame.attrs["truncated"] = truncated
+    return frame
@@ -0,0 +1,310 @@
+"""
+Daily rollups of Dw.fsales and a rewriter that sends eligible queries to them.
+
+Two rollup tables share the fact table's column names, so an eligible query is
+rewritten by swapping only the table name:
+- Dw.fsales_daily_rollup: one row per date x hierarchy x route x sales office with
+  the summed measures. Answers SUM() queries.
+- Dw.fsales_daily_bills: the same grain plus BillingDocument. COUNT(DISTINCT BillingDocument)
+  (UBC) is not additive, neither across days nor across hierarchy values or routes,
+  because one bill spans several products. Keeping the bill number lets any filter or
+  grouping over these dimensions count distinct bills exactly.
+
+Run `python rollups.py` after each warehouse load (e.g. from cron) to create the
+tables if needed and refresh them incrementally.
+"""
+import argparse
+import os
+import threading
+import time
+
+from sql_tokens import SQLTokenizeError, identifier_name, tokenize
+
+BASE_TABLE = "Dw.fsales"
+DAILY_ROLLUP_TABLE = "Dw.fsales_daily_rollup"
+BILL_ROLLUP_TABLE = "Dw.fsales_daily_bills"
+STATE_TABLE = "Dw.fsales_rollup_state"
+
+DIMENSIONS = [
+    "BillingDate", "ProductHeirachy1", "ProductHeirachy2", "ProductHeirachy3", "ProductHeirachy4",
+    "ProductHeirachy5", "Route", "SalesOfficeID",
+]
+MEASURES = ["SalesQuantity", "NetAmount", "TotalAmount", "TotalTax"]
+
+# Base table watermark recorded with each refresh; must match warehouse.WATERMARK_SQL, which
+# the router compares it with (main() passes that one)
+BASE_WATERMARK_SQL = f"SELECT MAX(BillingDate) FROM {BASE_TABLE}"
+# Days before the last refreshed date that are rebuilt on every refresh, for late-arriving rows
+ROLLUP_LOOKBACK_DAYS = int(os.getenv("ROLLUP_LOOKBACK_DAYS", "3"))
+
+_DIMENSION_DDL = """
+    BillingDate date NOT NULL,
+    ProductHeirachy1 nvarchar(35) NULL,
+    ProductHeirachy2 nvarchar(35) NULL,
+    ProductHeirachy3 nvarchar(35) NULL,
+    ProductHeirachy4 nvarchar(35) NULL,
+    ProductHeirachy5 nvarchar(35) NULL,
+    Route nvarchar(25) NULL,
+    SalesOfficeID int NULL,"""
+_MEASURE_DDL = """
+    SalesQuantity decimal(38, 3) NULL,
+    NetAmount decimal(38, 2) NULL,
+    TotalAmount decimal(38, 2) NULL,
+    TotalTax decimal(38, 2) NULL"""
+
+CREATE_STATEMENTS = [
+    f"""IF OBJECT_ID('{DAILY_ROLLUP_TABLE}') IS NULL
+CREATE TABLE {DAILY_ROLLUP_TABLE} ({_DIMENSION_DDL}{_MEASURE_DDL},
+    LineCount int NOT NULL
+)""",
+    f"""IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_fsales_daily_rollup_date')
+CREATE CLUSTERED INDEX IX_fsales_daily_rollup_date ON {DAILY_ROLLUP_TABLE} (BillingDate, ProductHeirachy1)""",
+    f"""IF OBJECT_ID('{BILL_ROLLUP_TABLE}') IS NULL
+CREATE TABLE {BILL_ROLLUP_TABLE} ({_DIMENSION_DDL}
+    BillingDocument varchar(20) NOT NULL,{_MEASURE_DDL}
+)""",
+    f"""IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_fsales_daily_bills_date')
+CREATE CLUSTERED INDEX IX_fsales_daily_bills_date ON {BILL_ROLLUP_TABLE} (BillingDate, ProductHeirachy1)""",
+    f"""IF OBJECT_ID('{STATE_TABLE}') IS NULL
+CREATE TABLE {STATE_TABLE} (
+    RefreshedFrom date NULL,
+    SourceWatermark nvarchar(100) NULL,
+    RefreshedAt datetime2 NOT NULL
+)""",
+    # SourceWatermark was a date; the watermark query may return a load id or timestamp instead
+    f"""IF EXISTS (SELECT 1 FROM sys.columns WHERE object_id = OBJECT_ID('{STATE_TABLE}')
+    AND name = 'SourceWatermark' AND system_type_id = TYPE_ID('date'))
+ALTER TABLE {STATE_TABLE} ALTER COLUMN SourceWatermark nvarchar(100) NULL""",
+]
+
+
+def create_rollup_tables(conn):
+    cursor = conn.cursor()
+    for statement in CREATE_STATEMENTS:
+        cursor.execute(statement)
+    conn.commit()
+
+
+def refresh_rollups(conn, lookback_days=ROLLUP_LOOKBACK_DAYS, full=False, watermark_sql=BASE_WATERMARK_SQL):
+    """
+    Rebuild the rollup rows from (last refreshed date - lookback_days) onwards, or everything
+    if full or the rollups are empty, and record the base table watermark they reflect, as
+    read by watermark_sql before the rebuild (the query the router's watermark comes from).
+    Returns the first date that was rebuilt (None for a full rebuild).
+    """
+    cursor = conn.cursor()
+    start = None
+    if not full:
+        cursor.execute(f"SELECT DATEADD(DAY, -?, MAX(BillingDate)) FROM {DAILY_ROLLUP_TABLE}", lookback_days)
+        start = cursor.fetchone()[0]
+    cursor.execute(watermark_sql)
+    source_watermark = cursor.fetchone()[0]
+
+    dimensions = ", ".join(DIMENSIONS)
+    sums = ", ".join(f"SUM({measure})" for measure in MEASURES)
+    where, params = ("WHERE BillingDate >= ?", [start]) if start is not None else ("", [])
+    for table in (DAILY_ROLLUP_TABLE, BILL_ROLLUP_TABLE):
+        cursor.execute(f"DELETE FROM {table} {where}", *params)
+    cursor.execute(
+        f"INSERT INTO {DAILY_ROLLUP_TABLE} ({dimensions}, {', '.join(MEASURES)}, LineCount) "
+        f"SELECT {dimensions}, {sums}, COUNT(*) FROM {BASE_TABLE} {where} GROUP BY {dimensions}",
+        *params,
+    )
+    cursor.execute(
+        f"INSERT INTO {BILL_ROLLUP_TABLE} ({dimensions}, BillingDocument, {', '.join(MEASURES)}) "
+        f"SELECT {dimensions}, BillingDocument, {sums} FROM {BASE_TABLE} {where} "
+        f"GROUP BY {dimensions}, BillingDocument",
+        *params,
+    )
+    cursor.execute(f"DELETE FROM {STATE_TABLE}")
+    cursor.execute(
+        f"INSERT INTO {STATE_TABLE} (RefreshedFrom, SourceWatermark, RefreshedAt) VALUES (?, ?, SYSDATETIME())",
+        start, None if source_watermark is None else str(source_watermark),
+    )
+    conn.commit()
+    return start
+
+
+def load_rollup_watermark(conn):
+    """Base table watermark the rollups were last refreshed against."""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MAX(SourceWatermark) FROM {STATE_TABLE}")
+    return cursor.fetchone()[0]
+
+
+# Identifiers that may appear in an eligible query besides the rollup columns
+_ALLOWED_WORDS = {
+    "select", "top", "distinct", "from", "where", "and", "or", "not", "in", "between", "is", "null",
+    "like", "group", "by", "order", "asc", "desc", "having", "as", "case", "when", "then", "else", "end",
+    "percent", "with", "ties",
+    # functions
+    "sum", "count", "min", "max", "cast", "convert", "getdate", "sysdatetime", "dateadd", "datediff",
+    "datepart", "datefromparts", "eomonth", "year", "month", "day", "isnull", "coalesce", "round",
+    "nullif", "format",
+    # types and date parts
+    "date", "datetime", "datetime2", "int", "bigint", "decimal", "numeric", "float", "varchar", "nvarchar",
+    "week", "wk", "ww", "weekday", "dw", "quarter", "qq", "q", "dayofyear", "dy", "y", "dd", "d", "mm", "m",
+    "yy", "yyyy", "iso_week", "isowk",
+}
+# Aggregates that give different answers on pre-summed rows
+_NON_ADDITIVE = {"avg", "stdev", "stdevp", "var", "varp", "count_big", "string_agg"}
+_DIMENSION_NAMES = {name.lower() for name in DIMENSIONS}
+_MEASURE_NAMES = {name.lower() for name in MEASURES}
+
+
+def choose_rollup(sql_query):
+    """
+    Return (start, end, table) when the query can be answered from a rollup: the span of
+    the Dw.fsales reference to replace and the rollup table to use. Returns None otherwise.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except SQLTokenizeError:
+        return None
+    if tokens and tokens[-1].text == ";":
+        tokens = tokens[:-1]
+    words = [identifier_name(t) if t.kind == "identifier" else None for t in tokens]
+    if not tokens or words[0] != "select" or words.count("select") != 1 or words.count("from") != 1:
+        return None
+    # A second statement, or SELECT * which would return the rollup's own columns
+    if any(t.text == ";" or (t.text == "*" and words[i - 1] in ("select", "distinct"))
+           for i, t in enumerate(tokens)):
+        return None
+
+    from_index = words.index("from")
+    table_tokens = tokens[from_index + 1:from_index + 4]
+    if len(table_tokens) < 3 or [identifier_name(table_tokens[0]), table_tokens[1].text,
+                                 identifier_name(table_tokens[2])] != ["dw", ".", "fsales"]:
+        return None
+    table_start, table_end = table_tokens[0].start, table_tokens[2].end
+    after_table = from_index + 4
+    if after_table < len(tokens) and words[after_table] not in (None, "where", "group", "order", "having"):
+        # Table alias, JOIN, APPLY, UNION, ... are not handled
+        return None
+
+    aliases = {words[i + 1] for i in range(len(tokens) - 1) if words[i] == "as" and words[i + 1]}
+    order_index = words.index("order") if "order" in words else len(tokens)
+    needs_bills = False
+    for i, token in enumerate(tokens):
+        if i in (from_index + 1, from_index + 3) or token.kind != "identifier":
+            continue
+        word = words[i]
+        previous = [t.text.lower() for t in tokens[max(0, i - 3):i]]
+        following = tokens[i + 1].text if i + 1 < len(tokens) else ""
+        if word in _NON_ADDITIVE or word in ("over", "into", "join", "union", "apply", "exec", "execute"):
+            return None
+        if word in _MEASURE_NAMES:
+            # Measures are pre-summed, so only SUM(measure) stays correct; a measure name may
+            # still be reused as a column alias ("AS NetAmount ... ORDER BY NetAmount")
+            alias_use = word in aliases and (previous[-1:] == ["as"] or i > order_index)
+            if not alias_use and (previous[-2:] != ["sum", "("] or following != ")"):
+                return None
+        elif word == "billingdocument":
+            if previous != ["count", "(", "distinct"] or following != ")":
+                return None
+            needs_bills = True
+        elif word == "count":
+            # COUNT(*) / COUNT(column) count fact lines, not rollup rows
+            if tokens[i + 2:i + 3] and identifier_name(tokens[i + 2]) != "distinct":
+                return None
+        elif word not in _DIMENSION_NAMES and word not in _ALLOWED_WORDS and word not in aliases:
+            return None
+    return table_start, table_end, BILL_ROLLUP_TABLE if needs_bills else DAILY_ROLLUP_TABLE
+
+
+class RollupRouter:
+    """
+    Redirects eligible queries to the rollup tables, but only while the rollups were
+    refreshed against the same base table watermark the caller sees; otherwise (or if
+    the state cannot be read) every query stays on Dw.fsales, which is logged once per
+    pair of watermarks.
+    """
+
+    def __init__(self, state_interval=60, enabled=True):
+        self.enabled = enabled
+        self.state_interval = state_interval
+        self.counters = {"rewritten": 0, "base_table": 0, "stale": 0, "fallbacks": 0}
+        self._rollup_watermark = None
+        self._checked_at = 0.0
+        self._logged_stale = None
+        self._lock = threading.Lock()
+
+    def _current_rollup_watermark(self, load_rollup_state):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.state_interval:
+                return self._rollup_watermark
+        try:
+            watermark = load_rollup_state()
+        except Exception:
+            watermark = None
+        with self._lock:
+            self._rollup_watermark = watermark
+            self._checked_at = now
+        return watermark
+
+    def route(self, sql_query, base_watermark, load_rollup_state):
+        """Return the SQL to run: rewritten to a rollup when eligible and fresh, else unchanged."""
+        if not self.enabled:
+            return sql_query
+        choice = choose_rollup(sql_query)
+        if choice is None:
+            with self._lock:
+                self.counters["base_table"] += 1
+            return sql_query
+        rollup_watermark = self._current_rollup_watermark(load_rollup_state)
+        if base_watermark is None or rollup_watermark is None or str(rollup_watermark) != str(base_watermark):
+            with self._lock:
+                self.counters["stale"] += 1
+                log = self._logged_stale != (rollup_watermark, base_watermark)
+                self._logged_stale = (rollup_watermark, base_watermark)
+            if log:
+                print(f"Rollups skipped: refreshed against watermark {rollup_watermark}, "
+                      f"the base table is at {base_watermark}")
+            return sql_query
+        start, end, table = choice
+        with self._lock:
+            self.counters["rewritten"] += 1
+        return sql_query[:start] + table + sql_query[end:]
+
+    def record_fallback(self):
+        """A rewritten query failed and was re-run on the base table."""
+        with self._lock:
+            self.counters["fallbacks"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+# Process-wide router used by warehouse.execute_sql_query
+rollup_router = RollupRouter(
+    state_interval=float(os.getenv("RESULT_CACHE_WATERMARK_SECONDS", "60")),
+    enabled=os.getenv("ROLLUPS_ENABLED", "1") == "1",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and refresh the Dw.fsales daily rollups.")
+    parser.add_argument("--full", action="store_true", help="rebuild every date instead of refreshing incrementally")
+    parser.add_argument("--lookback-days", type=int, default=ROLLUP_LOOKBACK_DAYS)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from warehouse import WATERMARK_SQL, connect_to_warehouse
+
+    conn = connect_to_warehouse()
+    try:
+        create_rollup_tables(conn)
+        started = time.perf_counter()
+        start = refresh_rollups(
+            conn, lookback_days=args.lookback_days, full=args.full, watermark_sql=WATERMARK_SQL,
+        )
+        print(f"Refreshed rollups from {start or 'the beginning'} in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Single-flight coalescing of identical work that is in flight at the same time.
+
+Streamlit runs every session in its own thread with its own event loop, so when many
+users ask the same question at once each would make its own LLM call and warehouse
+query. A SingleFlight lets the first caller for a key (the leader) do the work while
+identical calls arriving before it finishes (duplicates) wait for its result, from any
+thread or event loop. The leader's result, or its exception, is handed to every waiter.
+
+If the leader is abandoned instead (its task cancelled because its session reran or its
+stage timed out, or one of the flight's abandon_on exceptions such as QueryCancelled),
+its waiters are not failed with it: one of them becomes the new leader and runs the call.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, wait
+
+from tracing import annotate
+
+# How often a blocked waiter calls its check() to see whether it should stop waiting
+WAIT_POLL_SECONDS = 0.25
+
+
+class Abandoned(Exception):
+    """The leader stopped without a result; its waiters should run the call themselves."""
+
+
+class SingleFlight:
+    def __init__(self, name, abandon_on=()):
+        self.name = name
+        # Exceptions that end only the leader's own interest in the result
+        self.abandon_on = tuple(abandon_on)
+        self._calls = {}  # key -> concurrent.futures.Future of the call in flight
+        self._lock = threading.Lock()
+        self.counters = {"leaders": 0, "duplicates": 0, "errors": 0, "abandoned": 0}
+
+    def _join(self, key):
+        """The future of the call in flight for key and whether the caller must run it (leads)."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.counters["duplicates"] += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self.counters["leaders"] += 1
+            return future, True
+
+    def _settle(self, key, future, value=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+            if isinstance(error, Abandoned):
+                self.counters["abandoned"] += 1
+            elif error is not None:
+                self.counters["errors"] += 1
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def _shared(self):
+        # Counted per flight in askdb_coalesced_requests_total when the question's trace is recorded
+        annotate(coalesced=self.name)
+
+    def do(self, key, function, *args, check=None):
+        """
+        Call function(*args), or wait for the identical call already in flight for key.
+        check() is called while waiting and may raise to stop waiting (e.g. when cancelled).
+        Returns (value, shared), shared being True when another caller's result was used.
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    value = function(*args)
+                except BaseException as e:
+                    abandoned = not isinstance(e, Exception) or isinstance(e, self.abandon_on)
+                    self._settle(key, future, error=Abandoned() if abandoned else e)
+                    raise
+                self._settle(key, future, value=value)
+                return value, False
+            self._shared()
+            try:
+                while not wait([future], WAIT_POLL_SECONDS).done:
+                    if check is not None:
+                        check()
+                return future.result(), True
+            except Abandoned:
+                continue
+
+    async def ado(self, key, function, *args):
+        """Async variant of do() for a coroutine function; waiting is cancelled with the caller's task."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    value = await function(*args)
+                except BaseException as e:
+                    abandoned = not isinstance(e, Exception) or isinstance(e, self.abandon_on)
+                    self._settle(key, future, error=Abandoned() if abandoned else e)
+                    raise
+                self._settle(key, future, value=value)
+                return value, False
+            self._shared()
+            try:
+                # Shielded so that one waiter being cancelled does not cancel the shared future
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except Abandoned:
+                continue
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self._calls)
+        return stats
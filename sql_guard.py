@@ -0,0 +1,709 @@
+"""
+Cost guard for generated SQL, applied before anything reaches the warehouse.
+
+The query is parsed into a tree of SELECT statements (one per query or subquery) with
+their clauses as token ranges, and checked against these policies:
+- one SELECT statement only: no batches, DML/DDL, EXEC, INTO, UNION or SELECT *
+- only allowlisted tables (Dw.fsales), columns and functions
+- every SELECT reading Dw.fsales has a constant lower BillingDate bound, covering at most
+  SQL_GUARD_MAX_SPAN_DAYS days; a missing or unevaluable bound is rejected or, with
+  SQL_GUARD_MISSING_DATE=rewrite, replaced by the last SQL_GUARD_DEFAULT_DAYS days
+- row-returning queries get a TOP, so the server never streams more than we fetch
+- optionally, the optimizer's estimated cost (SET SHOWPLAN_XML) stays below
+  SQL_GUARD_MAX_PLAN_COST
+Rejections raise QueryRejected with a message meant for the user.
+"""
+import calendar
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+
+from result_fetch import MAX_RESULT_ROWS
+from sql_tokens import SQLTokenizeError, identifier_name, string_value, tokenize
+from tracing import annotate
+from warehouse import COLUMN_TYPES
+
+GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "1") == "1"
+MAX_SPAN_DAYS = int(os.getenv("SQL_GUARD_MAX_SPAN_DAYS", "400"))
+# "reject" or "rewrite"
+MISSING_DATE_ACTION = os.getenv("SQL_GUARD_MISSING_DATE", "reject")
+DEFAULT_DAYS = int(os.getenv("SQL_GUARD_DEFAULT_DAYS", "90"))
+# One more than we fetch, so fetch_frame can still tell the result was truncated
+MAX_TOP_ROWS = int(os.getenv("SQL_GUARD_MAX_ROWS", str(MAX_RESULT_ROWS + 1)))
+ALLOWED_COLUMNS = {
+    column.strip().lower()
+    for column in (os.getenv("SQL_GUARD_ALLOWED_COLUMNS") or ",".join(COLUMN_TYPES)).split(",")
+    if column.strip()
+}
+ALLOWED_TABLES = {"dw.fsales"}
+DATE_COLUMN = "billingdate"
+SHOWPLAN_ENABLED = os.getenv("SQL_GUARD_SHOWPLAN", "0") == "1"
+MAX_PLAN_COST = float(os.getenv("SQL_GUARD_MAX_PLAN_COST", "200"))
+
+KEYWORDS = {
+    "select", "distinct", "all", "top", "percent", "with", "ties", "from", "where", "and", "or", "not",
+    "in", "between", "is", "null", "like", "escape", "group", "by", "order", "asc", "desc", "having", "as",
+    "case", "when", "then", "else", "end", "join", "inner", "left", "right", "outer", "full", "cross", "on",
+    "exists", "any", "some", "over", "partition", "rows", "range", "unbounded", "preceding", "following",
+    "current", "row", "offset", "fetch", "next", "first", "only", "current_timestamp",
+}
+# Statements and clauses that either change data or are more than one SELECT
+BLOCKED = {
+    "insert", "update", "delete", "merge", "drop", "alter", "create", "truncate", "exec", "execute", "into",
+    "grant", "revoke", "deny", "declare", "set", "use", "backup", "restore", "shutdown", "kill", "waitfor",
+    "dbcc", "openrowset", "opendatasource", "openquery", "openxml", "union", "intersect", "except", "go",
+}
+FUNCTIONS = {
+    "sum", "count", "count_big", "avg", "min", "max", "stdev", "stdevp", "var", "varp", "cast", "convert",
+    "try_cast", "try_convert", "getdate", "sysdatetime", "dateadd", "datediff", "datepart", "datename",
+    "datefromparts", "eomonth", "year", "month", "day", "isnull", "coalesce", "nullif", "round", "abs",
+    "floor", "ceiling", "format", "concat", "upper", "lower", "ltrim", "rtrim", "trim", "left", "right",
+    "len", "substring", "replace", "iif", "row_number", "rank", "dense_rank", "ntile", "lag", "lead",
+}
+AGGREGATES = {"sum", "count", "count_big", "avg", "min", "max", "stdev", "stdevp", "var", "varp"}
+DATE_PART_FUNCTIONS = {"dateadd", "datediff", "datepart", "datename"}
+TYPES = {
+    "date", "datetime", "datetime2", "smalldatetime", "int", "bigint", "smallint", "tinyint", "decimal",
+    "numeric", "float", "real", "money", "varchar", "nvarchar", "char", "nchar", "bit",
+}
+
+
+class QueryRejected(Exception):
+    pass
+
+
+@dataclass
+class SelectNode:
+    """One SELECT (query or subquery): clause name -> (first, end) token range, without the keyword."""
+    start: int
+    end: int
+    clauses: dict = field(default_factory=dict)
+    # (first, end) token range of each table reference in FROM/JOIN
+    tables: list = field(default_factory=list)
+    subqueries: list = field(default_factory=list)
+
+
+@dataclass
+class GuardedQuery:
+    sql: str
+    # What was changed or could not be checked, for the user
+    notes: list = field(default_factory=list)
+    span_days: int = None
+    plan_cost: float = None
+
+
+class _Parser:
+    def __init__(self, sql_query):
+        self.sql = sql_query
+        try:
+            self.tokens = tokenize(sql_query)
+        except SQLTokenizeError as e:
+            raise QueryRejected(f"The query could not be parsed ({e})")
+        if self.tokens and self.tokens[-1].text == ";":
+            self.tokens = self.tokens[:-1]
+        self.words = [identifier_name(t) if t.kind == "identifier" else t.text.lower() for t in self.tokens]
+        self.depth = []
+        self.match = {}
+        stack = []
+        for i, word in enumerate(self.words):
+            if word == "(":
+                stack.append(i)
+            elif word == ")":
+                if not stack:
+                    raise QueryRejected("The query has unbalanced parentheses")
+                self.match[stack.pop()] = i
+            self.depth.append(len(stack) - (word == "("))
+        if stack:
+            raise QueryRejected("The query has unbalanced parentheses")
+
+    def text(self, first, end):
+        if first >= end:
+            return ""
+        return self.sql[self.tokens[first].start:self.tokens[end - 1].end]
+
+    def parse(self):
+        if not self.tokens or self.words[0] != "select":
+            raise QueryRejected("Only SELECT queries can be run")
+        if ";" in self.words:
+            raise QueryRejected("Only a single SELECT statement can be run")
+        return self.parse_select(0, len(self.tokens))
+
+    def parse_select(self, start, end):
+        node = SelectNode(start, end)
+        base = self.depth[start]
+        clause, clause_start = "select", start + 1
+        i = start + 1
+        while i < end:
+            word = self.words[i]
+            if word == "(" and i + 1 < end and self.words[i + 1] == "select":
+                node.subqueries.append(self.parse_select(i + 1, self.match[i]))
+                i = self.match[i] + 1
+                continue
+            if self.depth[i] == base and self.tokens[i].kind == "identifier":
+                name = None
+                if word in ("from", "where", "having"):
+                    name = word
+                elif word in ("group", "order") and i + 1 < end and self.words[i + 1] == "by":
+                    name = word
+                if name is not None:
+                    node.clauses[clause] = (clause_start, i)
+                    clause, clause_start = name, i + (1 if name in ("from", "where", "having") else 2)
+                    i = clause_start
+                    continue
+            i += 1
+        node.clauses[clause] = (clause_start, end)
+        if "from" in node.clauses:
+            node.tables = self.table_references(*node.clauses["from"])
+        return node
+
+    def table_references(self, first, end):
+        """Token ranges of the tables named directly in a FROM clause (not derived tables)."""
+        tables = []
+        expect_table = True
+        i = first
+        while i < end:
+            word = self.words[i]
+            if expect_table and self.tokens[i].kind == "identifier":
+                table_end = i + 1
+                while table_end + 1 < end and self.words[table_end] == ".":
+                    table_end += 2
+                tables.append((i, table_end))
+                expect_table = False
+                i = table_end
+                continue
+            if word == "(":
+                expect_table = False
+                i = self.match[i] + 1
+                continue
+            if word in (",", "join", "apply"):
+                expect_table = True
+            i += 1
+        return tables
+
+    def table_name(self, reference):
+        first, end = reference
+        return ".".join(self.words[i] for i in range(first, end, 2))
+
+
+def _check_identifiers(parser, node):
+    """Reject blocked statements, unknown functions and columns outside the allowlist."""
+    tokens, words = parser.tokens, parser.words
+    table_tokens = set()
+    aliases = set()
+    for select in _walk(node):
+        for first, end in select.tables:
+            table_tokens.update(range(first, end))
+            name = parser.table_name((first, end))
+            if name not in ALLOWED_TABLES:
+                raise QueryRejected(f"Table {parser.text(first, end)} is not allowed")
+            # Table alias, with or without AS
+            alias = end + 1 if end < len(words) and words[end] == "as" else end
+            if alias < len(words) and tokens[alias].kind == "identifier" and words[alias] not in KEYWORDS:
+                aliases.add(words[alias])
+    for i, token in enumerate(tokens):
+        if token.kind == "identifier" and (words[i - 1:i] == ["as"] or _is_bare_alias(tokens, words, i)):
+            aliases.add(words[i])
+
+    for i, token in enumerate(tokens):
+        word = words[i]
+        previous = words[i - 1] if i > 0 else ""
+        following = words[i + 1] if i + 1 < len(words) else ""
+        if token.kind == "variable" and word != "@@datefirst":
+            raise QueryRejected(f"Variable {token.text} is not allowed")
+        if token.text == "*" and following in ("from", ","):
+            raise QueryRejected("SELECT * is not allowed; name the columns you need")
+        if token.kind != "identifier" or i in table_tokens:
+            continue
+        if word in BLOCKED:
+            raise QueryRejected(f"{token.text.upper()} is not allowed; only a single SELECT statement can be run")
+        if word in KEYWORDS or previous == "as" or following == ".":
+            continue
+        if following == "(":
+            if word not in FUNCTIONS:
+                raise QueryRejected(f"Function {token.text} is not allowed")
+            continue
+        if previous == "(" and i >= 2 and words[i - 2] in DATE_PART_FUNCTIONS:
+            continue
+        if previous == "(" and i >= 2 and words[i - 2] in ("convert", "try_convert") and word in TYPES:
+            continue
+        if word in ALLOWED_COLUMNS or word in aliases:
+            continue
+        raise QueryRejected(f"Column {token.text} is not allowed")
+
+
+def _is_bare_alias(tokens, words, i):
+    """Whether identifier i names a column or derived table without AS, e.g. "SUM(NetAmount) Net"."""
+    if i == 0 or words[i] in KEYWORDS or words[i] in BLOCKED or words[i + 1:i + 2] in (["("], ["."]):
+        return False
+    previous = tokens[i - 1]
+    return previous.text == ")" or previous.kind in ("number", "string") \
+        or previous.kind == "identifier" and words[i - 1] not in KEYWORDS and words[i - 1] not in BLOCKED
+
+
+def _walk(node):
+    yield node
+    for subquery in node.subqueries:
+        yield from _walk(subquery)
+
+
+def _conjuncts(parser, first, end):
+    """Top-level AND-ed conditions of a WHERE clause as token ranges; [] if it has a top-level OR."""
+    words, base = parser.words, parser.depth[first] if first < end else 0
+    if any(words[i] == "or" and parser.depth[i] == base for i in range(first, end)):
+        return []
+    conjuncts, start, in_between = [], first, False
+    for i in range(first, end):
+        if parser.depth[i] != base:
+            continue
+        if words[i] == "between":
+            in_between = True
+        elif words[i] == "and":
+            if in_between:
+                in_between = False
+            else:
+                conjuncts.append((start, i))
+                start = i + 1
+    conjuncts.append((start, end))
+    result = []
+    for first, end in conjuncts:
+        # (BillingDate >= x AND BillingDate < y)
+        if words[first] == "(" and parser.match.get(first) == end - 1:
+            result.extend(_conjuncts(parser, first + 1, end - 1))
+        else:
+            result.append((first, end))
+    return result
+
+
+def _as_date(value):
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+# Day 0 of SQL Server's integer date arithmetic, as in DATEADD(QUARTER, DATEDIFF(QUARTER, 0, GETDATE()), 0)
+BASE_DATE = datetime(1900, 1, 1)
+DATEFIRST = 7
+
+DATE_PARTS = {
+    "year": "year", "yy": "year", "yyyy": "year",
+    "quarter": "quarter", "qq": "quarter", "q": "quarter",
+    "month": "month", "mm": "month", "m": "month",
+    "week": "week", "wk": "week", "ww": "week",
+    "day": "day", "dd": "day", "d": "day",
+    "dayofyear": "dayofyear", "dy": "dayofyear", "y": "dayofyear",
+    "weekday": "weekday", "dw": "weekday",
+}
+
+
+def parse_sql_date(value):
+    """(datetime, had_time) for a date/datetime string or SQL Server day number."""
+    if isinstance(value, (int, float)):
+        return BASE_DATE + timedelta(days=value), True
+    if len(value) <= 10:
+        return datetime.combine(date.fromisoformat(value), time()), False
+    return datetime.fromisoformat(value), True
+
+
+def format_sql_date(value, with_time):
+    return value.isoformat(sep=" ", timespec="seconds") if with_time else value.date().isoformat()
+
+
+def _add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    year, month = divmod(month_index, 12)
+    day = min(value.day, calendar.monthrange(year, month + 1)[1])
+    return value.replace(year=year, month=month + 1, day=day)
+
+
+def _week_start(value):
+    # Sunday-based weeks, as with DATEFIRST 7
+    return value.date() - timedelta(days=(value.weekday() + 1) % 7)
+
+
+def dateadd(part, number, value):
+    value, with_time = parse_sql_date(value)
+    part = DATE_PARTS[part.lower()]
+    number = int(number)
+    if part == "year":
+        value = _add_months(value, 12 * number)
+    elif part == "quarter":
+        value = _add_months(value, 3 * number)
+    elif part == "month":
+        value = _add_months(value, number)
+    elif part == "week":
+        value += timedelta(weeks=number)
+    else:
+        value += timedelta(days=number)
+    return format_sql_date(value, with_time)
+
+
+def datediff(part, start, end):
+    start, end = parse_sql_date(start)[0], parse_sql_date(end)[0]
+    part = DATE_PARTS[part.lower()]
+    if part == "year":
+        return end.year - start.year
+    if part == "quarter":
+        return (end.year - start.year) * 4 + (end.month - 1) // 3 - (start.month - 1) // 3
+    if part == "month":
+        return (end.year - start.year) * 12 + end.month - start.month
+    if part == "week":
+        return (_week_start(end) - _week_start(start)).days // 7
+    return (end.date() - start.date()).days
+
+
+def datepart(part, value):
+    value = parse_sql_date(value)[0]
+    part = DATE_PARTS[part.lower()]
+    if part == "weekday":
+        return (value.isoweekday() - DATEFIRST) % 7 + 1
+    if part == "dayofyear":
+        return value.timetuple().tm_yday
+    if part == "week":
+        return int(value.strftime("%U")) + 1
+    if part == "quarter":
+        return (value.month - 1) // 3 + 1
+    return getattr(value, part)
+
+
+def eomonth(value, months=0):
+    value = _add_months(parse_sql_date(value)[0], int(months))
+    return value.replace(day=calendar.monthrange(value.year, value.month)[1]).date().isoformat()
+
+
+# Types a constant can be CAST or CONVERTed to while evaluating a bound
+_DATE_TYPES = {"date": False, "datetime": True, "datetime2": True, "smalldatetime": True}
+_INTEGER_TYPES = {"int", "bigint", "smallint", "tinyint"}
+_DECIMAL_TYPES = {"decimal", "numeric", "float", "real", "money"}
+
+
+class _Evaluator:
+    """Recursive-descent evaluator of a constant T-SQL expression; dates are ISO strings, as in SQLite."""
+
+    def __init__(self, expression, now):
+        self.tokens = tokenize(expression)
+        self.words = [identifier_name(t) if t.kind == "identifier" else t.text.lower() for t in self.tokens]
+        self.position = 0
+        self.now = now
+
+    def peek(self):
+        return self.words[self.position] if self.position < len(self.words) else ""
+
+    def take(self, expected=None):
+        word = self.peek()
+        if not word or (expected is not None and word != expected):
+            raise ValueError(f"Expected {expected or 'a value'} in constant expression")
+        self.position += 1
+        return word
+
+    def evaluate(self):
+        value = self.sum()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.position].text!r} in constant expression")
+        return value
+
+    def sum(self):
+        value = self.product()
+        while self.peek() in ("+", "-"):
+            sign = 1 if self.take() == "+" else -1
+            right = self.product()
+            if isinstance(value, str) and not isinstance(right, str):
+                # GETDATE() - 7: datetime plus or minus days
+                value = dateadd("day", sign * right, value)
+            elif isinstance(right, str) and sign == 1 and not isinstance(value, str):
+                value = dateadd("day", value, right)
+            elif isinstance(value, str) or isinstance(right, str):
+                raise ValueError("Unsupported date arithmetic in constant expression")
+            else:
+                value += sign * right
+        return value
+
+    def product(self):
+        value = self.unary()
+        while self.peek() in ("*", "/", "%"):
+            operator, right = self.take(), self.unary()
+            if isinstance(value, str) or isinstance(right, str):
+                raise ValueError("Unsupported arithmetic on text in constant expression")
+            if operator == "*":
+                value *= right
+            elif isinstance(value, int) and isinstance(right, int):
+                # Integer division truncates toward zero in T-SQL
+                value = int(value / right) if operator == "/" else value - right * int(value / right)
+            else:
+                value = value / right if operator == "/" else value % right
+        return value
+
+    def unary(self):
+        if self.peek() in ("-", "+"):
+            sign = -1 if self.take() == "-" else 1
+            value = self.unary()
+            if isinstance(value, str):
+                raise ValueError("Unsupported sign on text in constant expression")
+            return sign * value
+        return self.primary()
+
+    def primary(self):
+        token = self.tokens[self.position] if self.position < len(self.tokens) else None
+        word = self.take()
+        if token.kind == "number":
+            return float(token.text) if "." in token.text else int(token.text)
+        if token.kind == "string":
+            return string_value(token)
+        if word == "(":
+            value = self.sum()
+            self.take(")")
+            return value
+        if word == "@@datefirst":
+            return DATEFIRST
+        if word == "current_timestamp":
+            return format_sql_date(self.now, True)
+        if token.kind != "identifier" or self.peek() != "(":
+            raise ValueError(f"{token.text} is not a constant")
+        self.take("(")
+        if word == "cast":
+            value = self.sum()
+            self.take("as")
+            value = self.cast(value, self.type_name())
+        elif word in ("convert", "try_convert"):
+            type_name = self.type_name()
+            self.take(",")
+            value = self.cast(self.sum(), type_name)
+            if self.peek() == ",":
+                # Style only affects conversion to and from text
+                self.take(",")
+                self.sum()
+        elif word in ("dateadd", "datediff", "datepart"):
+            part = self.take()
+            arguments = []
+            while self.peek() == ",":
+                self.take(",")
+                arguments.append(self.sum())
+            value = {"dateadd": dateadd, "datediff": datediff, "datepart": datepart}[word](part, *arguments)
+        else:
+            arguments = []
+            if self.peek() != ")":
+                arguments.append(self.sum())
+                while self.peek() == ",":
+                    self.take(",")
+                    arguments.append(self.sum())
+            value = self.call(word, arguments)
+        self.take(")")
+        return value
+
+    def type_name(self):
+        name = self.take()
+        if self.peek() == "(":
+            # DECIMAL(10, 2), VARCHAR(10)
+            while self.take() != ")":
+                pass
+        return name
+
+    def cast(self, value, type_name):
+        if type_name in _DATE_TYPES:
+            return format_sql_date(parse_sql_date(value)[0], _DATE_TYPES[type_name])
+        if type_name in _INTEGER_TYPES:
+            return int(float(value))
+        if type_name in _DECIMAL_TYPES:
+            return float(value)
+        if type_name in ("varchar", "nvarchar", "char", "nchar"):
+            return str(value)
+        raise ValueError(f"Unsupported type {type_name} in constant expression")
+
+    def call(self, name, arguments):
+        if name in ("getdate", "sysdatetime") and not arguments:
+            return format_sql_date(self.now, True)
+        if name in ("year", "month", "day") and len(arguments) == 1:
+            return datepart(name, arguments[0])
+        if name == "eomonth" and len(arguments) in (1, 2):
+            return eomonth(*arguments)
+        if name == "datefromparts" and len(arguments) == 3:
+            return date(*(int(argument) for argument in arguments)).isoformat()
+        if name in ("isnull", "coalesce") and arguments:
+            return next((argument for argument in arguments if argument is not None), None)
+        raise ValueError(f"Function {name} is not supported in constant expressions")
+
+
+def evaluate_expression(expression, now=None):
+    """Value of a constant T-SQL expression, e.g. DATEADD(DAY, -7, GETDATE()), with GETDATE() = now."""
+    return _Evaluator(expression, now or datetime.now()).evaluate()
+
+
+def _date_bounds(parser, node, now):
+    """
+    (has_lower_bound, lower, upper) of BillingDate in the node's WHERE clause;
+    lower/upper are dates, or None when absent or not a constant expression.
+    """
+    if "where" not in node.clauses:
+        return False, None, None
+    words = parser.words
+    has_lower, lowers, uppers = False, [], []
+
+    def evaluate(first, end):
+        try:
+            return _as_date(evaluate_expression(parser.text(first, end), now))
+        except Exception:
+            return None
+
+    for first, end in _conjuncts(parser, *node.clauses["where"]):
+        # BillingDate, f.BillingDate or CAST(BillingDate AS DATE)
+        column_end = None
+        if words[first] == DATE_COLUMN:
+            column_end = first + 1
+        elif end - first > 2 and words[first + 1] == "." and words[first + 2] == DATE_COLUMN:
+            column_end = first + 3
+        elif words[first:first + 3] == ["cast", "(", DATE_COLUMN] and first + 1 in parser.match:
+            column_end = parser.match[first + 1] + 1
+        operator = words[column_end] if column_end is not None and column_end < end else ""
+        if operator in (">=", ">", "=", "<", "<=", "between"):
+            if operator == "between":
+                middle = next((i for i in range(column_end + 1, end)
+                               if words[i] == "and" and parser.depth[i] == parser.depth[first]), end)
+                lower, upper = evaluate(column_end + 1, middle), evaluate(middle + 1, end)
+                has_lower = True
+            else:
+                value = evaluate(column_end + 1, end)
+                lower = value if operator in (">=", ">", "=") else None
+                upper = value if operator in ("<", "<=", "=") else None
+                has_lower = has_lower or operator in (">=", ">", "=")
+        elif words[end - 1] == DATE_COLUMN and end - first > 2 and words[end - 2] in (">=", ">", "<=", "<"):
+            # GETDATE() - 7 <= BillingDate
+            value = evaluate(first, end - 2)
+            lower = value if words[end - 2] in ("<=", "<") else None
+            upper = value if words[end - 2] in (">=", ">") else None
+            has_lower = has_lower or words[end - 2] in ("<=", "<")
+        elif words[first:first + 4] == ["year", "(", DATE_COLUMN, ")"] and words[first + 4:first + 5] == ["="]:
+            # YEAR(BillingDate) = 2024
+            try:
+                year = int(evaluate_expression(parser.text(first + 5, end), now))
+            except Exception:
+                year = None
+            lower = date(year, 1, 1) if year else None
+            upper = date(year, 12, 31) if year else None
+            has_lower = True
+        elif words[first:first + 3] == ["datediff", "(", "day"] and words[first + 4:first + 5] == [DATE_COLUMN] \
+                and parser.match.get(first + 1) is not None and parser.match[first + 1] + 1 < end \
+                and words[parser.match[first + 1] + 1] in ("<", "<="):
+            # DATEDIFF(DAY, BillingDate, GETDATE()) <= 30
+            close = parser.match[first + 1]
+            try:
+                days = int(evaluate_expression(parser.text(close + 2, end), now))
+                reference = _as_date(evaluate_expression(parser.text(first + 6, close), now))
+                lower = reference - timedelta(days=days - (words[close + 1] == "<"))
+            except Exception:
+                lower = None
+            upper = None
+            has_lower = True
+        else:
+            continue
+        if lower is not None:
+            lowers.append(lower)
+        if upper is not None:
+            uppers.append(upper)
+    return has_lower, max(lowers) if lowers else None, min(uppers) if uppers else None
+
+
+def _default_bound_edit(parser, node):
+    """Edit adding the default BillingDate bound to the node's WHERE clause."""
+    bound = f"BillingDate >= CAST(DATEADD(DAY, -{DEFAULT_DAYS}, GETDATE()) AS DATE)"
+    if "where" in node.clauses:
+        first, end = node.clauses["where"]
+        return [(parser.tokens[first].start, parser.tokens[first].start, "("),
+                (parser.tokens[end - 1].end, parser.tokens[end - 1].end, f") AND {bound}")]
+    after_from = node.clauses["from"][1]
+    position = parser.tokens[after_from - 1].end
+    return [(position, position, f" WHERE {bound}")]
+
+
+def _top_edit(parser, node):
+    """Edit adding or lowering the outer query's TOP, or None if it returns a bounded number of rows."""
+    words, tokens = parser.words, parser.tokens
+    first, end = node.clauses["select"]
+    position = first
+    if words[position] in ("distinct", "all"):
+        position += 1
+    if words[position] == "top":
+        parenthesized = words[position + 1:position + 2] == ["("]
+        value = position + 1 + parenthesized
+        after = value + 1 + parenthesized
+        if value < len(tokens) and tokens[value].kind == "number" and words[after:after + 1] != ["percent"] \
+                and float(tokens[value].text) > MAX_TOP_ROWS:
+            return (tokens[value].start, tokens[value].end, str(MAX_TOP_ROWS))
+        return None
+    # A plain aggregate returns one row; a windowed one (SUM(...) OVER) returns one per input row
+    aggregate_only = "group" not in node.clauses and any(
+        words[i] in AGGREGATES and words[i + 1:i + 2] == ["("]
+        and words[parser.match[i + 1] + 1:parser.match[i + 1] + 2] != ["over"]
+        for i in range(first, end)
+    )
+    if aggregate_only:
+        return None
+    insert_at = tokens[position - 1].end
+    return (insert_at, insert_at, f" TOP {MAX_TOP_ROWS}")
+
+
+def guard_sql(sql_query, estimate_cost=None, now=None):
+    """
+    Check the query against the policies above and return a GuardedQuery with the SQL to run,
+    rewritten where a policy allows it. estimate_cost(sql) -> optimizer cost, if given, is
+    consulted last. Raises QueryRejected otherwise.
+    """
+    if not GUARD_ENABLED:
+        return GuardedQuery(sql_query)
+    now = now or datetime.now()
+    parser = _Parser(sql_query)
+    root = parser.parse()
+    _check_identifiers(parser, root)
+
+    guarded = GuardedQuery(sql_query)
+    edits = []
+    spans = []
+    for node in _walk(root):
+        if not any(parser.table_name(reference) in ALLOWED_TABLES for reference in node.tables):
+            continue
+        has_lower, lower, upper = _date_bounds(parser, node, now)
+        # A lower bound that cannot be evaluated (e.g. BillingDate > EffectiveStartDate) bounds nothing
+        if lower is None:
+            if MISSING_DATE_ACTION != "rewrite":
+                if has_lower:
+                    raise QueryRejected(
+                        "The query's BillingDate range could not be checked, so it could scan all of Dw.fsales. "
+                        "Ask for a period such as 'yesterday', 'last month' or 'YTD'."
+                    )
+                raise QueryRejected(
+                    "The query has no BillingDate range, so it would scan all of Dw.fsales. "
+                    "Ask for a period such as 'yesterday', 'last month' or 'YTD'."
+                )
+            edits.extend(_default_bound_edit(parser, node))
+            guarded.notes.append(f"No checkable date range was given, so only the last {DEFAULT_DAYS} days were used.")
+            spans.append(DEFAULT_DAYS)
+            continue
+        span_days = ((upper or now.date()) - lower).days + 1
+        if span_days > MAX_SPAN_DAYS:
+            raise QueryRejected(
+                f"The query covers {span_days} days of data; the limit is {MAX_SPAN_DAYS} days. "
+                "Ask for a shorter period."
+            )
+        spans.append(span_days)
+    guarded.span_days = max(spans) if spans else None
+
+    top = _top_edit(parser, root)
+    if top is not None:
+        edits.append(top)
+    for start, end, text in sorted(edits, reverse=True):
+        sql_query = sql_query[:start] + text + sql_query[end:]
+    guarded.sql = sql_query
+
+    if estimate_cost is not None:
+        try:
+            guarded.plan_cost = estimate_cost(guarded.sql)
+        except Exception as e:
+            guarded.notes.append(f"The query cost could not be estimated ({e}).")
+        if guarded.plan_cost is not None and guarded.plan_cost > MAX_PLAN_COST:
+            raise QueryRejected(
+                f"The query is too expensive to run (estimated cost {guarded.plan_cost:.0f}, "
+                f"limit {MAX_PLAN_COST:.0f}). Narrow the period or the grouping."
+            )
+    annotate(span_days=guarded.span_days, plan_cost=guarded.plan_cost, rewritten=guarded.sql != parser.sql)
+    return guarded
@@ -0,0 +1,53 @@
+import re
+from collections import namedtuple
+
+Token = namedtuple("Token", "kind text start end")
+
+_TOKEN_PATTERN = re.compile(
+    r"(?P<whitespace>\s+)"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>N?'(?:[^']|'')*')"
+    r"|(?P<number>\d+(?:\.\d+)?|\.\d+)"
+    r"|(?P<variable>@@?\w+)"
+    r"|(?P<parameter>\?)"
+    r"|(?P<identifier>\[[^\]]*\]|\"[^\"]*\"|[A-Za-z_#][\w$#]*)"
+    r"|(?P<operator><>|!=|<=|>=|[-+*/%=<>])"
+    r"|(?P<punct>[(),.;])",
+    re.DOTALL,
+)
+
+
+class SQLTokenizeError(ValueError):
+    pass
+
+
+def tokenize(sql_query, keep_whitespace=False):
+    """
+    Split T-SQL into tokens of kind whitespace, comment, string, number, variable,
+    parameter (a ? placeholder), identifier, operator or punct. Whitespace and comments are dropped unless keep_whitespace.
+    """
+    tokens = []
+    position = 0
+    while position < len(sql_query):
+        match = _TOKEN_PATTERN.match(sql_query, position)
+        if match is None:
+            raise SQLTokenizeError(f"Unexpected character {sql_query[position]!r} at position {position}")
+        kind = match.lastgroup
+        if keep_whitespace or kind not in ("whitespace", "comment"):
+            tokens.append(Token(kind, match.group(), match.start(), match.end()))
+        position = match.end()
+    return tokens
+
+
+def identifier_name(token):
+    """Identifier text without [brackets] or "quotes", lower-cased for comparison."""
+    text = token.text
+    if text[:1] in "[\"":
+        text = text[1:-1]
+    return text.lower()
+
+
+def string_value(token):
+    """Python value of a string literal token."""
+    text = token.text[1:] if token.text[:1] in "Nn" else token.text
+    return text[1:-1].replace("''", "'")
@@ -0,0 +1,136 @@
+"""
+SQLite stand-in for the Dw.fsales warehouse, used by the offline benchmark.
+
+create_warehouse() builds an in-memory database with a synthetic Dw.fsales and registers
+the T-SQL date functions our queries use; to_sqlite() rewrites the remaining T-SQL syntax
+(TOP, CAST(... AS DATE), date-part keywords, @@DATEFIRST) so generated queries run unchanged.
+The date functions are the ones sql_guard uses to evaluate BillingDate bounds.
+"""
+import random
+import sqlite3
+from datetime import date, datetime, time, timedelta
+
+from sql_guard import DATEFIRST, dateadd, datediff, datepart, eomonth, format_sql_date
+from sql_tokens import identifier_name, tokenize
+from warehouse import COLUMN_TYPES
+
+SQLITE_TYPES = {"int": "INTEGER", "bit": "INTEGER", "decimal": "REAL", "date": "TEXT", "varchar": "TEXT"}
+
+DATE_FUNCTIONS = {"dateadd", "datediff", "datepart"}
+
+
+def register_functions(conn, now):
+    """Register the T-SQL functions used by generated queries; GETDATE() returns now."""
+    conn.create_function("GETDATE", 0, lambda: format_sql_date(now, True), deterministic=True)
+    conn.create_function("SYSDATETIME", 0, lambda: format_sql_date(now, True), deterministic=True)
+    conn.create_function("DATEADD", 3, dateadd, deterministic=True)
+    conn.create_function("DATEDIFF", 3, datediff, deterministic=True)
+    conn.create_function("DATEPART", 2, datepart, deterministic=True)
+    conn.create_function("EOMONTH", 1, eomonth, deterministic=True)
+    conn.create_function("EOMONTH", 2, eomonth, deterministic=True)
+    conn.create_function("DATEFROMPARTS", 3, lambda y, m, d: date(int(y), int(m), int(d)).isoformat(),
+                         deterministic=True)
+    for part in ("year", "month", "day"):
+        conn.create_function(part.upper(), 1, lambda value, part=part: datepart(part, value), deterministic=True)
+    conn.create_function("ISNULL", 2, lambda value, default: default if value is None else value,
+                         deterministic=True)
+
+
+def to_sqlite(sql_query):
+    """Rewrite T-SQL-only syntax in a generated query into its SQLite equivalent."""
+    tokens = tokenize(sql_query, keep_whitespace=True)
+    code = [i for i, token in enumerate(tokens) if token.kind not in ("whitespace", "comment")]
+    position = {i: n for n, i in enumerate(code)}
+    following = {code[n]: code[n + 1] for n in range(len(code) - 1)}
+    output = {i: token.text for i, token in enumerate(tokens)}
+    limit = None
+
+    open_parens = []
+    casts = {}
+    for n, i in enumerate(code):
+        text = tokens[i].text
+        if text == "(":
+            open_parens.append(i)
+        elif text == ")" and open_parens:
+            opened = open_parens.pop()
+            function = code[position[opened] - 1] if position[opened] > 0 else None
+            # CAST(x AS DATE) -> DATE(x)
+            if function is not None and identifier_name(tokens[function]) == "cast" and n >= 2 \
+                    and identifier_name(tokens[code[n - 1]]) == "date" \
+                    and identifier_name(tokens[code[n - 2]]) == "as":
+                casts[function] = (code[n - 2], code[n - 1])
+
+    for function, (as_index, type_index) in casts.items():
+        output[function] = "DATE"
+        output[as_index] = output[type_index] = ""
+    for n, i in enumerate(code):
+        token = tokens[i]
+        name = identifier_name(token) if token.kind == "identifier" else None
+        if token.kind == "variable" and token.text.lower() == "@@datefirst":
+            output[i] = str(DATEFIRST)
+        elif token.kind == "string" and token.text[:1] in "Nn":
+            output[i] = token.text[1:]
+        elif name == "top" and i in following and tokens[following[i]].kind == "number":
+            limit = tokens[following[i]].text
+            output[i] = output[following[i]] = ""
+        elif name in DATE_FUNCTIONS and n + 2 < len(code) and tokens[code[n + 1]].text == "(":
+            part = tokens[code[n + 2]]
+            if part.kind == "identifier":
+                output[code[n + 2]] = f"'{identifier_name(part)}'"
+
+    result = "".join(output[i] for i in range(len(tokens))).strip()
+    if limit is not None:
+        result = result.rstrip(";").rstrip() + f" LIMIT {limit}"
+    return result
+
+
+def create_warehouse(rows=100_000, days=120, seed=7, hierarchy_levels=None, now=None):
+    """
+    In-memory SQLite database with `rows` synthetic Dw.fsales lines spread over the
+    `days` days before now (about four lines per bill).
+    hierarchy_levels maps ProductHeirachy1..5 to their possible values.
+    """
+    now = now or datetime.combine(date.today(), time(12))
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("ATTACH DATABASE ':memory:' AS Dw")
+    register_functions(conn, now)
+    columns = ", ".join(f"{column} {SQLITE_TYPES[col_type]}" for column, col_type in COLUMN_TYPES.items())
+    conn.execute(f"CREATE TABLE Dw.fsales ({columns})")
+
+    hierarchy_values = {
+        column: sorted(values) for column, values in (hierarchy_levels or {}).items()
+    }
+    routes = [(f"{1900 + n}G", f"Route {1900 + n}") for n in range(60)]
+    material_groups = [f"MG{n:02d}" for n in range(20)]
+    start = now.date() - timedelta(days=days)
+
+    def lines():
+        bill = 0
+        for n in range(rows):
+            if n % 4 == 0:
+                bill += 1
+                billing_date = (start + timedelta(days=rng.randrange(days))).isoformat()
+                route, route_description = rng.choice(routes)
+                sales_office = rng.randrange(1, 11)
+                customer = f"C{rng.randrange(5000):05d}"
+            quantity = rng.randrange(1, 50)
+            net_amount = round(quantity * rng.uniform(20, 400), 2)
+            tax = round(net_amount * 0.05, 2)
+            row = {
+                "DId": n + 1, "BillingDocument": str(9_000_000 + bill), "BillingDocumentItem": str(n % 4 + 1),
+                "BillingDate": billing_date, "SalesOfficeID": sales_office, "Route": route,
+                "RouteDescription": route_description, "CustomerID": customer,
+                "Materialgroup": rng.choice(material_groups), "SalesQuantity": quantity,
+                "NetAmount": net_amount, "TotalTax": tax, "TotalAmount": round(net_amount + tax, 2),
+                "IsActive": 1,
+            }
+            for column, values in hierarchy_values.items():
+                row[column] = rng.choice(values)
+            yield tuple(row.get(column) for column in COLUMN_TYPES)
+
+    placeholders = ", ".join("?" for _ in COLUMN_TYPES)
+    conn.executemany(f"INSERT INTO Dw.fsales VALUES ({placeholders})", lines())
+    conn.execute("CREATE INDEX Dw.IX_fsales_BillingDate ON fsales (BillingDate)")
+    conn.commit()
+    return conn
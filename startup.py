@@ -0,0 +1,155 @@
+"""
+Startup profile and warm-up of the process-wide resources.
+
+The heavy resources (the LangChain chain, the term matchers, the tokenizer, the OpenAI
+client and the warehouse connection) are created on first use and then shared by every
+session. warm_up() creates them ahead of the first question and times each step; app.py
+starts it in the background once per server process.
+
+    python startup.py                # import time per module, warm-up and rerun cost
+    python startup.py --top 30 --module batch
+"""
+import argparse
+import os
+import re
+import runpy
+import subprocess
+import sys
+import threading
+import time
+
+# One line of `python -X importtime` output: self and cumulative microseconds, indented name
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def _term_matchers():
+    from dynamic_sql_generation import term_matchers
+
+    term_matchers()
+
+
+def _tokenizer():
+    from prompt_builder import count_tokens
+
+    count_tokens("warm up")
+
+
+def _openai():
+    # Importing is the whole step: it pays the slow module import before the first question
+    import openai  # noqa: F401
+
+
+def _llm_chain():
+    from dynamic_sql_generation import get_nl_to_sql_chain
+
+    get_nl_to_sql_chain()
+
+
+def _warehouse():
+    from warehouse import warm_up_connection
+
+    warm_up_connection()
+
+
+# Cheapest first, so a slow or unreachable warehouse does not hold up the rest
+WARM_UP_STEPS = [
+    ("term_matchers", _term_matchers),
+    ("tokenizer", _tokenizer),
+    ("openai", _openai),
+    ("llm_chain", _llm_chain),
+    ("warehouse", _warehouse),
+]
+
+
+def warm_up(steps=WARM_UP_STEPS, report=None):
+    """
+    Run every step, recording {"seconds", "error"} per step name in report (returned).
+    A failing step is recorded and does not stop the others; its resource is created on first use instead.
+    """
+    report = {} if report is None else report
+    for name, step in steps:
+        started = time.perf_counter()
+        error = None
+        try:
+            step()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        report[name] = {"seconds": round(time.perf_counter() - started, 3), "error": error}
+    return report
+
+
+def warm_up_in_background(steps=WARM_UP_STEPS):
+    """Start warm_up() in a daemon thread; returns its report, filled in as steps finish."""
+    report = {}
+    threading.Thread(target=warm_up, args=(steps, report), name="warm-up", daemon=True).start()
+    return report
+
+
+def profile_imports(module="app"):
+    """
+    Import module in a fresh interpreter under `-X importtime`.
+    Returns [(name, self_ms, cumulative_ms, depth)] for module (depth 0) and everything it
+    imported first (depth 1 for its direct imports), in the order the imports finished.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    rows = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2))
+    # importtime lists each module after everything it imported, indented one level deeper
+    end = next(i for i in range(len(rows) - 1, -1, -1) if rows[i][0] == module and rows[i][3] == 0)
+    start = end
+    while start > 0 and rows[start - 1][3] > 0:
+        start -= 1
+    return rows[start:end + 1]
+
+
+def measure_rerun(path="app.py", runs=5):
+    """Median seconds to execute a script's body again with its imports already loaded, like a Streamlit rerun."""
+    runpy.run_path(path, run_name="__startup_profile__")
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        runpy.run_path(path, run_name="__startup_profile__")
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile startup: import time per module and warm-up per resource.")
+    parser.add_argument("--module", default="app", help="module whose import is profiled")
+    parser.add_argument("--top", type=int, default=15, help="modules listed per table")
+    parser.add_argument("--no-warm-up", action="store_true", help="skip warm-up (it connects to the warehouse)")
+    args = parser.parse_args()
+
+    rows = profile_imports(args.module)
+    total = rows[-1][2]
+    print(f"import {args.module}: {total:.0f} ms\n")
+    print(f"{'direct imports':<40}{'cumulative ms':>15}")
+    direct = sorted((row for row in rows if row[3] == 1), key=lambda row: -row[2])
+    for name, _, cumulative, _ in direct[:args.top]:
+        print(f"{name:<40}{cumulative:>15.1f}")
+    print(f"\n{'slowest modules':<40}{'self ms':>15}")
+    for name, self_ms, _, _ in sorted(rows, key=lambda row: -row[1])[:args.top]:
+        print(f"{name:<40}{self_ms:>15.1f}")
+
+    if not args.no_warm_up:
+        # Warm up in this process (the profile above ran in a fresh one) so the numbers are cold
+        print(f"\n{'warm-up step':<40}{'seconds':>15}")
+        for name, step in warm_up().items():
+            print(f"{name:<40}{step['seconds']:>15.3f}" + (f"  {step['error']}" if step["error"] else ""))
+
+    if args.module == "app":
+        print(f"\nRerun of app.py with everything loaded: {measure_rerun() * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import re
+
+import dynamic_sql_generation
+from answer_templates import summarize_locally
+from prompt_builder import count_tokens
+from single_flight import SingleFlight
+from tracing import annotate, span
+
+SUMMARY_MODEL = "gpt-3.5-turbo"
+
+# Concurrent identical summary prompts (same question and result rows) share one model call
+summary_flight = SingleFlight("summary")
+
+# Unit strings the summary model sometimes adds. Matched as whole tokens in one pass,
+# so e.g. the "L" in "Lassi" is left alone.
+UNITS = ["$ USD", "€ EUR", "£ GBP", "₹ INR", "¥ JPY", "₩ KRW", "KG", "G", "L", "ML", "Units", "$"]
+UNIT_PATTERN = re.compile(
+    "|".join(rf"(?<!\w){re.escape(unit)}(?!\w)" for unit in sorted(UNITS, key=len, reverse=True))
+)
+
+def answer_without_llm(results, user_query):
+    """Return the answer when no model call is needed, otherwise None."""
+    if results is None or results.empty:
+        return "No results found."
+
+    # Detect sales quantity questions without a time reference
+    if "salesquantity" in user_query.lower().replace(" ", "") or "sales quantity" in user_query.lower():
+        # Extend time references with additional time-related keywords
+        time_keywords = [
+            "yesterday", "today", "last week", "last month", "this week", "this month",
+            "on", "between", "from", "to", "qtd", "quarter", "mtd", "month", "wtd", "week",
+            "ytd", "year", "l7d", "last 7 days", "lw", "previous week", "pw"
+        ]
+
+        # Check if any time keyword is present in the user's query
+        if not any(time_kw in user_query.lower() for time_kw in time_keywords):
+            return "Please specify a time period for the sales quantity (e.g., 'last week', 'yesterday', 'QTD', 'MTD', 'L7D', etc.)."
+
+    # Scalar and small tabular results are described locally, without a model call
+    return summarize_locally(results, dynamic_sql_generation.term_matchers().fast_path.parse(user_query, strict=False))
+
+def summary_messages(results, user_query):
+    # Convert the first rows of the result to string for prompt
+    results_str = "\n".join([str(row) for row in results.head(10).to_dict("records")])  # limit to first 10 rows
+
+    prompt_text = (
+        f"The user asked: \"{user_query}\"\n\n"
+        f"The SQL query returned the following result:\n{results_str}\n\n"
+        "Generate a direct, concise, and natural language answer using the user's question and result. "
+        "Avoid explanations and unit information. Example output: 'The unique billing count for yesterday is 3421.'\n\n"
+        "Answer:"
+    )
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt_text}
+    ]
+
+def messages_tokens(messages):
+    """Approximate prompt token count of a chat request."""
+    return sum(count_tokens(message["content"]) for message in messages)
+
+def clean_summary(summary):
+    # Remove units if accidentally generated
+    summary = UNIT_PATTERN.sub("", summary.strip())
+    return re.sub(r" {2,}", " ", summary).replace(" .", ".")
+
+def results_to_natural_language(results, user_query):
+    """Summarize the result; model errors are raised to the caller."""
+    answer = answer_without_llm(results, user_query)
+    annotate(local=answer is not None)
+    if answer is not None:
+        return answer
+    messages = summary_messages(results, user_query)
+    summary, _ = summary_flight.do(summary_key(messages), llm_summary, messages)
+    return summary
+
+def summary_key(messages):
+    # The prompt holds the question and the leading rows, so equal prompts get the same answer
+    return messages[-1]["content"]
+
+def llm_summary(messages):
+    # Imported on first use (it is slow to import); it reads OPENAI_API_KEY from the environment
+    import openai
+
+    with span("llm_summary", model=SUMMARY_MODEL, prompt_tokens=messages_tokens(messages)):
+        response = openai.ChatCompletion.create(
+            model=SUMMARY_MODEL,
+            messages=messages,
+            max_tokens=150,
+            temperature=0.3,
+        )
+        content = response.choices[0].message['content']
+        annotate(completion_tokens=count_tokens(content))
+    return clean_summary(content)
+
+async def astream_natural_language(results, user_query, on_token=None):
+    """
+    Async variant of results_to_natural_language that streams the model's answer,
+    calling on_token with each new piece of text as it arrives.
+    """
+    answer = answer_without_llm(results, user_query)
+    annotate(local=answer is not None)
+    if answer is not None:
+        if on_token is not None:
+            on_token(answer)
+        return answer
+    messages = summary_messages(results, user_query)
+    summary, shared = await summary_flight.ado(summary_key(messages), astream_llm_summary, messages, on_token)
+    if shared and on_token is not None:
+        # The stream went to the session that made the call; this one gets the finished answer
+        on_token(summary)
+    return summary
+
+async def astream_llm_summary(messages, on_token=None):
+    import openai
+
+    with span("llm_summary", model=SUMMARY_MODEL, prompt_tokens=messages_tokens(messages)):
+        response = await openai.ChatCompletion.acreate(
+            model=SUMMARY_MODEL,
+            messages=messages,
+            max_tokens=150,
+            temperature=0.3,
+            stream=True,
+        )
+        pieces = []
+        async for chunk in response:
+            token = chunk["choices"][0]["delta"].get("content")
+            if token:
+                pieces.append(token)
+                if on_token is not None:
+                    on_token(token)
+        annotate(completion_tokens=count_tokens("".join(pieces)))
+    return clean_summary("".join(pieces))
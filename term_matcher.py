@@ -0,0 +1,68 @@
+import re
+
+
+def _trie_pattern(words):
+    # Build a regex from a character trie so matching cost depends on the
+    # length of the longest term, not on how many terms there are.
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        optional = "" in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        # Greedy "?" prefers the longer term, so the first match is the longest one
+        return group + "?" if optional else group
+
+    return emit(trie)
+
+
+# A single-quoted T-SQL string literal, including doubled '' escapes
+SQL_STRING_LITERAL = r"'(?:[^']|'')*'"
+
+
+class TermMatcher:
+    """
+    Case-insensitive, whole-word, leftmost-longest matcher for a fixed set of terms.
+    The regex is compiled once, and every call is a single scan over the text.
+    """
+
+    def __init__(self, replacements):
+        # replacements maps each term to the text it should be rewritten to, or to a
+        # function building that text from the term as written
+        self.terms = {}
+        self.replacements = {}
+        for term in sorted(replacements):
+            if term.lower() not in self.terms:
+                self.terms[term.lower()] = term
+                self.replacements[term.lower()] = replacements[term]
+        terms = r"(?<!\w)(?P<term>" + _trie_pattern(self.replacements) + r")(?!\w)"
+        self.pattern = re.compile(terms, re.IGNORECASE) if self.replacements else None
+
+    def _replace(self, match):
+        term = match.group("term")
+        replacement = self.replacements.get(term.lower(), term)
+        return replacement(term) if callable(replacement) else replacement
+
+    def sub(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self._replace, text)
+
+    def find(self, text: str):
+        """Return (canonical term, start, end) for every term found in the text."""
+        if self.pattern is None:
+            return []
+        found = []
+        for match in self.pattern.finditer(text):
+            term = match.group("term")
+            found.append((self.terms.get(term.lower(), term), match.start(), match.end()))
+        return found
@@ -0,0 +1,276 @@
+"""
+Per-question tracing and Prometheus-style metrics.
+
+run_pipeline starts a Trace for every question; code anywhere below it opens spans with
+`with span("query"):` and attaches numbers with annotate(rows=...). The current trace
+and span live in context variables, so they follow the question into asyncio tasks
+and asyncio.to_thread workers, and span()/annotate() are no-ops outside a trace.
+
+Finished traces are appended as JSON lines to TRACE_LOG_PATH and folded into the
+process-wide metrics, which are written to METRICS_PATH and optionally served on
+http://localhost:METRICS_PORT/metrics.
+
+Span attributes with a meaning for the metrics:
+    prompt_tokens, completion_tokens, model  LLM usage
+    rows                                      rows fetched from the warehouse
+    cache, cache_hit                          cache name and whether it answered
+    path                                      how the question was translated
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(".cache", "traces.jsonl"))
+METRICS_PATH = os.getenv("METRICS_PATH", os.path.join(".cache", "metrics.prom"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "start", "duration", "attrs", "error")
+
+    def __init__(self, span_id, parent_id, name, start, attrs):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        # Seconds since the start of the trace
+        self.start = start
+        self.duration = None
+        self.attrs = attrs
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start_ms": round(self.start * 1000, 3),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self, question):
+        self.trace_id = uuid.uuid4().hex
+        self.question = question
+        self.started_at = datetime.now(timezone.utc)
+        self.duration = None
+        self.error = None
+        self.spans = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def open_span(self, name, attrs):
+        parent = _current_span.get()
+        with self._lock:
+            span = Span(len(self.spans) + 1, parent.span_id if parent else None, name,
+                        time.perf_counter() - self._started, attrs)
+            self.spans.append(span)
+        return span
+
+    def close_span(self, span):
+        span.duration = time.perf_counter() - self._started - span.start
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._started
+        self.error = error
+
+    def to_dict(self):
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "question": self.question,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "error": self.error,
+            "spans": spans,
+        }
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a child of the current span; yields the span's attribute dict."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    current = trace.open_span(name, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current.attrs
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        trace.close_span(current)
+
+
+def annotate(**attrs):
+    """Add attributes to the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def traced(question):
+    """Trace everything in the enclosed block as one question; yields the Trace."""
+    trace = Trace(question)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if trace.duration is None:
+            trace.finish()
+        record_trace(trace)
+
+
+class Metrics:
+    """Counters and duration histograms rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts, total, observations = self.histograms.get(key, ([0] * len(self.buckets), 0.0, 0))
+            # Buckets are cumulative: each counts the observations up to its bound
+            counts = [count + (seconds <= bound) for count, bound in zip(counts, self.buckets)]
+            self.histograms[key] = (counts, total + seconds, observations + 1)
+
+    def record(self, trace):
+        self.inc("askdb_questions_total", status="error" if trace.error else "ok")
+        self.observe("askdb_question_seconds", trace.duration or 0.0)
+        for span in trace.spans:
+            if span.duration is not None:
+                self.observe("askdb_span_seconds", span.duration, span=span.name)
+            if span.error:
+                self.inc("askdb_span_errors_total", span=span.name)
+            attrs = span.attrs
+            model = attrs.get("model", "")
+            for kind in ("prompt", "completion"):
+                if attrs.get(f"{kind}_tokens"):
+                    self.inc("askdb_llm_tokens_total", attrs[f"{kind}_tokens"], model=model, kind=kind)
+            if attrs.get("rows") is not None:
+                self.inc("askdb_rows_fetched_total", attrs["rows"])
+            if "cache_hit" in attrs:
+                self.inc("askdb_cache_requests_total", cache=attrs.get("cache", span.name),
+                         result="hit" if attrs["cache_hit"] else "miss")
+            if attrs.get("path"):
+                self.inc("askdb_translations_total", path=attrs["path"])
+            if attrs.get("coalesced"):
+                self.inc("askdb_coalesced_requests_total", flight=attrs["coalesced"])
+
+    def render(self):
+        def label_text(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for (name, labels), (counts, total, observations) in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {observations}")
+            lines.append(f"{name}_sum{label_text(labels)} {total}")
+            lines.append(f"{name}_count{label_text(labels)} {observations}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics shared by every Streamlit session
+metrics = Metrics()
+_write_lock = threading.Lock()
+
+
+def record_trace(trace):
+    """Append the finished trace to TRACE_LOG_PATH and update the metrics (and METRICS_PATH)."""
+    metrics.record(trace)
+    try:
+        with _write_lock:
+            if TRACE_LOG_PATH:
+                os.makedirs(os.path.dirname(TRACE_LOG_PATH) or ".", exist_ok=True)
+                with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+            if METRICS_PATH:
+                os.makedirs(os.path.dirname(METRICS_PATH) or ".", exist_ok=True)
+                temporary = METRICS_PATH + ".tmp"
+                with open(temporary, "w", encoding="utf-8") as f:
+                    f.write(metrics.render())
+                os.replace(temporary, METRICS_PATH)
+    except OSError as e:
+        # Instrumentation must never fail a question
+        print(f"Could not write trace {trace.trace_id}: {e}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics on localhost:port from a daemon thread, once per process. port 0 disables it."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
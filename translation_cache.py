@@ -0,0 +1,155 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Time references whose meaning moves with the calendar ("yesterday" is a different day tomorrow)
+RELATIVE_DATE_PATTERN = re.compile(
+    r"\b(?:yesterday|today|tonight|now|current|recent|recently|this (?:week|month|quarter|year)|"
+    r"(?:last|previous|past) (?:\d+ )?(?:days?|weeks?|months?|quarters?|years?)|"
+    r"ago|l\d+d|lw|pw|lm|ly|fy|wtd|mtd|qtd|ytd|fytd|lmtd|lytd)\b",
+    re.IGNORECASE,
+)
+# SQL that resolves dates on the server at run time
+SQL_RELATIVE_DATE_PATTERN = re.compile(
+    r"\b(?:GETDATE|SYSDATETIME|GETUTCDATE|SYSUTCDATETIME|CURRENT_TIMESTAMP)\b", re.IGNORECASE
+)
+SQL_LITERAL_DATE_PATTERN = re.compile(r"'(\d{4})-\d{2}-\d{2}")
+QUESTION_YEAR_PATTERN = re.compile(r"(?<!\d)\d{4}(?!\d)")
+
+
+def normalize_question(question: str) -> str:
+    # Case, repeated whitespace and trailing punctuation do not change the SQL
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.! ").lower()
+
+
+def entry_expiry(question, sql_query, ttl_seconds, now=None):
+    """
+    Return the unix time at which a cached translation stops being valid, or None if it never does.
+    - SQL using GETDATE() stays correct as the days pass, so it gets the normal TTL.
+    - Literal dates are only valid for the rest of today, unless the question is not relative and
+      names the year of every literal ("October 2024"); the model may have filled in the year
+      of "October" or "2 days ago" from today's date.
+    - A question without relative references whose SQL has no dates at all is stable forever.
+    """
+    now = time.time() if now is None else now
+    relative_question = bool(RELATIVE_DATE_PATTERN.search(question))
+    if SQL_RELATIVE_DATE_PATTERN.search(sql_query):
+        return now + ttl_seconds
+    literal_years = set(SQL_LITERAL_DATE_PATTERN.findall(sql_query))
+    if literal_years and (relative_question or not literal_years <= set(QUESTION_YEAR_PATTERN.findall(question))):
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        return (midnight + timedelta(days=1)).timestamp()
+    if not relative_question:
+        return None
+    return now + ttl_seconds
+
+
+class TranslationCache:
+    """
+    Persistent NL-to-SQL cache stored in a local SQLite file, with per-entry expiry
+    and least-recently-used eviction once max_entries is exceeded.
+    """
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_entries=5000, namespace=""):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # The namespace (prompt/model fingerprint) is part of every key, so changing
+        # the prompt never serves SQL produced by the old one.
+        self.namespace = namespace
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache ("
+                "key TEXT PRIMARY KEY, question TEXT, sql TEXT, "
+                "created_at REAL, expires_at REAL, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sql_cache_last_used ON sql_cache (last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _key(self, question):
+        return hashlib.sha256(f"{self.namespace}\x00{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def _count(self, name):
+        self.counters[name] += 1
+
+    def get(self, question):
+        key = self._key(question)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT sql, expires_at FROM sql_cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self._count("misses")
+                    return None
+                sql_query, expires_at = row
+                if expires_at is not None and expires_at <= now:
+                    conn.execute("DELETE FROM sql_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    self._count("expired")
+                    self._count("misses")
+                    return None
+                conn.execute("UPDATE sql_cache SET last_used = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self._count("hits")
+                return sql_query
+            except sqlite3.Error:
+                # A broken cache must never block translation
+                self._count("errors")
+                self._count("misses")
+                return None
+
+    def put(self, question, sql_query):
+        key = self._key(question)
+        now = time.time()
+        expires_at = entry_expiry(question, sql_query, self.ttl_seconds, now)
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO sql_cache (key, question, sql, created_at, expires_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, normalize_question(question), sql_query, now, expires_at, now),
+                )
+                self._count("stores")
+                conn.execute("DELETE FROM sql_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                (size,) = conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()
+                if size > self.max_entries:
+                    evicted = conn.execute(
+                        "DELETE FROM sql_cache WHERE key IN "
+                        "(SELECT key FROM sql_cache ORDER BY last_used LIMIT ?)",
+                        (size - self.max_entries,),
+                    ).rowcount
+                    self.counters["evictions"] += evicted
+                conn.commit()
+            except sqlite3.Error:
+                self._count("errors")
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM sql_cache")
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,354 @@
+import os
+import re
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import pyodbc
+
+from admission import QueryCancelled, QueryHandle, WarehouseBusy, warehouse_admission
+from db_pool import get_pool
+from dimension_catalog import dimension_catalog
+from result_cache import result_cache
+from result_fetch import fetch_frame
+from rollups import load_rollup_watermark, rollup_router
+from single_flight import SingleFlight
+from sql_tokens import SQLTokenizeError, identifier_name, string_value, tokenize
+from tracing import annotate, span
+
+DRIVER = os.getenv("Driver")
+SERVER = os.getenv("Server")
+DATABASE = os.getenv("Database")
+UID = os.getenv("UID")
+PWD = os.getenv("PWD")
+
+# Query whose value changes whenever new data is loaded into the warehouse
+WATERMARK_SQL = os.getenv("WAREHOUSE_WATERMARK_SQL", "SELECT MAX(BillingDate) FROM Dw.fsales")
+
+# Server-side limit on each statement (pyodbc Connection.timeout); 0 disables it
+QUERY_TIMEOUT_SECONDS = int(os.getenv("WAREHOUSE_QUERY_TIMEOUT_SECONDS", "90"))
+
+# Optimizer cost of each statement in a SHOWPLAN_XML plan
+PLAN_COST_PATTERN = re.compile(r'StatementSubtreeCost="([0-9.Ee+-]+)"')
+
+# Define column data types for Dw.fsales table
+COLUMN_TYPES = {
+    "DId": "int",
+    "BillingDocument": "varchar",
+    "BillingDocumentItem": "varchar",
+    "BillingDate": "date",
+    "SalesOfficeID": "int",
+    "DistributionChannel": "varchar",
+    "DisivisonCode": "varchar",
+    "Route": "varchar",
+    "RouteDescription": "varchar",
+    "CustomerGroup": "varchar",
+    "CustomerID": "varchar",
+    "ProductHeirachy1": "varchar",
+    "ProductHeirachy2": "varchar",
+    "ProductHeirachy3": "varchar",
+    "ProductHeirachy4": "varchar",
+    "ProductHeirachy5": "varchar",
+    "Materialgroup": "varchar",
+    "SubMaterialgroup1": "varchar",
+    "SubMaterialgroup2": "varchar",
+    "SubMaterialgroup3": "varchar",
+    "MaterialCode": "varchar",
+    "SalesQuantity": "int",
+    "SalesUnit": "varchar",
+    "TotalAmount": "decimal",
+    "TotalTax": "decimal",
+    "NetAmount": "decimal",
+    "EffectiveStartDate": "date",
+    "EffectiveEndDate": "date",
+    "IsActive": "bit",
+    "SalesOrganizationCode": "varchar",
+    "SalesOrgCodeDesc": "varchar",
+    "ItemCategory": "varchar",
+    "ShipToParty": "varchar"
+}
+
+class QueryTimeout(Exception):
+    pass
+
+_COLUMN_TYPES_BY_NAME = {column.lower(): col_type for column, col_type in COLUMN_TYPES.items()}
+NUMERIC_TYPES = {"int", "decimal", "bit"}
+COMPARISON_OPERATORS = {"=", "<>", "!=", "<", ">", "<=", ">="}
+
+# Driver input size (SQL type, size, decimal digits) per COLUMN_TYPES type. Fixed sizes keep the
+# parameter declarations, and so the cached plan, the same whatever the value; varchar parameters
+# avoid converting the column to nvarchar, which would prevent index seeks.
+PARAMETER_INPUT_SIZES = {
+    "varchar": (pyodbc.SQL_VARCHAR, 255, 0),
+    "int": (pyodbc.SQL_INTEGER, 0, 0),
+    "decimal": (pyodbc.SQL_DECIMAL, 38, 6),
+    "bit": (pyodbc.SQL_BIT, 0, 0),
+    "date": (pyodbc.SQL_TYPE_DATE, 0, 0),
+}
+
+# SQL with ? placeholders, the values bound to them and the COLUMN_TYPES type of each
+ParameterizedQuery = namedtuple("ParameterizedQuery", "sql params types")
+
+def _column_literals(tokens):
+    """
+    Yield (column type, literal token) for every string or number compared with a known column:
+    col <op> literal, literal <op> col, col [NOT] IN (literal, ...), col [NOT] BETWEEN literal AND literal
+    and col [NOT] LIKE literal.
+    """
+    def col_type(token):
+        return _COLUMN_TYPES_BY_NAME.get(identifier_name(token)) if token.kind == "identifier" else None
+
+    def is_literal(token):
+        return token.kind in ("string", "number")
+
+    for i, token in enumerate(tokens):
+        following = tokens[i + 1:i + 4]
+        if is_literal(token) and len(following) >= 2 and following[0].text in COMPARISON_OPERATORS \
+                and col_type(following[1]) and not (i > 0 and tokens[i - 1].text in COMPARISON_OPERATORS):
+            yield col_type(following[1]), token
+            continue
+        column_type = col_type(token)
+        if column_type is None or not following:
+            continue
+        if following[0].text in COMPARISON_OPERATORS:
+            if len(following) >= 2 and is_literal(following[1]):
+                yield column_type, following[1]
+            continue
+        j = i + 1
+        if tokens[j].kind == "identifier" and identifier_name(tokens[j]) == "not":
+            j += 1
+        keyword = identifier_name(tokens[j]) if j < len(tokens) and tokens[j].kind == "identifier" else None
+        if keyword == "like":
+            if tokens[j + 1:j + 2] and tokens[j + 1].kind == "string":
+                yield column_type, tokens[j + 1]
+        elif keyword == "between":
+            bounds = tokens[j + 1:j + 4]
+            if len(bounds) == 3 and is_literal(bounds[0]) and identifier_name(bounds[1]) == "and" \
+                    and is_literal(bounds[2]):
+                yield column_type, bounds[0]
+                yield column_type, bounds[2]
+        elif keyword == "in" and tokens[j + 1:j + 2] and tokens[j + 1].text == "(":
+            items = []
+            for k in range(j + 2, len(tokens), 2):
+                if not is_literal(tokens[k]) or k + 1 >= len(tokens) or tokens[k + 1].text not in (",", ")"):
+                    items = []
+                    break
+                items.append(tokens[k])
+                if tokens[k + 1].text == ")":
+                    break
+            for item in items:
+                yield column_type, item
+
+def fix_sql_value_quoting(sql_query):
+    """
+    Unquote numbers compared with numeric columns (SalesQuantity = '5' -> SalesQuantity = 5,
+    IsActive = 'true' -> IsActive = 1) in one pass over the tokens. Other literals are kept as they are.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except SQLTokenizeError:
+        return sql_query
+    edits = []
+    for col_type, literal in _column_literals(tokens):
+        if col_type not in NUMERIC_TYPES or literal.kind != "string":
+            continue
+        value = string_value(literal)
+        if value.isdigit():
+            edits.append((literal.start, literal.end, value))
+        elif col_type == "bit" and value.lower() in ("true", "false"):
+            edits.append((literal.start, literal.end, "1" if value.lower() == "true" else "0"))
+    for start, end, text in reversed(edits):
+        sql_query = sql_query[:start] + text + sql_query[end:]
+    return sql_query
+
+def _parameter_value(literal, col_type):
+    """Python value of a literal compared with a column of col_type, or None to leave it inline."""
+    text = string_value(literal) if literal.kind == "string" else literal.text
+    try:
+        if col_type == "varchar":
+            return text if literal.kind == "string" else None
+        if col_type == "date":
+            return date.fromisoformat(text)
+        if col_type == "int":
+            return int(text)
+        if col_type == "decimal":
+            return Decimal(text)
+        if col_type == "bit":
+            return {"0": False, "1": True, "true": True, "false": False}.get(text.lower())
+    except (ValueError, InvalidOperation):
+        return None
+    return None
+
+def parameterize_sql(sql_query):
+    """
+    Move the literals compared with known columns into typed ? parameters, so that questions
+    differing only in their values share one cached plan on SQL Server and the values are
+    never parsed as SQL. Only WHERE conditions are parameterized; other literals (TOP, DATEADD
+    arguments, CASE expressions in the select list) stay inline.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except SQLTokenizeError:
+        return ParameterizedQuery(sql_query, [], [])
+    # Only WHERE clauses: a parameter in a grouped expression would no longer match its GROUP BY copy
+    in_where, filtering = set(), [False]
+    for token in tokens:
+        word = identifier_name(token) if token.kind == "identifier" else token.text
+        if word == "(":
+            filtering.append(filtering[-1])
+        elif word == ")" and len(filtering) > 1:
+            filtering.pop()
+        elif word == "where":
+            filtering[-1] = True
+        elif word in ("select", "group", "order", "having", "union"):
+            filtering[-1] = False
+        elif filtering[-1]:
+            in_where.add(token.start)
+    found = []
+    for col_type, literal in _column_literals(tokens):
+        if literal.start not in in_where:
+            continue
+        value = _parameter_value(literal, col_type)
+        if value is not None:
+            found.append((literal, value, col_type))
+    found.sort(key=lambda item: item[0].start)
+    parts, position = [], 0
+    for literal, _, _ in found:
+        parts.append(sql_query[position:literal.start])
+        parts.append("?")
+        position = literal.end
+    parts.append(sql_query[position:])
+    return ParameterizedQuery("".join(parts), [value for _, value, _ in found], [col_type for _, _, col_type in found])
+
+def validate_sql_query(sql_query):
+    # Check for placeholder or example values in the SQL query
+    placeholders = ['specific_salesofficeid', 'example_value', 'placeholder']
+    for ph in placeholders:
+        if ph.lower() in sql_query.lower():
+            return False, f"SQL query contains placeholder value: {ph}"
+    return True, ""
+
+def get_connection_string():
+    return (
+        f"DRIVER={{{DRIVER}}};"
+        f"SERVER={SERVER};"
+        f"DATABASE={DATABASE};"
+        f"UID={UID};"
+        f"PWD={PWD}"
+    )
+
+def connect_to_warehouse():
+    with span("connect"):
+        return pyodbc.connect(get_connection_string(), timeout=10)
+
+def get_warehouse_pool():
+    # One pool per process, shared by every Streamlit session and rerun
+    return get_pool("warehouse", connect_to_warehouse)
+
+def load_warehouse_watermark():
+    with get_warehouse_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(WATERMARK_SQL)
+        return cursor.fetchone()[0]
+
+def load_warehouse_rollup_watermark():
+    with get_warehouse_pool().connection() as conn:
+        return load_rollup_watermark(conn)
+
+def run_sql_query(sql_query, handle=None):
+    """
+    Run one statement under warehouse_admission and the QUERY_TIMEOUT_SECONDS statement timeout,
+    with its literals bound as parameters (see parameterize_sql).
+    handle.cancel() from another thread stops it while queued or on the server while it runs.
+    """
+    handle = handle or QueryHandle()
+    with span("parameterize"):
+        query = parameterize_sql(sql_query)
+        annotate(params=len(query.params))
+    with warehouse_admission.admit(handle), get_warehouse_pool().connection() as conn:
+        conn.timeout = QUERY_TIMEOUT_SECONDS
+        try:
+            with handle.bind(conn.cursor()) as cursor:
+                with span("query"):
+                    if query.params:
+                        cursor.setinputsizes([PARAMETER_INPUT_SIZES[col_type] for col_type in query.types])
+                    cursor.execute(query.sql, *query.params)
+                # Streamed in fetchmany batches into a DataFrame capped at MAX_RESULT_ROWS
+                with span("fetch"):
+                    frame = fetch_frame(cursor)
+                    annotate(rows=len(frame), truncated=frame.attrs.get("truncated", False))
+        except pyodbc.Error as e:
+            if handle.cancelled:
+                raise QueryCancelled("Query cancelled") from e
+            # HYT00: the statement timeout expired and the driver cancelled the query
+            if e.args and e.args[0] == "HYT00":
+                raise QueryTimeout(f"Query exceeded the {QUERY_TIMEOUT_SECONDS}s time limit") from e
+            raise
+        return frame
+
+def estimate_plan_cost(sql_query):
+    """The optimizer's estimated cost of a query (SET SHOWPLAN_XML), without running it."""
+    with get_warehouse_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            cursor.execute(sql_query)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute("SET SHOWPLAN_XML OFF")
+    costs = [float(cost) for cost in PLAN_COST_PATTERN.findall(plan)]
+    return max(costs) if costs else None
+
+# Concurrent identical queries (same cache key and watermark) share one warehouse execution.
+# A leader cancelled by its own session hands the query to one of its waiters.
+query_flight = SingleFlight("query", abandon_on=(QueryCancelled,))
+
+def execute_sql_query(sql_query, handle=None):
+    """
+    Run a query through the shared result cache; errors are raised to the caller.
+    handle (an admission.QueryHandle) lets the caller follow and cancel the warehouse query.
+    """
+    # Identical SQL is answered from the shared result cache until new data is loaded
+    with span("watermark"):
+        watermark = result_cache.watermark(load_warehouse_watermark)
+    with span("result_cache", cache="result_cache"):
+        results = result_cache.get(sql_query, watermark)
+        annotate(cache_hit=results is not None)
+    if results is None:
+        handle = handle or QueryHandle()
+        results, _ = query_flight.do(
+            (result_cache.key(sql_query), watermark), run_uncached_query, sql_query, watermark, handle,
+            check=handle.raise_if_cancelled,
+        )
+    return results
+
+def run_uncached_query(sql_query, watermark, handle):
+    """Run a query (on a rollup when eligible) and store its result in the result cache."""
+    # Eligible aggregates are answered from the daily rollups; the cache key stays the original SQL
+    routed_query = rollup_router.route(sql_query, watermark, load_warehouse_rollup_watermark)
+    if routed_query != sql_query:
+        annotate(rollup=True)
+    try:
+        results = run_sql_query(routed_query, handle)
+    except (QueryCancelled, QueryTimeout, WarehouseBusy):
+        # The base table would be slower still
+        raise
+    except Exception:
+        if routed_query == sql_query:
+            raise
+        rollup_router.record_fallback()
+        results = run_sql_query(sql_query, handle)
+    result_cache.put(sql_query, watermark, results)
+    return results
+
+def warm_up_connection():
+    """
+    Open (or validate) a pooled connection and refresh the watermark so the next query starts warm.
+    Also starts a background refresh of the dimension catalog when one is due.
+    """
+    with span("warm_up"):
+        pool = get_warehouse_pool()
+        with pool.connection():
+            pass
+        result_cache.watermark(load_warehouse_watermark)
+        dimension_catalog.refresh_in_background(pool.connection)